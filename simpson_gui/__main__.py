@@ -0,0 +1,47 @@
+"""
+Renders SIMPSON input files from JSON or YAML specs, without starting the GUI:
+
+    python -m simpson_gui specs.json -o inputs
+
+See core.render.expand_specs for the layout of a spec file.
+"""
+import argparse
+import sys
+import time
+
+from .core.render import expand_specs , load_document , render , write_inputs
+from .core.sequence import SEQUENCES
+
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser ( prog='python -m simpson_gui' ,
+                                       description='Render SIMPSON input files from JSON or YAML specs.' )
+    parser.add_argument ( 'specs' , nargs='*' , help='spec files' )
+    parser.add_argument ( '-o' , '--output' , default='.' , help='folder of the input files (default: .)' )
+    parser.add_argument ( '--stdout' , action='store_true' , help='print the inputs instead of writing them' )
+    parser.add_argument ( '--sequences' , action='store_true' , help='list the pulse sequences and exit' )
+    args = parser.parse_args ( argv )
+    if args.sequences :
+        print ( '\n'.join ( SEQUENCES ) )
+        return 0
+    if not args.specs :
+        parser.error ( 'no spec file given' )
+    start = time.perf_counter ()
+    paths = [ ]
+    try :
+        specs = [ spec for path in args.specs for spec in expand_specs ( load_document ( path ) ) ]
+        if args.stdout :
+            for spec in specs :
+                sys.stdout.write ( render ( spec ) )
+        else :
+            paths = write_inputs ( specs , args.output )
+    except (OSError , ValueError , TypeError) as error :
+        parser.exit ( 1 , f"{parser.prog}: error: {error}\n" )
+    if not args.stdout :
+        seconds = time.perf_counter () - start
+        print ( f"{len ( paths )} inputs written to {args.output} in {seconds:.2f} s" , file=sys.stderr )
+    return 0
+
+
+if __name__ == '__main__' :
+    sys.exit ( main () )
@@ -0,0 +1,7 @@
+"""
+Computational helpers shared by the SIMPSON GUI pages.
+
+The Streamlit pages import these modules as ``core.<module>`` (the directory of
+``Homepage.py`` is on the path when the app runs), and scripts as
+``simpson_gui.core.<module>``, so nothing in here may depend on Streamlit.
+"""
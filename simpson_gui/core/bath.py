@@ -0,0 +1,145 @@
+#%% Header files
+from dataclasses import dataclass
+
+import numpy as np
+
+from .dipolar import PLANCK , MU0_4PI , dipolar_constant , pairwise_dipolar , dipolar_table
+from .lazy import LazyImport
+
+pd = LazyImport ( 'pandas' )
+
+
+#%% Functions
+@dataclass
+class ReducedBath :
+    """
+    Spin system of a few centre atoms, the bath atoms kept as they are and effective spins
+    standing in for the rest of the bath. Spins are numbered from 1 in the order of ``atoms``.
+    """
+    atoms: list  # per spin, the 0-based structure atoms it stands for (one for real spins)
+    nuclei: list
+    coord_xyz: np.ndarray
+    table: 'pd.DataFrame'  # dipole table of the reduced system, as dipolar_table
+    second_moment: 'pd.DataFrame'  # per spin, see reduce_bath
+
+
+def _distance_of(coupling , gyr1 , gyr2) :
+    """
+    Distance in Angstrom at which two nuclei are coupled by |coupling| Hz, inverse of dipolar_constant.
+    """
+    return (MU0_4PI * PLANCK * abs ( gyr1 * gyr2 ) * 1e12 / abs ( coupling )) ** (1.0 / 3.0) * 1e10
+
+
+def _shells(strength , count) :
+    """
+    Splits atoms sorted by decreasing strength into at most ``count`` consecutive groups
+    carrying equal shares of the summed squared strength.
+    :return: list of index arrays into strength
+    """
+    share = np.cumsum ( strength ** 2 ) / np.sum ( strength ** 2 )
+    group = np.minimum ( (share * count - 1e-9).astype ( int ) , count - 1 )
+    return [ np.flatnonzero ( group == g ) for g in range ( count ) if np.any ( group == g ) ]
+
+
+def _principal_direction(vectors , weights) :
+    """
+    Axis of the weighted average orientation of a set of internuclear vectors, the main
+    eigenvector of sum w u u^T; a dipolar tensor does not tell u from -u.
+    """
+    units = vectors / np.linalg.norm ( vectors , axis=1 , keepdims=True )
+    _ , axes = np.linalg.eigh ( np.einsum ( 'k,ki,kj->ij' , weights , units , units ) )
+    axis = axes[ : , -1 ]
+    # keep the side of the bath, so that the effective spin sits among the atoms it replaces
+    return axis if np.dot ( weights , units @ axis ) >= 0 else -axis
+
+
+def reduce_bath(coord_xyz , nuclei , gyr_atom , centres , bath='1H' , explicit=1 , effective=3 , radius=None) :
+    """
+    Reduces a large bath of one nucleus around one or more centre atoms, e.g. the protons around a 13C,
+    to a few spins. The ``explicit`` bath atoms most strongly coupled to the centres are kept. The
+    others, by decreasing coupling, are split into ``effective`` shells of equal second moment, each
+    becoming one spin. The coupling between two spins is the root-sum-square of the couplings between
+    the atoms they stand for, so that the second moment sum D^2 of every centre and explicit atom is
+    kept; only the couplings inside a shell are lost. An effective spin is placed along the D^2-weighted
+    average orientation of its atoms seen from the first centre, at the distance of its coupling to it,
+    which sets the Euler angles of its couplings.
+    :param coord_xyz: (N, 3) coordinates in Angstrom
+    :param nuclei: list of N nucleus names (1H, 13C, ...)
+    :param gyr_atom: (N,) gyromagnetic ratios in MHz/T
+    :param centres: 0-based index or list of indices of the centre atoms, kept as they are
+    :param bath: nucleus of the bath
+    :param explicit: number of bath atoms kept as they are
+    :param effective: number of effective spins for the rest of the bath
+    :param radius: only bath atoms within it (Angstrom) of a centre count, all by default
+    :return: ReducedBath; its second moment table has per spin the number of atoms it stands for, their
+             root-sum-square coupling to the centres and the whole bath of the structure ('full', Hz), the
+             same in the reduced system ('reduced', Hz) and the fraction of the second moment retained
+    """
+    coord_xyz = np.asarray ( coord_xyz , dtype=float )
+    gyr_atom = np.asarray ( gyr_atom , dtype=float )
+    nuclei = list ( nuclei )
+    centres = [ int ( c ) for c in np.atleast_1d ( centres ) ]
+    if not centres :
+        raise ValueError ( "Pick at least one centre atom" )
+    if explicit < 0 or effective < 0 :
+        raise ValueError ( "The numbers of explicit and effective spins cannot be negative" )
+
+    everything = np.array ( [ k for k , name in enumerate ( nuclei ) if name == bath and k not in centres ] , dtype=np.intp )
+    offsets = coord_xyz[ everything ][ None , : , : ] - coord_xyz[ centres ][ : , None , : ]
+    dist = np.linalg.norm ( offsets , axis=2 )
+    candidates = everything
+    if radius is not None :
+        keep = np.any ( dist <= radius , axis=0 )
+        candidates , offsets , dist = candidates[ keep ] , offsets[ : , keep ] , dist[ : , keep ]
+    if len ( candidates ) == 0 :
+        raise ValueError ( f"No {bath} atoms around the centres" )
+    dip = dipolar_constant ( dist , gyr_atom[ centres ][ : , None ] , gyr_atom[ candidates ][ None , : ] )
+    order = np.argsort ( -np.sum ( dip ** 2 , axis=0 ) , kind='stable' )
+    candidates , offsets , dip = candidates[ order ] , offsets[ : , order ] , dip[ : , order ]
+
+    explicit = min ( explicit , len ( candidates ) )
+    atoms = [ [ c ] for c in centres ] + [ [ k ] for k in candidates[ :explicit ] ]
+    positions = [ coord_xyz[ k ] for k in centres + candidates[ :explicit ].tolist () ]
+    rest = slice ( explicit , None )
+    if effective and len ( candidates[ rest ] ) :
+        reference = centres[ 0 ]
+        for shell in _shells ( np.abs ( dip[ 0 , rest ] ) , effective ) :
+            members = candidates[ rest ][ shell ]
+            squared = dip[ 0 , rest ][ shell ] ** 2
+            distance = _distance_of ( np.sqrt ( np.sum ( squared ) ) , gyr_atom[ reference ] , gyr_atom[ members[ 0 ] ] )
+            atoms.append ( members.tolist () )
+            positions.append ( coord_xyz[ reference ] + distance * _principal_direction ( offsets[ 0 , rest ][ shell ] , squared ) )
+    spin_nuclei = [ nuclei[ group[ 0 ] ] for group in atoms ]
+
+    # couplings between all the atoms represented, summed in squares over the atoms of each spin
+    members = np.concatenate ( [ np.asarray ( group , dtype=np.intp ) for group in atoms ] )
+    spin_of = np.repeat ( np.arange ( len ( atoms ) ) , [ len ( group ) for group in atoms ] )
+    pair_i , pair_j = np.triu_indices ( len ( members ) , k=1 )
+    between = spin_of[ pair_i ] != spin_of[ pair_j ]
+    pair_i , pair_j = pair_i[ between ] , pair_j[ between ]
+    atom_dip = dipolar_constant ( np.linalg.norm ( coord_xyz[ members[ pair_j ] ] - coord_xyz[ members[ pair_i ] ] , axis=1 ) ,
+                                  gyr_atom[ members[ pair_i ] ] , gyr_atom[ members[ pair_j ] ] )
+    squared = np.zeros ( (len ( atoms ) , len ( atoms )) )
+    signed = np.zeros ( (len ( atoms ) , len ( atoms )) )
+    np.add.at ( squared , (spin_of[ pair_i ] , spin_of[ pair_j ]) , atom_dip ** 2 )
+    np.add.at ( signed , (spin_of[ pair_i ] , spin_of[ pair_j ]) , atom_dip )
+    squared , signed = squared + squared.T , signed + signed.T
+
+    pair_data = pairwise_dipolar ( np.array ( positions ) , gyr_atom[ [ group[ 0 ] for group in atoms ] ] )
+    pair_data[ 'dip' ] = np.sign ( signed[ pair_data[ 'i' ] , pair_data[ 'j' ] ] ) * np.sqrt ( squared[ pair_data[ 'i' ] , pair_data[ 'j' ] ] )
+
+    partners = np.array ( centres + everything.tolist () , dtype=np.intp )
+    rows = [ ]
+    for spin , group in enumerate ( atoms ) :
+        full = 0.0
+        for atom in group :
+            others = partners[ partners != atom ]
+            full += np.sum ( dipolar_constant ( np.linalg.norm ( coord_xyz[ others ] - coord_xyz[ atom ] , axis=1 ) ,
+                                                gyr_atom[ atom ] , gyr_atom[ others ] ) ** 2 )
+        reduced = np.sum ( squared[ spin ] )
+        rows.append ( { 'spin' : spin + 1 , 'nucleus' : spin_nuclei[ spin ] ,
+                        'atoms' : ' '.join ( str ( atom + 1 ) for atom in group ) ,
+                        'full' : np.sqrt ( full ) , 'reduced' : np.sqrt ( reduced ) ,
+                        'retained' : reduced / full if full > 0 else 1.0 } )
+    return ReducedBath ( atoms=atoms , nuclei=spin_nuclei , coord_xyz=np.array ( positions ) ,
+                         table=dipolar_table ( pair_data ) , second_moment=pd.DataFrame ( rows ) )
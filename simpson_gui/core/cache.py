@@ -0,0 +1,182 @@
+#%% Header files
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from functools import lru_cache
+
+from .par import strip_comment
+
+CACHE_DIRECTORY = os.environ.get ( 'SIMPSON_GUI_CACHE' ,
+                                   os.path.join ( os.path.expanduser ( '~' ) , '.cache' , 'simpson_gui' , 'results' ) )
+CACHE_MAX_BYTES = int ( float ( os.environ.get ( 'SIMPSON_GUI_CACHE_BYTES' , 2e9 ) ) )
+VERSION_PATTERN = re.compile ( r'SIMPSON\s+version\s+([\w.\-]+)' , flags=re.I )
+
+
+#%% Functions
+def _collapse_whitespace(line) :
+    """
+    Words of a line joined by single spaces. The whitespace inside "..." and {...} words is part of
+    their value and kept; a brace left open keeps the rest of the line but its trailing whitespace.
+    """
+    words , word , depth , quoted , escaped = [ ] , [ ] , 0 , False , False
+    for char in line :
+        if escaped :
+            escaped = False
+        elif char == '\\' :
+            escaped = True
+        elif quoted :
+            quoted = char != '"'
+        elif char == '"' and not depth :
+            quoted = True
+        elif char == '{' :
+            depth += 1
+        elif char == '}' and depth :
+            depth -= 1
+        elif char.isspace () and not depth :
+            if word :
+                words.append ( ''.join ( word ) )
+                word = [ ]
+            continue
+        word.append ( char )
+    if word :
+        words.append ( ''.join ( word ).rstrip () )
+    return ' '.join ( words )
+
+
+def canonical_input(text) :
+    """
+    SIMPSON input with comments removed, whitespace between words collapsed and the par entries
+    sorted, so that inputs differing only in layout give the same text.
+    """
+    lines = [ _collapse_whitespace ( strip_comment ( line ) ) for line in text.splitlines () ]
+    text = '\n'.join ( line for line in lines if line )
+
+    def sort_par(match) :
+        entries = { }
+        for line in match.group ( 2 ).splitlines () :
+            parts = line.split ( None , 1 )
+            if parts :
+                entries[ parts[ 0 ] ] = line
+        return match.group ( 1 ) + '\n'.join ( entries[ key ] for key in sorted ( entries ) ) + '\n}'
+
+    return re.sub ( r'(\bpar\s*\{\s*)(.*?)\s*\}' , sort_par , text , flags=re.S )
+
+
+def _binary_digest(path) :
+    digest = hashlib.sha256 ()
+    with open ( path , 'rb' ) as handle :
+        for chunk in iter ( lambda : handle.read ( 1 << 20 ) , b'' ) :
+            digest.update ( chunk )
+    return digest.hexdigest ()
+
+
+@lru_cache ( maxsize=16 )
+def _version(path , mtime , size) :
+    try :
+        output = subprocess.run ( [ path , '-v' ] , capture_output=True , timeout=10 , stdin=subprocess.DEVNULL )
+        match = VERSION_PATTERN.search ( (output.stdout + output.stderr).decode ( errors='replace' ) )
+    except (OSError , subprocess.SubprocessError) :
+        match = None
+    return match.group ( 1 ) if match else f"sha256:{_binary_digest ( path )}"
+
+
+def simpson_version(path) :
+    """
+    Version reported by a SIMPSON executable, or the digest of the binary if it does not print one.
+    Asked once per executable and modification time.
+    """
+    status = os.stat ( path )
+    return _version ( path , status.st_mtime , status.st_size )
+
+
+def cache_key(text , version , files=None) :
+    """
+    Hex digest of the canonical input and the SIMPSON version.
+    :param files: dict file name -> content of the other files the input reads, e.g. a crystal file
+    """
+    digest = hashlib.sha256 ( f"{version}\n{canonical_input ( text )}".encode () )
+    for name in sorted ( files or { } ) :
+        content = files[ name ]
+        digest.update ( f"\n{name}\n".encode () + (content if isinstance ( content , bytes ) else content.encode ()) )
+    return digest.hexdigest ()
+
+
+class ResultCache :
+    """
+    Output files of SIMPSON runs on disk, one folder per key. Reading an entry marks it as
+    recently used; when the cache grows above max_bytes the least recently used entries go first.
+    """
+
+    def __init__(self , directory=CACHE_DIRECTORY , max_bytes=CACHE_MAX_BYTES) :
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock ()
+        os.makedirs ( directory , exist_ok=True )
+
+    def _path(self , key) :
+        return os.path.join ( self.directory , key[ :2 ] , key )
+
+    def get(self , key) :
+        """
+        :return: dict file name -> content, or None on a miss
+        """
+        path = self._path ( key )
+        try :
+            with open ( os.path.join ( path , 'meta.json' ) ) as handle :
+                files = json.load ( handle )[ 'files' ]
+            outputs = { }
+            for name in files :
+                with open ( os.path.join ( path , 'files' , name ) , 'rb' ) as handle :
+                    outputs[ name ] = handle.read ()
+        except (OSError , ValueError , KeyError) :
+            return None
+        os.utime ( path )
+        return outputs
+
+    def put(self , key , outputs , **meta) :
+        """
+        Stores the output files of one run, then evicts old entries if needed.
+        """
+        path = self._path ( key )
+        staging = f"{path}.{os.getpid ()}.{threading.get_ident ()}.tmp"
+        os.makedirs ( os.path.join ( staging , 'files' ) , exist_ok=True )
+        for name , content in outputs.items () :
+            with open ( os.path.join ( staging , 'files' , os.path.basename ( name ) ) , 'wb' ) as handle :
+                handle.write ( content )
+        with open ( os.path.join ( staging , 'meta.json' ) , 'w' ) as handle :
+            json.dump ( dict ( meta , files=[ os.path.basename ( name ) for name in outputs ] , stored=time.time () ) ,
+                        handle )
+        with self._lock :
+            if os.path.exists ( path ) :
+                shutil.rmtree ( staging , ignore_errors=True )
+            else :
+                os.replace ( staging , path )
+            self.evict ()
+
+    def entries(self) :
+        """
+        :return: list of (last use, size in bytes, path), oldest first
+        """
+        entries = [ ]
+        for prefix in os.scandir ( self.directory ) :
+            if not prefix.is_dir () :
+                continue
+            for entry in os.scandir ( prefix.path ) :
+                if entry.is_dir () and not entry.name.endswith ( '.tmp' ) :
+                    size = sum ( f.stat ().st_size for f in os.scandir ( os.path.join ( entry.path , 'files' ) ) )
+                    entries.append ( (entry.stat ().st_mtime , size , entry.path) )
+        return sorted ( entries )
+
+    def evict(self) :
+        entries = self.entries ()
+        total = sum ( size for _ , size , _ in entries )
+        for _ , size , path in entries :
+            if total <= self.max_bytes :
+                break
+            shutil.rmtree ( path , ignore_errors=True )
+            total -= size
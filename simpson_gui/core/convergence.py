@@ -0,0 +1,106 @@
+#%% Header files
+import numpy as np
+
+from .lazy import LazyImport
+from .powder import zcw_angles
+from .spinsys import to_hz
+
+Rot = LazyImport ( 'scipy.spatial.transform' , 'Rotation' )
+
+# zcw121392 from the exact Fibonacci sequence, far denser than any offered set
+REFERENCE_SIZE = 121392
+
+
+#%% Functions
+def tensors_from_spinsys(spin_system , proton_frequency , nuclei) :
+    """
+    Anisotropic interactions of a spin system as Cartesian tensors in the crystal frame,
+    in Hz. Chemical shifts give one line, dipoles and J couplings a doublet.
+    :param spin_system: SpinSystem from core.spinsys.parse_spinsys
+    :param proton_frequency: 1H Larmor frequency in Hz, for values given in ppm
+    :param nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    :return: list of (isotropic value, (3, 3) tensor, doublet)
+    """
+    tensors = [ ]
+    for interaction in spin_system.interactions :
+        kind = interaction[ 'type' ]
+        if kind == 'quadrupole' :
+            continue
+        nucleus = spin_system.nuclei[ interaction[ 'i' ] - 1 ]
+        aniso = to_hz ( interaction[ 'aniso' ] , nucleus , proton_frequency , nuclei )
+        iso = to_hz ( interaction.get ( 'iso' , 0.0 ) , nucleus , proton_frequency , nuclei )
+        eta = float ( interaction.get ( 'eta' , 0.0 ) )
+        if aniso == 0.0 and iso == 0.0 :
+            continue
+        pas = np.diag ( [ -0.5 * aniso * (1 + eta) , -0.5 * aniso * (1 - eta) , aniso ] )
+        rotation = Rot.from_euler ( 'zyz' , [ interaction[ 'alpha' ] , interaction[ 'beta' ] , interaction[ 'gamma' ] ] ,
+                                    degrees=True ).as_matrix ()
+        tensors.append ( (iso , rotation @ pas @ rotation.T , kind != 'shift') )
+    return tensors
+
+
+def static_pattern(tensors , alpha , beta , weights , edges) :
+    """
+    First-order static powder pattern, one histogram over all crystallites.
+    :param tensors: list from tensors_from_spinsys
+    :param alpha , beta: powder angles in degrees (azimuth and polar angle of the field in the crystal frame)
+    :param weights: crystallite weights
+    :param edges: frequency bin edges in Hz
+    :return: histogram normalised to unit sum
+    """
+    alpha , beta = np.radians ( alpha ) , np.radians ( beta )
+    field = np.column_stack ( (np.sin ( beta ) * np.cos ( alpha ) , np.sin ( beta ) * np.sin ( alpha ) , np.cos ( beta )) )
+    spectrum = np.zeros ( len ( edges ) - 1 )
+    for iso , tensor , doublet in tensors :
+        freq = iso + np.einsum ( 'ki,ij,kj->k' , field , tensor , field )
+        spectrum += np.histogram ( freq , bins=edges , weights=weights )[ 0 ]
+        if doublet :
+            spectrum += np.histogram ( -freq , bins=edges , weights=weights )[ 0 ]
+    return spectrum / max ( spectrum.sum () , 1e-300 )
+
+
+def _broaden(spectrum , width_bins) :
+    """
+    Gaussian line broadening by convolution, width in bins (FWHM).
+    """
+    sigma = width_bins / 2.3548
+    half = int ( np.ceil ( 4 * sigma ) )
+    kernel = np.exp ( -0.5 * (np.arange ( -half , half + 1 ) / sigma) ** 2 )
+    return np.convolve ( spectrum , kernel / kernel.sum () , mode='same' )
+
+
+def powder_convergence(tensors , schemes , num_bins=512 , broadening=0.01 , reference=None) :
+    """
+    Compares the static powder pattern of every scheme with a dense ZCW reference.
+    :param tensors: list from tensors_from_spinsys
+    :param schemes: dict name -> (alpha, beta, weights)
+    :param num_bins: number of frequency bins
+    :param broadening: Gaussian FWHM as a fraction of the spectral range
+    :param reference: optional (alpha, beta, weights) of the reference set
+    :return: list of (name, number of orientations, relative RMS error) sorted by orientation count
+    """
+    if not tensors :
+        raise ValueError ( "The spin system has no anisotropic interaction" )
+    ref_alpha , ref_beta , ref_weights = reference if reference is not None else zcw_angles ( REFERENCE_SIZE )
+
+    extent = max ( abs ( iso ) + 1.5 * np.abs ( np.linalg.eigvalsh ( tensor ) ).max () for iso , tensor , _ in tensors )
+    edges = np.linspace ( -extent , extent , num_bins + 1 ) * 1.05
+    width = broadening * num_bins
+    ref_spectrum = _broaden ( static_pattern ( tensors , ref_alpha , ref_beta , ref_weights , edges ) , width )
+    norm = np.linalg.norm ( ref_spectrum )
+
+    results = [ ]
+    for name , (alpha , beta , weights) in schemes.items () :
+        spectrum = _broaden ( static_pattern ( tensors , alpha , beta , weights , edges ) , width )
+        results.append ( (name , len ( alpha ) , float ( np.linalg.norm ( spectrum - ref_spectrum ) / norm )) )
+    return sorted ( results , key=lambda row : (row[ 1 ] , row[ 2 ]) )
+
+
+def recommend_scheme(results , tolerance) :
+    """
+    Cheapest scheme whose error is within tolerance.
+    :param results: output of powder_convergence
+    :return: (name, number of orientations, error), or None if no scheme is good enough
+    """
+    adequate = [ row for row in results if row[ 2 ] <= tolerance ]
+    return min ( adequate , key=lambda row : (row[ 1 ] , row[ 2 ]) ) if adequate else None
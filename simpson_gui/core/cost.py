@@ -0,0 +1,325 @@
+#%% Header files
+import math
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+from .par import par_number , parse_par , strip_comment
+from .powder import crystal_file_angles
+from .propagators import DOMAIN_METHODS , PROPAGATOR_METHODS , benchmark , time_call
+from .spinsys import parse_spinsys
+
+# Matrix sizes timed by calibrate, beyond the largest the cost grows as N^3
+CALIBRATION_SIZES = ( 4 , 8 , 16 , 32 , 64 , 128 )
+# Commands of the pulseq that need a propagator of their own
+TIMED_EVENTS = ( 'pulse' , 'pulseid' , 'delay' )
+
+
+@dataclass
+class InputFeatures :
+    """
+    What the cost of a SIMPSON input depends on. Counts of the pulseq are per orientation,
+    with the loops expanded when their bounds can be evaluated.
+    """
+    dimension: int
+    crystallites: int
+    gamma_angles: int
+    n_points: int
+    spin_rate: float
+    maxdt: float
+    methods: list
+    events: int
+    propagators: int
+    block_propagators: int
+    multiplications: int
+    acquisitions: int
+    stores: int
+    unknown_loops: int
+
+    @property
+    def orientations(self) :
+        return self.crystallites * (self.gamma_angles if self.spin_rate else 1)
+
+    def selected(self) :
+        """
+        (domain, propagator algorithm) chosen by the method entry, with SIMPSON's defaults.
+        """
+        domain = next ( ( m for m in self.methods if m in DOMAIN_METHODS ) , 'direct' )
+        algorithm = next ( ( m for m in self.methods if m in PROPAGATOR_METHODS ) , 'dysev' )
+        return domain , algorithm
+
+
+#%% Functions
+def proc_body(text , name='pulseq') :
+    """
+    Body of a Tcl procedure of a SIMPSON input, or None if there is none.
+    """
+    match = re.search ( rf'\bproc\s+{name}\s*\{{[^}}]*\}}\s*\{{' , text )
+    if match is None :
+        return None
+    depth , position = 1 , match.end ()
+    while position < len ( text ) and depth :
+        depth += { '{' : 1 , '}' : -1 }.get ( text[ position ] , 0 )
+        position += 1
+    return text[ match.end () :position - 1 ]
+
+
+def _tcl_number(expression , scope) :
+    """
+    Value of a Tcl expression of numbers, $par(...) and variables set to numbers, or None.
+    """
+    expression = re.sub ( r'\$(?!par\()(\w+)' , r'\1' , expression.strip () )
+    try :
+        return par_number ( dict ( scope , _value=expression ) , '_value' )
+    except (KeyError , ValueError , ZeroDivisionError , TypeError , RecursionError) :
+        return None
+
+
+def _tcl_words(line) :
+    """
+    Words of a Tcl command, keeping [...] and {...} groups whole.
+    """
+    words , word , depth = [ ] , '' , 0
+    for character in line :
+        if character.isspace () and depth == 0 :
+            if word :
+                words.append ( word )
+            word = ''
+            continue
+        depth += (character in '[{') - (character in ']}')
+        word += character
+    return words + ([ word ] if word else [ ])
+
+
+def _loop_count(line , scope , lists) :
+    """
+    Number of passes of a for or foreach loop opened on this line, None if it cannot be
+    evaluated, 0 if the line opens no loop.
+    :return: (count, loop variable)
+    """
+    match = re.match ( r'for\s*\{\s*set\s+(\w+)\s+([^}]+)\}\s*\{\s*\$\w+\s*(<=|<)\s*([^}]+)\}' , line )
+    if match :
+        first , last = _tcl_number ( match.group ( 2 ) , scope ) , _tcl_number ( match.group ( 4 ) , scope )
+        if first is None or last is None :
+            return None , match.group ( 1 )
+        return max ( int ( math.floor ( last - first + 1e-9 ) ) + (match.group ( 3 ) == '<=') , 0 ) , match.group ( 1 )
+    match = re.match ( r'foreach\s+(\w+)\s+(?:\[list\s+([^\]]*)\]|\$(\w+)|\{([^}]*)\})' , line )
+    if match :
+        items = match.group ( 2 ) or match.group ( 4 ) or lists.get ( match.group ( 3 ) )
+        return (len ( items.split () ) if items is not None else None) , match.group ( 1 )
+    return 0 , None
+
+
+def _tcl_scope(lines , par) :
+    """
+    Variables of a pulseq: the par entries and every set, list variables apart.
+    :return: (dict name -> expression, dict name -> list items, names that change from one pass of a loop to the next)
+    """
+    scope = { key : re.sub ( r'\$(?!par\()(\w+)' , r'\1' , value ) for key , value in par.items () }
+    lists = { }
+    looped , depth = set () , 0
+    for line in lines :
+        match = re.match ( r'set\s+(\w+)\s+(.+)$' , line )
+        loop = re.match ( r'(?:for\s*\{\s*set|foreach)\s+(\w+)' , line )
+        if loop or (match and depth > 0) :
+            looped.add ( (loop or match).group ( 1 ) )
+        depth += line.count ( '{' ) - line.count ( '}' )
+        if match :
+            value = match.group ( 2 ).strip ()
+            listed = re.fullmatch ( r'\[list\s+([^\]]*)\]' , value )
+            if listed :
+                lists[ match.group ( 1 ) ] = listed.group ( 1 )
+            else :
+                scope[ match.group ( 1 ) ] = re.sub ( r'\$(?!par\()(\w+)' , r'\1' , value )
+    return scope , lists , looped
+
+
+def rf_amplitude(body , par) :
+    """
+    Strongest rf field of the pulse commands of a pulseq (pulse duration rf phase [rf phase ...]),
+    in Hz, among the amplitudes that can be evaluated; 0 if there is none.
+    """
+    lines = [ strip_comment ( line ).strip () for line in body.splitlines () ]
+    scope , _ , _ = _tcl_scope ( lines , par )
+    amplitudes = [ 0.0 ]
+    for line in lines :
+        words = _tcl_words ( line )
+        if words and words[ 0 ] == 'pulse' :
+            amplitudes.extend ( abs ( value ) for value in ( _tcl_number ( word , scope ) for word in words[ 2 ::2 ] )
+                                if value is not None )
+    return max ( amplitudes )
+
+
+def pulseq_counts(body , par) :
+    """
+    Events of a pulseq with the loops expanded: propagating events (pulse, pulseid, delay),
+    propagators to compute, products with stored propagators and acquisitions. Under MAS every
+    event is computed again, in steps of maxdt, as the rotor has moved; static, an event in a
+    loop is computed once unless it depends on the loop.
+    acq_block runs its content once per point; its propagators are also counted as 'block_propagators'.
+    :return: dict of counts, with 'unknown_loops' for loops taken as one pass
+    """
+    lines = [ strip_comment ( line ).strip () for line in body.splitlines () ]
+    scope , lists , looped = _tcl_scope ( lines , par )
+    spin_rate = _tcl_number ( par.get ( 'spin_rate' , '0' ) , scope ) or 0.0
+    maxdt = next ( ( _tcl_number ( line.split ()[ 1 ] , scope ) for line in lines
+                     if line.startswith ( 'maxdt ' ) ) , None ) or 1.0
+
+    counts = { 'events' : 0 , 'propagators' : 0 , 'block_propagators' : 0 , 'multiplications' : 0 ,
+               'acquisitions' : 0 , 'stores' : set () , 'unknown_loops' : 0 , 'maxdt' : maxdt }
+    # frames of the enclosing loops: (brace depth inside the loop, passes, acq_block or not)
+    frames , depth = [ ] , 0
+    for line in lines :
+        if not line :
+            continue
+        passes , _ = _loop_count ( line , scope , lists )
+        block = line.startswith ( 'acq_block' )
+        if block :
+            passes = int ( _tcl_number ( 'np' , scope ) or 1 )
+        if passes is None :
+            counts[ 'unknown_loops' ] += 1
+            passes = 1
+        words = _tcl_words ( line )
+        multiplier = math.prod ( frame[ 1 ] for frame in frames )
+        if words[ 0 ] in TIMED_EVENTS :
+            counts[ 'events' ] += multiplier
+            duration = _tcl_number ( words[ 1 ] , scope ) if len ( words ) > 1 else None
+            if spin_rate :
+                propagators = multiplier * (max ( math.ceil ( duration / maxdt - 1e-9 ) , 1 ) if duration else 1)
+            else :
+                dependent = any ( re.search ( rf'\${name}\b' , line ) for name in looped )
+                propagators = multiplier if dependent else 1
+            counts[ 'propagators' ] += propagators
+            if any ( frame[ 2 ] for frame in frames ) :
+                counts[ 'block_propagators' ] += propagators
+        elif words[ 0 ] == 'prop' :
+            counts[ 'multiplications' ] += multiplier
+        elif words[ 0 ] == 'acq' :
+            counts[ 'acquisitions' ] += multiplier
+        elif words[ 0 ] == 'store' and len ( words ) > 1 :
+            counts[ 'stores' ].add ( words[ 1 ] )
+        depth += line.count ( '{' ) - line.count ( '}' )
+        if passes :
+            frames.append ( (depth , passes , block) )
+        while frames and depth < frames[ -1 ][ 0 ] :
+            frames.pop ()
+    counts[ 'stores' ] = len ( counts[ 'stores' ] )
+    return counts
+
+
+def crystallite_count(name) :
+    """
+    Number of orientations of a crystal file, from the file itself when it can be generated
+    here or from the digits of its name (LEBoct31, repoct41).
+    """
+    try :
+        return len ( crystal_file_angles ( name )[ 0 ] )
+    except ValueError :
+        digits = re.search ( r'(\d+)$' , name )
+        return int ( digits.group ( 1 ) ) if digits else 1
+
+
+def input_features(text , nuclei) :
+    """
+    :param text: full SIMPSON input
+    :param nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    :return: InputFeatures
+    :raises ValueError: when the input has no spin in its spinsys or no pulseq procedure
+    """
+    spin_system = parse_spinsys ( text )
+    if not spin_system.nuclei :
+        raise ValueError ( "The spinsys block has no nuclei" )
+    body = proc_body ( text )
+    if body is None :
+        raise ValueError ( "The input has no proc pulseq" )
+    dimension = math.prod ( int ( round ( 2 * nuclei.spin ( name ) + 1 ) ) if name in nuclei else 2
+                            for name in spin_system.nuclei )
+    par = parse_par ( text )
+    counts = pulseq_counts ( body , par )
+    spin_rate = par_number ( par , 'spin_rate' , 0 )
+    return InputFeatures ( dimension=dimension ,
+                           crystallites=crystallite_count ( par.get ( 'crystal_file' , 'alpha0beta0' ).split ()[ 0 ] ) ,
+                           gamma_angles=max ( int ( par_number ( par , 'gamma_angles' , 1 ) ) , 1 ) ,
+                           n_points=max ( int ( par_number ( par , 'np' , 1 ) ) , 1 ) , spin_rate=spin_rate ,
+                           maxdt=counts[ 'maxdt' ] , methods=par.get ( 'method' , '' ).split () ,
+                           events=counts[ 'events' ] , propagators=counts[ 'propagators' ] ,
+                           block_propagators=counts[ 'block_propagators' ] ,
+                           multiplications=counts[ 'multiplications' ] , acquisitions=counts[ 'acquisitions' ] ,
+                           stores=counts[ 'stores' ] , unknown_loops=counts[ 'unknown_loops' ] )
+
+
+@lru_cache ( maxsize=4 )
+def calibrate(sizes=CALIBRATION_SIZES , repeats=3) :
+    """
+    Times on this machine of one propagator of every algorithm of PROPAGATOR_METHODS (cheby2
+    applied to a density matrix) and of one matrix product, for random Hamiltonians of a few
+    tens of kHz and a step of 1 µs. Measured once per process.
+    :return: dict name -> (sizes, seconds) arrays, with 'multiply' for the product
+    """
+    rng = np.random.default_rng ( 0 )
+    timings = { name : [ ] for name in PROPAGATOR_METHODS + ('multiply' ,) }
+    for n in sizes :
+        a = rng.normal ( size=(n , n) ) + 1j * rng.normal ( size=(n , n) )
+        h = (a + a.conj ().T) * 1e4 / np.sqrt ( n )
+        for result in benchmark ( h , 1e-6 , repeats ) :
+            timings[ result[ 'method' ] ].append ( result[ 'seconds' ] )
+        timings[ 'multiply' ].append ( time_call ( lambda : h @ h , repeats ) )
+    return { name : (np.array ( sizes , dtype=float ) , np.array ( seconds )) for name , seconds in timings.items () }
+
+
+def operation_time(calibration , name , n) :
+    """
+    Time of one operation on N x N matrices, interpolated in log-log between the calibrated
+    sizes and grown as N^3 beyond them.
+    """
+    sizes , seconds = calibration[ name ]
+    if n >= sizes[ -1 ] :
+        return float ( seconds[ -1 ] * (n / sizes[ -1 ]) ** 3 )
+    return float ( np.exp ( np.interp ( np.log ( max ( n , sizes[ 0 ] ) ) , np.log ( sizes ) , np.log ( seconds ) ) ) )
+
+
+def estimate_cost(features , calibration) :
+    """
+    Predicted run time and memory of one SIMPSON process for every method combination.
+    direct computes every propagator for each crystallite and gamma angle; gcompute and freq
+    compute the acquisition over one rotor period per crystallite and share it between the gamma
+    angles (freq also diagonalises the period propagator). These are estimates from NumPy timings:
+    SIMPSON's own code is usually faster for small matrices, the scaling is what matters.
+    :return: list of dicts with domain, method, seconds, bytes, sorted by time
+    """
+    n = features.dimension
+    multiply = operation_time ( calibration , 'multiply' , n )
+    period_steps = math.ceil ( 1e6 / features.spin_rate / features.maxdt ) if features.spin_rate else 0
+    # the Hamiltonian pieces, the density matrix and a few work matrices are held besides the stored propagators
+    held = features.stores + 8
+    rows = [ ]
+    for domain in DOMAIN_METHODS :
+        for method in PROPAGATOR_METHODS :
+            step = operation_time ( calibration , method , n )
+            products = features.events + features.multiplications + features.acquisitions
+            if domain == 'direct' or not features.spin_rate :
+                seconds = features.orientations * (features.propagators * step + products * multiply)
+                matrices = held
+            else :
+                # the acq_block is only computed over one rotor period
+                per_crystallite = (features.propagators - features.block_propagators +
+                                   max ( period_steps , features.gamma_angles )) * step + \
+                                  (products + 2 * features.gamma_angles) * multiply
+                if domain == 'freq' :
+                    per_crystallite += operation_time ( calibration , 'dysev' , n )
+                detection = features.gamma_angles * features.n_points * multiply / n
+                seconds = features.crystallites * (per_crystallite + detection)
+                matrices = held + features.gamma_angles
+            rows.append ( { 'domain' : domain , 'method' : method , 'seconds' : seconds ,
+                            'bytes' : 16 * (n * n * matrices + features.n_points * features.gamma_angles) } )
+    return sorted ( rows , key=lambda row : row[ 'seconds' ] )
+
+
+def selected_cost(features , rows) :
+    """
+    Row of estimate_cost for the method entry of the input.
+    """
+    domain , method = features.selected ()
+    return next ( row for row in rows if row[ 'domain' ] == domain and row[ 'method' ] == method )
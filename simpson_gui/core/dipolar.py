@@ -0,0 +1,197 @@
+#%% Header files
+import numpy as np
+
+from .lazy import LazyImport
+
+pd = LazyImport ( 'pandas' )
+
+PLANCK = 6.62607015e-34  # Planck's constant in J s
+MU0_4PI = 1.0e-7  # mu_0 / 4 pi in T^2 m^3 / J
+
+# Number of pairs converted to angles in one go, small enough for the temporaries to stay in cache
+_CHUNK_PAIRS = 1 << 16
+
+DIPOLAR_COLUMNS = [ 'i' , 'j' , 'dip' , 'alpha' , 'beta' , 'gamma' ]
+
+
+#%% Functions
+def read_xyz(xyzfile) :
+    """
+    Reads a single frame .xyz file.
+    :param xyzfile: path or file-like object of the format .xyz
+    :return: (atoms, coordinates) with atoms a list of names and coordinates a (N, 3) array in Angstrom
+    """
+    mol = pd.read_csv ( xyzfile , sep=r'\s+' , skiprows=2 , names=[ 'atom' , 'x' , 'y' , 'z' ] , index_col=False )
+    return mol[ 'atom' ].astype ( str ).tolist () , mol[ [ 'x' , 'y' , 'z' ] ].to_numpy ( dtype=float )
+
+
+def dipolar_constant(distance , gyr1 , gyr2) :
+    """
+    Dipolar coupling constant in Hz, broadcast over arrays.
+    :param distance: distance(s) in Angstrom
+    :param gyr1: gyromagnetic ratio(s) of the first nucleus in MHz/T
+    :param gyr2: gyromagnetic ratio(s) of the second nucleus in MHz/T
+    :return: dipolar coupling(s) in Hz
+    """
+    distance = np.asarray ( distance , dtype=float )
+    return -MU0_4PI * (np.asarray ( gyr1 ) * 1e6 * np.asarray ( gyr2 ) * 1e6 * PLANCK) / ((distance * 1e-10) ** 3)
+
+
+def _unit_vectors(vectors) :
+    """
+    Rows divided by their length; zero rows stay zero.
+    """
+    norm = np.sqrt ( np.einsum ( 'ij,ij->i' , vectors , vectors ) )[ : , None ]
+    return vectors / np.where ( norm == 0 , 1.0 , norm )
+
+
+def _rotation_angles(x1 , y1 , z1 , x2 , y2 , z2 , out=None) :
+    """
+    zyz Euler angles (extrinsic, as scipy's transform module) of the rotations taking the unit vectors
+    (x1, y1, z1) onto (x2, y2, z2), given as component arrays, in closed form from the entries of
+    R = d I + [c]x + c c^T / (1 + d) with c = v1 x v2 and d = v1 . v2. Antiparallel pairs are turned by
+    180 degrees about an axis normal to v1 and pairs with a zero vector get the identity. At beta = 0
+    or 180 the angle goes into alpha, as in scipy. The entries are computed in place in a handful of
+    buffers, so a chunk of pairs stays in cache.
+    :param out: optional (M, 3) array the angles are written to
+    :return: (M, 3) array of angles in degrees
+    """
+    angles = np.empty ( (len ( x1 ) , 3) ) if out is None else out
+    scratch = np.empty_like ( x1 )
+    cx = np.multiply ( y1 , z2 )
+    cx -= np.multiply ( z1 , y2 , out=scratch )
+    cy = np.multiply ( z1 , x2 )
+    cy -= np.multiply ( x1 , z2 , out=scratch )
+    cz = np.multiply ( x1 , y2 )
+    cz -= np.multiply ( y1 , x2 , out=scratch )
+    d = np.multiply ( x1 , x2 )
+    d += np.multiply ( y1 , y2 , out=scratch )
+    d += np.multiply ( z1 , z2 , out=scratch )
+    special = d < -1.0 + 1e-12
+    t = np.add ( d , 1.0 )
+    t[ special ] = 1.0
+    t = np.divide ( cz , t , out=t )
+    r22 = np.multiply ( cz , t )
+    r22 += d
+    r20 = np.multiply ( cx , t )
+    r20 -= cy
+    r21 = np.multiply ( cy , t )
+    r21 += cx
+    r02 = np.multiply ( cx , t , out=cz )
+    r02 += cy
+    r12 = np.multiply ( cy , t , out=t )
+    r12 -= cx
+    if np.any ( special ) :
+        # antiparallel, 180 degrees about n normal to v1: R = 2 n n^T - I; zero vectors: R = I
+        unit1 = np.column_stack ( (x1[ special ] , y1[ special ] , z1[ special ]) )
+        empty = ~np.any ( unit1 , axis=1 ) | (x2[ special ] == 0) & (y2[ special ] == 0) & (z2[ special ] == 0)
+        least = np.eye ( 3 )[ np.argmin ( np.abs ( unit1 ) , axis=1 ) ]
+        nx , ny , nz = np.where ( empty[ : , None ] , 0.0 , _unit_vectors ( np.cross ( unit1 , least ) ) ).T
+        r22[ special ] = np.where ( empty , 1.0 , 2 * nz * nz - 1 )
+        r20[ special ] , r21[ special ] = 2 * nz * nx , 2 * nz * ny
+        r02[ special ] , r12[ special ] = 2 * nx * nz , 2 * ny * nz
+    np.arctan2 ( r21 , np.negative ( r20 , out=scratch ) , out=angles[ : , 0 ] )
+    np.arccos ( np.clip ( r22 , -1.0 , 1.0 , out=r22 ) , out=angles[ : , 1 ] )
+    np.arctan2 ( r12 , r02 , out=angles[ : , 2 ] )
+    np.multiply ( r20 , r20 , out=scratch )
+    scratch += np.multiply ( r21 , r21 , out=cx )
+    locked = np.flatnonzero ( scratch < 1e-18 )
+    if len ( locked ) :
+        # R = Rz(alpha) or Ry(180) Rz(alpha); the angle is read from the first column
+        units = np.column_stack ( (x1[ locked ] , y1[ locked ] , z1[ locked ] ,
+                                   x2[ locked ] , y2[ locked ] , z2[ locked ]) )
+        matrices = _rotation_matrices ( units[ : , :3 ] , units[ : , 3 : ] )
+        angles[ locked , 0 ] = np.arctan2 ( matrices[ : , 1 , 0 ] , matrices[ : , 0 , 0 ] * matrices[ : , 2 , 2 ] )
+        angles[ locked , 2 ] = 0.0
+    return np.degrees ( angles , out=angles )
+
+
+def _rotation_matrices(unit1 , unit2) :
+    """
+    Rotation matrices taking unit1 onto unit2, with the conventions of _rotation_angles, for the few
+    pairs whose angles need the whole matrix.
+    """
+    c = np.cross ( unit1 , unit2 )
+    d = np.einsum ( 'ij,ij->i' , unit1 , unit2 )
+    skew = np.zeros ( (len ( d ) , 3 , 3) )
+    skew[ : , 0 , 1 ] , skew[ : , 0 , 2 ] , skew[ : , 1 , 2 ] = -c[ : , 2 ] , c[ : , 1 ] , -c[ : , 0 ]
+    skew -= skew.transpose ( 0 , 2 , 1 )
+    special = d < -1.0 + 1e-12
+    matrices = d[ : , None , None ] * np.eye ( 3 ) + skew + np.einsum ( 'ki,kj->kij' , c , c ) / np.where (
+        special , 1.0 , 1.0 + d )[ : , None , None ]
+    if np.any ( special ) :
+        empty = ~np.any ( unit1[ special ] , axis=1 ) | ~np.any ( unit2[ special ] , axis=1 )
+        least = np.eye ( 3 )[ np.argmin ( np.abs ( unit1[ special ] ) , axis=1 ) ]
+        n = _unit_vectors ( np.cross ( unit1[ special ] , least ) )
+        matrices[ special ] = np.where ( empty[ : , None , None ] , np.eye ( 3 ) ,
+                                         2 * np.einsum ( 'ki,kj->kij' , n , n ) - np.eye ( 3 ) )
+    return matrices
+
+
+def euler_angles_between(vec1 , vec2) :
+    """
+    Batched version of the rotation between two vectors used by the Spinsys page, the same
+    rotation as I + [v]x + [v]x^2 / (1 + cos) with its angles computed in closed form.
+    Antiparallel vectors are turned by 180 degrees about an axis normal to vec1; a zero
+    vector (an atom at the origin) has no direction and gets the identity, angles 0.
+    :param vec1: (M, 3) array of vectors
+    :param vec2: (M, 3) array of vectors
+    :return: (M, 3) array of Euler angles in degrees, zyz convention of scipy's transform module
+    """
+    vec1 = _unit_vectors ( np.atleast_2d ( np.asarray ( vec1 , dtype=float ) ) )
+    vec2 = _unit_vectors ( np.atleast_2d ( np.asarray ( vec2 , dtype=float ) ) )
+    angles = np.empty ( (len ( vec1 ) , 3) )
+    for start in range ( 0 , len ( vec1 ) , _CHUNK_PAIRS ) :
+        stop = start + _CHUNK_PAIRS
+        _rotation_angles ( *vec1[ start :stop ].T , *vec2[ start :stop ].T , out=angles[ start :stop ] )
+    return angles
+
+
+def pairwise_dipolar(coord_xyz , gyr_atom , pairs=None) :
+    """
+    Distances, dipolar couplings and Euler angles for pairs of atoms in one pass.
+    :param coord_xyz: (N, 3) coordinates in Angstrom
+    :param gyr_atom: (N,) gyromagnetic ratios in MHz/T
+    :param pairs: optional tuple (i, j) of 0-based index arrays, defaults to every pair i < j
+    :return: dict of arrays 'i', 'j' (0-based), 'dist', 'dip', 'alpha', 'beta', 'gamma'
+    """
+    coord_xyz = np.asarray ( coord_xyz , dtype=float )
+    gyr_atom = np.asarray ( gyr_atom , dtype=float )
+    if pairs is None :
+        idx_i , idx_j = np.triu_indices ( len ( coord_xyz ) , k=1 )
+    else :
+        idx_i , idx_j = (np.asarray ( p , dtype=np.intp ) for p in pairs)
+
+    # the atoms are read as contiguous components, their directions normalised once and not once per pair
+    coords = np.ascontiguousarray ( coord_xyz.T )
+    units = np.ascontiguousarray ( _unit_vectors ( coord_xyz ).T )
+    dist = np.empty ( len ( idx_i ) )
+    dip = np.empty ( len ( idx_i ) )
+    angles = np.empty ( (len ( idx_i ) , 3) )
+    for start in range ( 0 , len ( idx_i ) , _CHUNK_PAIRS ) :
+        stop = start + _CHUNK_PAIRS
+        first , second = idx_i[ start :stop ] , idx_j[ start :stop ]
+        squared = sum ( (component[ second ] - component[ first ]) ** 2 for component in coords )
+        dist[ start :stop ] = np.sqrt ( squared , out=squared )
+        dip[ start :stop ] = dipolar_constant ( squared , gyr_atom[ first ] , gyr_atom[ second ] )
+        _rotation_angles ( *(component[ first ] for component in units) ,
+                           *(component[ second ] for component in units) , out=angles[ start :stop ] )
+    return { 'i' : idx_i , 'j' : idx_j , 'dist' : dist , 'dip' : dip ,
+             'alpha' : angles[ : , 0 ] , 'beta' : angles[ : , 1 ] , 'gamma' : angles[ : , 2 ] }
+
+
+def dipolar_table(pair_data , decimals=2) :
+    """
+    Builds the dipole table of the Spinsys page from the output of pairwise_dipolar.
+    :param pair_data: dict of arrays as returned by pairwise_dipolar
+    :param decimals: rounding applied to the coupling and the angles
+    :return: pandas DataFrame with columns i, j (1-based), dip, alpha, beta, gamma
+    """
+    return pd.DataFrame ( {
+        'i' : pair_data[ 'i' ] + 1 ,
+        'j' : pair_data[ 'j' ] + 1 ,
+        'dip' : np.round ( pair_data[ 'dip' ] , decimals ) ,
+        'alpha' : np.round ( pair_data[ 'alpha' ] , decimals ) ,
+        'beta' : np.round ( pair_data[ 'beta' ] , decimals ) ,
+        'gamma' : np.round ( pair_data[ 'gamma' ] , decimals ) ,
+    } , columns=DIPOLAR_COLUMNS )
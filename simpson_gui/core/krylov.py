@@ -0,0 +1,158 @@
+#%% Header files
+import numpy as np
+
+from .lazy import LazyImport
+from .preview import Rotor , acquisition , crystallites , parse_operator , spin_hamiltonian
+
+sparse = LazyImport ( 'scipy.sparse' )
+expm_multiply = LazyImport ( 'scipy.sparse.linalg' , 'expm_multiply' )
+
+# Blocks up to this size are exponentiated densely, larger ones with expm_multiply
+DENSE_BLOCK = 16
+
+
+#%% Functions
+def magnetisation_blocks(spin_system) :
+    """
+    Block of every product state: states with the same Iz of every channel are coupled by the
+    secular Hamiltonian, states with different ones are not. This holds for free evolution;
+    RF pulses would mix the blocks of their channel.
+    :return: (block label per state, permutation putting the blocks one after the other, block boundaries)
+    """
+    n_spins = len ( spin_system.nuclei )
+    states = np.arange ( 2 ** n_spins )
+    # bit k of the state (spin k from the left) is 0 for alpha, 1 for beta
+    bits = (states[ : , None ] >> (n_spins - 1 - np.arange ( n_spins ))[ None , : ]) & 1
+    names = sorted ( set ( spin_system.nuclei ) )
+    per_channel = np.column_stack ( [ bits[ : , [ k for k , name in enumerate ( spin_system.nuclei ) if name == channel ] ]
+                                      .sum ( axis=1 ) for channel in names ] )
+    _ , labels = np.unique ( per_channel , axis=0 , return_inverse=True )
+    labels = labels.ravel ()
+    order = np.argsort ( labels , kind='stable' )
+    bounds = np.concatenate ( ( [ 0 ] , np.cumsum ( np.bincount ( labels ) ) ) )
+    return labels , order , bounds
+
+
+class BlockHamiltonian :
+    """
+    Hamiltonians H0 + sum_t c_t A_t of a stack of crystallites, stored on the union sparsity
+    pattern of the terms and split into the magnetisation blocks. The values of a block are one
+    sparse product with the coefficients, so memory stays proportional to the non-zeros.
+    """
+
+    def __init__(self , h_iso , operators , order , bounds) :
+        terms = [ h_iso ] + list ( operators )
+        terms = [ sparse.coo_matrix ( term[ order ][ : , order ].real ) for term in terms ]
+        rows = np.concatenate ( [ term.row for term in terms ] ).astype ( np.int64 )
+        cols = np.concatenate ( [ term.col for term in terms ] )
+        columns = np.concatenate ( [ np.full ( term.nnz , t ) for t , term in enumerate ( terms ) ] )
+        values = np.concatenate ( [ term.data for term in terms ] )
+        keys , entry = np.unique ( rows * len ( order ) + cols , return_inverse=True )
+        mapping = sparse.csr_matrix ( (values , (entry.ravel () , columns)) , shape=(len ( keys ) , len ( terms )) )
+        pattern_rows , pattern_cols = keys // len ( order ) , keys % len ( order )
+
+        # small blocks are exponentiated one by one, the large ones together as one sparse matrix
+        self.small = [ ]
+        large_states , large_entries = [ ] , [ ]
+        for first , last in zip ( bounds[ :-1 ] , bounds[ 1 : ] ) :
+            inside = np.arange ( *np.searchsorted ( pattern_rows , [ first , last ] ) )
+            if last - first <= DENSE_BLOCK :
+                self.small.append ( (first , last , pattern_rows[ inside ] - first , pattern_cols[ inside ] - first ,
+                                     mapping[ inside ]) )
+            else :
+                large_states.append ( np.arange ( first , last ) )
+                large_entries.append ( inside )
+        self.large_states = np.concatenate ( large_states ) if large_states else np.zeros ( 0 , dtype=int )
+        entries = np.concatenate ( large_entries ) if large_entries else np.zeros ( 0 , dtype=int )
+        position = np.full ( len ( order ) , -1 )
+        position[ self.large_states ] = np.arange ( len ( self.large_states ) )
+        self.large = (position[ pattern_rows[ entries ] ] , position[ pattern_cols[ entries ] ] , mapping[ entries ])
+        self.nnz = mapping.shape[ 0 ]
+
+    @staticmethod
+    def _stacked(size , rows , cols , count) :
+        """
+        CSR structure of count copies of a pattern along the diagonal.
+        """
+        offsets = size * np.arange ( count )[ : , None ]
+        indptr = np.searchsorted ( (rows[ None , : ] + offsets).ravel () , np.arange ( size * count + 1 ) )
+        return indptr , (cols[ None , : ] + offsets).ravel ()
+
+    def propagate(self , vectors , coefficients , dt) :
+        """
+        exp(-i 2 pi H dt) applied to the vectors of every crystallite.
+        :param vectors: (K, d, m) array, m vectors per crystallite
+        :param coefficients: (K, T) anisotropic coefficients
+        """
+        count = len ( coefficients )
+        weights = np.column_stack ( (np.ones ( count ) , coefficients) ).T
+        result = np.empty_like ( vectors )
+        for first , last , rows , cols , mapping in self.small :
+            size = last - first
+            matrices = np.zeros ( (count , size , size) )
+            matrices[ : , rows , cols ] = (mapping @ weights).T
+            energies , eigenvectors = np.linalg.eigh ( matrices )
+            phases = np.exp ( -2j * np.pi * energies * dt )[ : , : , None ]
+            result[ : , first :last ] = eigenvectors @ (phases * (eigenvectors.transpose ( 0 , 2 , 1 ) @
+                                                                 vectors[ : , first :last ]))
+        if len ( self.large_states ) :
+            rows , cols , mapping = self.large
+            size = len ( self.large_states )
+            indptr , indices = self._stacked ( size , rows , cols , count )
+            stacked = sparse.csr_matrix ( ((-2j * np.pi * dt) * (mapping @ weights).T.ravel () , indices , indptr) ,
+                                          shape=(size * count , size * count) )
+            # every crystallite stays in its own diagonal block of the stacked matrix
+            block_vectors = vectors[ : , self.large_states ].reshape ( size * count , -1 )
+            result[ : , self.large_states ] = expm_multiply ( stacked , block_vectors ,
+                                                              traceA=complex ( stacked.diagonal ().sum () ) ).reshape (
+                count , size , -1 )
+        return result
+
+
+def krylov_fid(spin_system , par , nuclei , maxdt=1e-6 , n_vectors=1 , seed=0 , max_elements=1 << 24) :
+    """
+    FID of up to core.preview.MAX_SPINS spins 1/2 under MAS from state vectors instead of propagators.
+    Tr(D rho(t)) is estimated as <r(t)| D |rho0 r (t)> with random-phase vectors r, whose error
+    falls as 1/sqrt(2^n * n_vectors * crystallites). Vectors are propagated with expm_multiply,
+    block by block of conserved Iz, so no matrix of size 2^n x 2^n is ever formed densely.
+    Only free evolution from start_operator is simulated: the pulse sequence is ignored.
+    :param spin_system: SpinSystem from core.spinsys.parse_spinsys
+    :param par: dict from core.par.parse_par
+    :param nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    :param maxdt: longest step in s over which the Hamiltonian is taken as constant
+    :param n_vectors: random vectors per crystallite
+    :param seed: seed of the random vectors, for reproducible previews
+    :param max_elements: bound on the non-zeros of the Hamiltonians of the crystallites propagated together
+    :return: (time in s, complex FID)
+    """
+    proton_frequency , spin_rate , rotor_angle , n_points , dwell = acquisition ( par )
+    n_spins = len ( spin_system.nuclei )
+    h_iso , tensors , operators = spin_hamiltonian ( spin_system , proton_frequency , nuclei , sparse_format=True )
+    _ , order , bounds = magnetisation_blocks ( spin_system )
+    hamiltonian = BlockHamiltonian ( h_iso , operators , order , bounds )
+    rho0 = parse_operator ( par.get ( 'start_operator' , 'Inx' ) , n_spins , sparse_format=True )[ order ][ : , order ]
+    detect = parse_operator ( par.get ( 'detect_operator' , 'Inp' ) , n_spins , sparse_format=True )[ order ][ : , order ]
+
+    alpha , beta , gamma , weights = crystallites ( par )
+    n_steps = max ( int ( np.ceil ( dwell / maxdt - 1e-9 ) ) , 1 ) if spin_rate else 1
+    dt = dwell / n_steps
+    chunk = max ( max_elements // (hamiltonian.nnz + 4 * n_vectors * 2 ** n_spins) , 1 )
+    rng = np.random.default_rng ( seed )
+
+    fid = np.zeros ( n_points , dtype=complex )
+    for first in range ( 0 , len ( alpha ) , chunk ) :
+        part = slice ( first , first + chunk )
+        rotor = Rotor ( tensors , alpha[ part ] , beta[ part ] , gamma[ part ] , spin_rate , rotor_angle )
+        count = len ( rotor.gamma )
+        vectors = np.exp ( 2j * np.pi * rng.random ( (count , 2 ** n_spins , n_vectors) ) )
+        # the first n_vectors columns are r, the others rho0 r
+        state = np.concatenate ( (vectors , np.stack ( [ rho0 @ v for v in vectors ] )) , axis=2 )
+        for point in range ( n_points ) :
+            bra , ket = state[ : , : , :n_vectors ] , state[ : , : , n_vectors : ]
+            detected = np.stack ( [ detect @ v for v in ket ] )
+            fid[ point ] += np.einsum ( 'k,kam,kam->' , weights[ part ] , bra.conj () , detected ) / n_vectors
+            if point == n_points - 1 :
+                break
+            for step in range ( n_steps ) :
+                state = hamiltonian.propagate ( state , rotor.scales ( point * dwell + (step + 0.5) * dt ) , dt )
+    return np.arange ( n_points ) * dwell , fid
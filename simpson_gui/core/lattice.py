@@ -0,0 +1,318 @@
+#%% Header files
+import io
+import re
+from fractions import Fraction
+from itertools import product
+
+import numpy as np
+
+from .dipolar import dipolar_constant
+from .lazy import LazyImport
+
+cKDTree = LazyImport ( 'scipy.spatial' , 'cKDTree' )
+
+_NUMBER = re.compile ( r'^([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)(?:\([0-9]+\))?$' )
+# CIF 1.1 words: a quote only opens a value at the start of a word and only closes it before
+# whitespace or the end of the line, so that labels such as C1' stay one bare word
+_CIF_WORD = re.compile ( r"'(.*?)'(?=\s|$)|\"(.*?)\"(?=\s|$)|(\S+)" )
+_SYMOP_TERM = re.compile ( r'([+-]?)([0-9.]*(?:/[0-9]+)?)\*?([xyz]?)' )
+
+PAIR_FIELDS = ( 'i' , 'j' , 'shift' , 'dist' , 'dip' , 'alpha' , 'beta' , 'gamma' )
+
+
+#%% CIF input
+def _cif_number(value) :
+    """
+    CIF numbers may carry a standard uncertainty, e.g. 5.4309(2).
+    """
+    match = _NUMBER.match ( value )
+    if match is None :
+        raise ValueError ( f"Not a number in CIF file: {value}" )
+    return float ( match.group ( 1 ) )
+
+
+def _cif_words(line) :
+    """
+    Values of one line of a CIF file, quoted values without their quotes.
+    """
+    return [ single or double or bare for single , double , bare in _CIF_WORD.findall ( line ) ]
+
+
+def _cif_items(text) :
+    """
+    Splits a CIF data block into single items and loops.
+    :return: (items, loops) with items a dict tag -> value and loops a list of dicts tag -> list of values
+    """
+    items = { }
+    loops = [ ]
+    lines = [ ]
+    in_text = False
+    for line in text.splitlines () :
+        if line.startswith ( ';' ) :
+            in_text = not in_text
+            continue
+        if in_text :
+            continue
+        line = line.strip ()
+        if line and not line.startswith ( '#' ) :
+            lines.append ( line )
+
+    pos = 0
+    while pos < len ( lines ) :
+        line = lines[ pos ]
+        if line.lower () == 'loop_' :
+            pos += 1
+            tags = [ ]
+            while pos < len ( lines ) and lines[ pos ].startswith ( '_' ) :
+                tags.append ( lines[ pos ].split ()[ 0 ].lower () )
+                pos += 1
+            values = [ ]
+            while pos < len ( lines ) and not lines[ pos ].startswith ( ( '_' , 'loop_' , 'data_' ) ) :
+                values.extend ( _cif_words ( lines[ pos ] ) )
+                pos += 1
+            loops.append ( { tag : values[ k : :len ( tags ) ] for k , tag in enumerate ( tags ) } )
+        elif line.startswith ( '_' ) :
+            parts = _cif_words ( line )
+            if len ( parts ) > 1 :
+                items[ parts[ 0 ].lower () ] = parts[ 1 ]
+            elif pos + 1 < len ( lines ) :
+                pos += 1
+                items[ parts[ 0 ].lower () ] = _cif_words ( lines[ pos ] )[ 0 ]
+            pos += 1
+        else :
+            pos += 1
+    return items , loops
+
+
+def parse_symmetry_operation(operation) :
+    """
+    Parses a symmetry operation such as '-x+1/2, y, -z' into (rotation, translation)
+    acting on fractional coordinates.
+    """
+    rotation = np.zeros ( (3 , 3) )
+    translation = np.zeros ( 3 )
+    components = operation.replace ( ' ' , '' ).lower ().split ( ',' )
+    if len ( components ) != 3 :
+        raise ValueError ( f"Cannot read symmetry operation: {operation}" )
+    for row , component in enumerate ( components ) :
+        for sign , number , axis in _SYMOP_TERM.findall ( component ) :
+            if not number and not axis :
+                continue
+            value = float ( Fraction ( number ) ) if number else 1.0
+            value = -value if sign == '-' else value
+            if axis :
+                rotation[ row , 'xyz'.index ( axis ) ] += value
+            else :
+                translation[ row ] += value
+    return rotation , translation
+
+
+def cell_matrix(a , b , c , alpha , beta , gamma) :
+    """
+    Lattice vectors as rows, a along x and b in the xy plane.
+    :param a, b, c: cell lengths in Angstrom
+    :param alpha, beta, gamma: cell angles in degrees
+    :return: (3, 3) array, Cartesian coordinates = fractional @ lattice
+    """
+    alpha , beta , gamma = np.radians ( [ alpha , beta , gamma ] )
+    cx = c * np.cos ( beta )
+    cy = c * (np.cos ( alpha ) - np.cos ( beta ) * np.cos ( gamma )) / np.sin ( gamma )
+    cz = np.sqrt ( c ** 2 - cx ** 2 - cy ** 2 )
+    return np.array ( [ [ a , 0.0 , 0.0 ] ,
+                        [ b * np.cos ( gamma ) , b * np.sin ( gamma ) , 0.0 ] ,
+                        [ cx , cy , cz ] ] )
+
+
+def read_cif(ciffile , tolerance=1e-3) :
+    """
+    Reads the unit cell and the atom sites of a CIF file and applies the symmetry
+    operations, so that the full content of the unit cell is returned.
+    :param ciffile: path or file-like object (text or bytes)
+    :param tolerance: fractional distance below which two generated sites are the same
+    :return: (atoms, fractional coordinates (N, 3), lattice (3, 3))
+    """
+    if hasattr ( ciffile , 'read' ) :
+        text = ciffile.read ()
+    else :
+        with open ( ciffile , 'r' ) as handle :
+            text = handle.read ()
+    if isinstance ( text , bytes ) :
+        text = text.decode ( 'utf-8' , errors='replace' )
+
+    items , loops = _cif_items ( text )
+    lattice = cell_matrix ( *(_cif_number ( items[ f'_cell_{tag}' ] ) for tag in
+                              ( 'length_a' , 'length_b' , 'length_c' , 'angle_alpha' , 'angle_beta' , 'angle_gamma' )) )
+
+    sites = next ( (loop for loop in loops if '_atom_site_fract_x' in loop) , None )
+    if sites is None :
+        raise ValueError ( "No fractional atom sites in CIF file" )
+    labels = sites.get ( '_atom_site_type_symbol' , sites.get ( '_atom_site_label' ) )
+    labels = [ re.match ( r'[A-Za-z]+' , label ).group ( 0 ) if not label[ 0 ].isdigit () else label
+               for label in labels ]
+    fract = np.array ( [ [ _cif_number ( v ) for v in sites[ f'_atom_site_fract_{axis}' ] ] for axis in 'xyz' ] ).T
+
+    operations = [ 'x,y,z' ]
+    for loop in loops :
+        for tag in ( '_symmetry_equiv_pos_as_xyz' , '_space_group_symop_operation_xyz' ) :
+            if tag in loop :
+                operations = loop[ tag ]
+
+    atoms = [ ]
+    positions = [ ]
+    for operation in operations :
+        rotation , translation = parse_symmetry_operation ( operation )
+        for label , site in zip ( labels , (fract @ rotation.T + translation) % 1.0 ) :
+            if positions :
+                delta = np.asarray ( positions ) - site
+                delta -= np.round ( delta )
+                if np.any ( np.linalg.norm ( delta , axis=1 ) < tolerance ) :
+                    continue
+            atoms.append ( label )
+            positions.append ( site )
+    return atoms , np.asarray ( positions ) , lattice
+
+
+def read_cell_text(text) :
+    """
+    Reads a plain unit-cell description: first line a b c alpha beta gamma, then one
+    line per atom 'label fx fy fz' in fractional coordinates.
+    :return: (atoms, fractional coordinates (N, 3), lattice (3, 3))
+    """
+    rows = [ line.split () for line in io.StringIO ( text ) if line.strip () and not line.startswith ( '#' ) ]
+    lattice = cell_matrix ( *map ( float , rows[ 0 ][ :6 ] ) )
+    atoms = [ row[ 0 ] for row in rows[ 1 : ] ]
+    fract = np.array ( [ [ float ( v ) for v in row[ 1 :4 ] ] for row in rows[ 1 : ] ] )
+    return atoms , fract , lattice
+
+
+#%% Image-aware couplings
+def internuclear_euler_angles(vectors) :
+    """
+    Euler angles (zyz, degrees) of an axially symmetric dipolar tensor whose unique axis
+    lies along the internuclear vector: (0, polar angle, azimuth).
+    """
+    vectors = np.atleast_2d ( vectors )
+    r = np.linalg.norm ( vectors , axis=1 )
+    beta = np.degrees ( np.arccos ( np.clip ( vectors[ : , 2 ] / r , -1.0 , 1.0 ) ) )
+    gamma = np.degrees ( np.arctan2 ( vectors[ : , 1 ] , vectors[ : , 0 ] ) )
+    return np.column_stack ( (np.zeros_like ( r ) , beta , gamma) )
+
+
+def image_shifts(lattice , cutoff) :
+    """
+    Lattice translations that can hold a neighbour within ``cutoff`` of an atom in the
+    home cell, restricted to one half space so that each pair is seen once.
+    The range along each axis follows from the spacing of the lattice planes.
+    """
+    reciprocal = np.linalg.inv ( lattice ).T
+    spacing = 1.0 / np.linalg.norm ( reciprocal , axis=1 )
+    reach = np.ceil ( cutoff / spacing ).astype ( int ) + 1
+    shifts = [ s for s in product ( *(range ( -n , n + 1 ) for n in reach) ) if s > (0 , 0 , 0) ]
+    return np.array ( [ (0 , 0 , 0) ] + shifts , dtype=int )
+
+
+def periodic_dipolar(fract , lattice , gyr_atom , cutoff) :
+    """
+    All dipolar couplings within ``cutoff`` between the atoms of a unit cell and every
+    periodic image. The supercell is never built: for one lattice shift at a time the
+    shifted cell is queried against a KD-tree of the home cell, and shifts whose cell
+    cannot come within the cutoff are skipped.
+    Each pair appears once: (i, j, T) with T > 0, or T = 0 and i < j.
+    :param fract: (N, 3) fractional coordinates
+    :param lattice: (3, 3) lattice vectors as rows
+    :param gyr_atom: (N,) gyromagnetic ratios in MHz/T
+    :param cutoff: largest distance in Angstrom
+    :return: dict of arrays 'i', 'j', 'shift' (M, 3), 'dist', 'dip', 'alpha', 'beta', 'gamma'
+    """
+    fract = np.asarray ( fract , dtype=float ) % 1.0
+    gyr_atom = np.asarray ( gyr_atom , dtype=float )
+    cart = fract @ lattice
+    tree = cKDTree ( cart )
+    low , high = cart.min ( axis=0 ) , cart.max ( axis=0 )
+
+    found = { field : [ ] for field in ( 'i' , 'j' , 'shift' ) }
+    for shift in image_shifts ( lattice , cutoff ) :
+        offset = shift @ lattice
+        gap = np.maximum ( 0.0 , np.maximum ( low - (high + offset) , (low + offset) - high ) )
+        if np.linalg.norm ( gap ) > cutoff :
+            continue
+        hits = tree.sparse_distance_matrix ( cKDTree ( cart + offset ) , cutoff , output_type='ndarray' )
+        idx_i , idx_j = hits[ 'i' ].astype ( np.intp ) , hits[ 'j' ].astype ( np.intp )
+        if not shift.any () :
+            keep = idx_i < idx_j
+            idx_i , idx_j = idx_i[ keep ] , idx_j[ keep ]
+        found[ 'i' ].append ( idx_i )
+        found[ 'j' ].append ( idx_j )
+        found[ 'shift' ].append ( np.broadcast_to ( shift , (len ( idx_i ) , 3) ) )
+
+    idx_i = np.concatenate ( found[ 'i' ] )
+    idx_j = np.concatenate ( found[ 'j' ] )
+    shifts = np.concatenate ( found[ 'shift' ] )
+    vectors = cart[ idx_j ] + shifts @ lattice - cart[ idx_i ]
+    dist = np.linalg.norm ( vectors , axis=1 )
+    angles = internuclear_euler_angles ( vectors ) if len ( vectors ) else np.zeros ( (0 , 3) )
+    return { 'i' : idx_i , 'j' : idx_j , 'shift' : shifts , 'dist' : dist ,
+             'dip' : dipolar_constant ( dist , gyr_atom[ idx_i ] , gyr_atom[ idx_j ] ) ,
+             'alpha' : angles[ : , 0 ] , 'beta' : angles[ : , 1 ] , 'gamma' : angles[ : , 2 ] }
+
+
+def minimum_image(pair_data) :
+    """
+    Keeps, for every pair of sites (i, j) with i < j, only the closest image.
+    Self-image pairs (i == i) are dropped.
+    """
+    lo = np.minimum ( pair_data[ 'i' ] , pair_data[ 'j' ] )
+    hi = np.maximum ( pair_data[ 'i' ] , pair_data[ 'j' ] )
+    distinct = lo != hi
+    order = np.lexsort ( (pair_data[ 'dist' ] , hi , lo) )
+    order = order[ distinct[ order ] ]
+    key = lo[ order ] * (hi.max ( initial=0 ) + 1) + hi[ order ]
+    first = order[ np.r_[ True , key[ 1 : ] != key[ :-1 ] ] ] if len ( order ) else order
+    picked = { field : pair_data[ field ][ first ] for field in PAIR_FIELDS }
+    return _orient_pairs ( picked )
+
+
+def _orient_pairs(pair_data) :
+    """
+    Puts the lower index first. Reversing a pair reverses its internuclear vector,
+    hence the shift, the polar angle and the azimuth change too.
+    """
+    swap = pair_data[ 'i' ] > pair_data[ 'j' ]
+    oriented = dict ( pair_data )
+    oriented[ 'i' ] = np.where ( swap , pair_data[ 'j' ] , pair_data[ 'i' ] )
+    oriented[ 'j' ] = np.where ( swap , pair_data[ 'i' ] , pair_data[ 'j' ] )
+    oriented[ 'shift' ] = np.where ( swap[ : , None ] , -pair_data[ 'shift' ] , pair_data[ 'shift' ] )
+    oriented[ 'beta' ] = np.where ( swap , 180.0 - pair_data[ 'beta' ] , pair_data[ 'beta' ] )
+    oriented[ 'gamma' ] = np.where ( swap , pair_data[ 'gamma' ] - np.copysign ( 180.0 , pair_data[ 'gamma' ] ) ,
+                                     pair_data[ 'gamma' ] )
+    return oriented
+
+
+def select_sites(pair_data , sites) :
+    """
+    Closest-image couplings among a subset of sites, renumbered 0..len(sites)-1 in the
+    order given, ready for dipolar_table.
+    """
+    sites = np.asarray ( sites , dtype=np.intp )
+    inside = np.isin ( pair_data[ 'i' ] , sites ) & np.isin ( pair_data[ 'j' ] , sites )
+    closest = minimum_image ( { field : pair_data[ field ][ inside ] for field in PAIR_FIELDS } )
+    renumber = np.zeros ( max ( sites.max ( initial=-1 ) + 1 , 1 ) , dtype=np.intp )
+    renumber[ sites ] = np.arange ( len ( sites ) )
+    closest[ 'i' ] , closest[ 'j' ] = renumber[ closest[ 'i' ] ] , renumber[ closest[ 'j' ] ]
+    return _orient_pairs ( closest )
+
+
+def rss_couplings(pair_data , n_sites , partners=None) :
+    """
+    Effective root-sum-square dipolar coupling of every site, sqrt(sum |D|^2) over all
+    neighbours and images within the cutoff.
+    :param pair_data: dict of arrays as returned by periodic_dipolar
+    :param n_sites: number of sites in the unit cell
+    :param partners: optional boolean mask of the sites that count as neighbours
+    :return: (n_sites,) array in Hz
+    """
+    squared = pair_data[ 'dip' ] ** 2
+    partners = np.ones ( n_sites , dtype=bool ) if partners is None else np.asarray ( partners )
+    total = np.bincount ( pair_data[ 'i' ] , weights=squared * partners[ pair_data[ 'j' ] ] , minlength=n_sites )
+    total += np.bincount ( pair_data[ 'j' ] , weights=squared * partners[ pair_data[ 'i' ] ] , minlength=n_sites )
+    return np.sqrt ( total )
@@ -0,0 +1,40 @@
+#%% Header files
+import importlib
+
+
+#%% Functions
+class LazyImport :
+    """
+    Stand-in for a module, or for one attribute of a module, that imports the module on first use,
+    so that heavy dependencies (pandas, scipy, plotly, ...) are only loaded by the features that need them.
+    pd = LazyImport ( 'pandas' ) and Rot = LazyImport ( 'scipy.spatial.transform' , 'Rotation' ) are used
+    like the module and the class they stand for.
+    """
+
+    def __init__(self , module , attribute=None) :
+        """
+        :param module: dotted name of the module
+        :param attribute: name of the attribute of the module to stand for, the module itself if None
+        """
+        self._module = module
+        self._attribute = attribute
+        self._target = None
+
+    def _load(self) :
+        if self._target is None :
+            target = importlib.import_module ( self._module )
+            self._target = target if self._attribute is None else getattr ( target , self._attribute )
+        return self._target
+
+    def __getattr__(self , name) :
+        # only reached for names that are not set in __init__; those are looked up while copying
+        if name in ( '_module' , '_attribute' , '_target' ) :
+            raise AttributeError ( name )
+        return getattr ( self._load () , name )
+
+    def __call__(self , *args , **kwargs) :
+        return self._load () ( *args , **kwargs )
+
+    def __repr__(self) :
+        name = self._module if self._attribute is None else f"{self._module}.{self._attribute}"
+        return f"<LazyImport {name}{'' if self._target is None else ' (loaded)'}>"
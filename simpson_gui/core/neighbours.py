@@ -0,0 +1,153 @@
+#%% Header files
+import numpy as np
+
+from .dipolar import PLANCK , MU0_4PI , dipolar_constant , pairwise_dipolar , dipolar_table
+from .lazy import LazyImport
+
+cKDTree = LazyImport ( 'scipy.spatial' , 'cKDTree' )
+
+
+#%% Functions
+def isotope_names(atoms , nuclei , isotopes=None) :
+    """
+    Maps the atom labels of a structure file onto nuclei of the NMR table.
+    A label that already is a nucleus name (1H, 13C, ...) is kept. An element symbol
+    is mapped through ``isotopes`` or, failing that, onto the default isotope of the
+    element (its first spin-1/2 isotope in the table).
+    :param atoms: list of atom labels from the structure file
+    :param nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    :param isotopes: optional dict such as {'C': '13C', 'N': '15N'}
+    :return: list of nucleus names, one per atom
+    """
+    isotopes = isotopes or { }
+    names = [ ]
+    for atom in atoms :
+        if atom in nuclei :
+            names.append ( atom )
+        elif atom in isotopes :
+            names.append ( isotopes[ atom ] )
+        else :
+            try :
+                names.append ( nuclei.default_isotope ( atom ) )
+            except KeyError :
+                raise ValueError ( f"Unknown atom {atom} in structure" ) from None
+    return names
+
+
+class StructureIndex :
+    """
+    A structure loaded once and indexed with one KD-tree per nucleus, so that
+    neighbour and coupling queries do not scan all atoms.
+    Atom indices are 0-based throughout.
+    """
+
+    def __init__(self , coord_xyz , nuclei , gyr_by_name) :
+        """
+        :param coord_xyz: (N, 3) coordinates in Angstrom
+        :param nuclei: list of N nucleus names (1H, 13C, ...)
+        :param gyr_by_name: mapping nucleus name -> gyromagnetic ratio in MHz/T
+        """
+        self.coord_xyz = np.asarray ( coord_xyz , dtype=float )
+        self.nuclei = np.asarray ( nuclei )
+        self.gyr = np.array ( [ gyr_by_name[ n ] for n in nuclei ] , dtype=float )
+        self.atoms_of = { }
+        self.trees = { }
+        for name in dict.fromkeys ( nuclei ) :
+            members = np.flatnonzero ( self.nuclei == name )
+            self.atoms_of[ name ] = members
+            self.trees[ name ] = cKDTree ( self.coord_xyz[ members ] )
+
+    def __len__(self) :
+        return len ( self.coord_xyz )
+
+    def _selected(self , nucleus) :
+        return list ( self.trees ) if nucleus is None else [ nucleus ]
+
+    def within(self , k , radius , nucleus=None) :
+        """
+        All atoms (of one nucleus if given) within ``radius`` Angstrom of atom k,
+        sorted by distance and excluding k itself.
+        """
+        found = [ ]
+        for name in self._selected ( nucleus ) :
+            if name not in self.trees :
+                continue
+            hits = self.trees[ name ].query_ball_point ( self.coord_xyz[ k ] , radius )
+            found.append ( self.atoms_of[ name ][ hits ] )
+        found = np.concatenate ( found ) if found else np.zeros ( 0 , dtype=np.intp )
+        found = found[ found != k ]
+        dist = np.linalg.norm ( self.coord_xyz[ found ] - self.coord_xyz[ k ] , axis=1 )
+        return found[ np.argsort ( dist , kind='stable' ) ]
+
+    def strongest(self , k , n , nucleus=None) :
+        """
+        The n atoms with the largest |D| to atom k.
+        Within one nucleus |D| only depends on the distance, so the n nearest atoms of
+        every nucleus are the only candidates.
+        :return: (atoms, couplings in Hz) sorted by decreasing |D|
+        """
+        candidates = [ ]
+        for name in self._selected ( nucleus ) :
+            if name not in self.trees :
+                continue
+            count = min ( n + 1 , len ( self.atoms_of[ name ] ) )
+            _ , hits = self.trees[ name ].query ( self.coord_xyz[ k ] , k=count )
+            candidates.append ( self.atoms_of[ name ][ np.atleast_1d ( hits ) ] )
+        candidates = np.concatenate ( candidates ) if candidates else np.zeros ( 0 , dtype=np.intp )
+        candidates = candidates[ candidates != k ]
+        dist = np.linalg.norm ( self.coord_xyz[ candidates ] - self.coord_xyz[ k ] , axis=1 )
+        dip = dipolar_constant ( dist , self.gyr[ k ] , self.gyr[ candidates ] )
+        order = np.argsort ( -np.abs ( dip ) , kind='stable' )[ :n ]
+        return candidates[ order ] , dip[ order ]
+
+    def coupling_radius(self , k , threshold , nucleus) :
+        """
+        Distance beyond which |D| between atom k and ``nucleus`` drops below ``threshold`` Hz.
+        """
+        gyr2 = self.gyr[ self.atoms_of[ nucleus ][ 0 ] ]
+        return (MU0_4PI * PLANCK * abs ( self.gyr[ k ] * gyr2 ) * 1e12 / threshold) ** (1.0 / 3.0) * 1e10
+
+    def above_threshold(self , k , threshold , nucleus=None) :
+        """
+        All atoms coupled to atom k by at least ``threshold`` Hz.
+        :return: (atoms, couplings in Hz) sorted by decreasing |D|
+        """
+        found = [ ]
+        for name in self._selected ( nucleus ) :
+            if name not in self.trees :
+                continue
+            found.append ( self.within ( k , self.coupling_radius ( k , threshold , name ) , name ) )
+        found = np.concatenate ( found ) if found else np.zeros ( 0 , dtype=np.intp )
+        dist = np.linalg.norm ( self.coord_xyz[ found ] - self.coord_xyz[ k ] , axis=1 )
+        dip = dipolar_constant ( dist , self.gyr[ k ] , self.gyr[ found ] )
+        order = np.argsort ( -np.abs ( dip ) , kind='stable' )
+        return found[ order ] , dip[ order ]
+
+    def truncated_spin_system(self , centres , threshold , max_spins=None , nucleus=None) :
+        """
+        Builds a small spin system around one or more centre atoms.
+        Every atom coupled to a centre by at least ``threshold`` Hz is kept, strongest first,
+        until ``max_spins`` spins are reached. Of the couplings inside the kept set, only
+        those with |D| >= threshold are returned.
+        :param centres: atom index or list of atom indices (0-based), e.g. the 13C of interest
+        :param threshold: smallest |D| in Hz that is kept
+        :param max_spins: maximum size of the spin system, centres included
+        :param nucleus: restrict the added spins to one nucleus, e.g. '1H'
+        :return: (atoms, nuclei, dipole table) with atoms the 0-based indices in the structure,
+                 nuclei their names and the table numbered 1..len(atoms) in that order
+        """
+        centres = [ int ( c ) for c in np.atleast_1d ( centres ) ]
+        best = { }
+        for c in centres :
+            for atom , dip in zip ( *self.above_threshold ( c , threshold , nucleus ) ) :
+                if atom not in centres and abs ( dip ) > best.get ( atom , 0.0 ) :
+                    best[ atom ] = abs ( dip )
+        others = sorted ( best , key=lambda a : -best[ a ] )
+        if max_spins is not None :
+            others = others[ :max ( 0 , max_spins - len ( centres ) ) ]
+        atoms = np.array ( centres + others , dtype=np.intp )
+
+        pair_data = pairwise_dipolar ( self.coord_xyz[ atoms ] , self.gyr[ atoms ] )
+        keep = np.abs ( pair_data[ 'dip' ] ) >= threshold
+        pair_data = { key : value[ keep ] for key , value in pair_data.items () }
+        return atoms , self.nuclei[ atoms ].tolist () , dipolar_table ( pair_data )
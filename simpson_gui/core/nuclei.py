@@ -0,0 +1,99 @@
+#%% Header files
+import csv
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+
+import numpy as np
+
+NMR_FREQ_TABLE = os.path.join ( os.path.dirname ( __file__ ) , '..' , 'resources' , 'NMR_freq_table.csv' )
+
+
+@dataclass ( frozen=True )
+class Nucleus :
+    """
+    One row of the NMR frequency table.
+    """
+    name: str
+    symbol: str
+    atomic_num: int
+    spin: float
+    gyr_rad: float
+    gyr_hz: float
+
+
+class NucleusRegistry :
+    """
+    Read-only view of the NMR frequency table with exact lookups by nucleus name
+    (1H, 13C, ...). Built once per process by load_nuclei and shared by every session.
+    """
+
+    def __init__(self , records) :
+        self._by_name = MappingProxyType ( { nucleus.name : nucleus for nucleus in records } )
+        self.names = tuple ( self._by_name )
+        self.gyr_by_name = MappingProxyType ( { name : n.gyr_hz for name , n in self._by_name.items () } )
+        self._index = MappingProxyType ( { name : k for k , name in enumerate ( self.names ) } )
+        self._gyr = np.array ( [ n.gyr_hz for n in self._by_name.values () ] )
+        self._gyr.flags.writeable = False
+        isotopes = { }
+        for nucleus in records :
+            best = isotopes.get ( nucleus.symbol )
+            if best is None or (best.spin != 0.5 and nucleus.spin == 0.5) :
+                isotopes[ nucleus.symbol ] = nucleus
+        self._default_isotope = MappingProxyType ( { s : n.name for s , n in isotopes.items () } )
+
+    def __getitem__(self , name) :
+        try :
+            return self._by_name[ name ]
+        except KeyError :
+            raise KeyError ( f"Unknown nucleus {name}" ) from None
+
+    def __contains__(self , name) :
+        return name in self._by_name
+
+    def __len__(self) :
+        return len ( self.names )
+
+    def gyr_hz(self , names) :
+        """
+        Gyromagnetic ratios in MHz/T for a sequence of nucleus names, as one array.
+        """
+        return self._gyr[ [ self._index[ name ] for name in names ] ]
+
+    def spin(self , name) :
+        return self[ name ].spin
+
+    def larmor_frequency(self , name , proton_frequency) :
+        """
+        Larmor frequency in Hz of a nucleus at the field given by its 1H frequency in Hz.
+        """
+        return proton_frequency * self[ name ].gyr_hz / self[ '1H' ].gyr_hz
+
+    def default_isotope(self , symbol) :
+        """
+        The first spin-1/2 isotope of an element in the table, or its first isotope if none is spin-1/2.
+        """
+        return self._default_isotope[ symbol ]
+
+
+def _number(value) :
+    """
+    Some rows of the table have no gyromagnetic ratio, read those as NaN like pandas does.
+    """
+    return float ( value ) if value.strip () else float ( 'nan' )
+
+
+@lru_cache ( maxsize=None )
+def load_nuclei(csv_file=NMR_FREQ_TABLE) :
+    """
+    Loads the NMR frequency table once per process.
+    :param csv_file: path of the table
+    :return: NucleusRegistry
+    """
+    with open ( csv_file , newline='' , encoding='utf-8-sig' ) as handle :
+        records = [ Nucleus ( name=row[ 'Name' ] , symbol=row[ 'Symbol' ] , atomic_num=int ( row[ 'AtomicNum' ] ) ,
+                              spin=_number ( row[ 'Spin' ] ) , gyr_rad=_number ( row[ 'GyrRad' ] ) ,
+                              gyr_hz=_number ( row[ 'GyrHz' ] ) )
+                    for row in csv.DictReader ( handle ) ]
+    return NucleusRegistry ( records )
@@ -0,0 +1,98 @@
+#%% Header files
+import ast
+import operator
+import re
+
+_OPERATORS = {
+    ast.Add : operator.add , ast.Sub : operator.sub , ast.Mult : operator.mul ,
+    ast.Div : operator.truediv , ast.Pow : operator.pow , ast.USub : operator.neg , ast.UAdd : operator.pos ,
+}
+
+
+#%% Functions
+def strip_comment(line) :
+    """
+    Tcl comments: a line starting with #, or ;# after a command.
+    """
+    if line.lstrip ().startswith ( '#' ) :
+        return ''
+    return re.sub ( r';\s*#.*$' , '' , line )
+
+
+def replace_block_entry(text , block , pattern , replacement , missing) :
+    """
+    Substitutes pattern inside the first block {...} of a SIMPSON input.
+    :param text: SIMPSON input text
+    :param block: block name, e.g. par or spinsys
+    :param pattern: regular expression matched line by line in the block
+    :param replacement: string or function, as for re.sub
+    :param missing: line appended to the block when pattern does not match, or None to raise ValueError
+    :return: new input text
+    """
+    match = re.search ( rf'\b{block}\s*\{{(.*?)\}}' , text , flags=re.S )
+    if match is None :
+        raise ValueError ( f"The input has no {block} block" )
+    body , count = re.subn ( pattern , replacement , match.group ( 1 ) , flags=re.M )
+    if count == 0 :
+        if missing is None :
+            raise ValueError ( f"Nothing matches {pattern} in the {block} block" )
+        indent = re.search ( r'^([ \t]*)\S' , body , flags=re.M )
+        body = body.rstrip () + '\n' + (indent.group ( 1 ) if indent else '    ') + missing + '\n'
+    return text[ :match.start ( 1 ) ] + body + text[ match.end ( 1 ) : ]
+
+
+def parse_par(text) :
+    """
+    Reads the par block of a SIMPSON input (the block itself or a whole file).
+    :param text: SIMPSON input text
+    :return: dict key -> value as written, e.g. {'spin_rate': '10000', 'method': 'direct freq'}
+    """
+    match = re.search ( r'\bpar\s*\{(.*?)\}' , text , flags=re.S )
+    body = match.group ( 1 ) if match else text
+    par = { }
+    for line in body.splitlines () :
+        line = line.split ( '#' , 1 )[ 0 ].strip ()
+        if not line :
+            continue
+        parts = line.split ( None , 1 )
+        par[ parts[ 0 ] ] = parts[ 1 ].strip () if len ( parts ) > 1 else ''
+    return par
+
+
+def _evaluate(node , par , seen) :
+    if isinstance ( node , ast.Expression ) :
+        return _evaluate ( node.body , par , seen )
+    if isinstance ( node , ast.Constant ) and isinstance ( node.value , (int , float) ) :
+        return float ( node.value )
+    if isinstance ( node , ast.BinOp ) and type ( node.op ) in _OPERATORS :
+        return _OPERATORS[ type ( node.op ) ] ( _evaluate ( node.left , par , seen ) , _evaluate ( node.right , par , seen ) )
+    if isinstance ( node , ast.UnaryOp ) and type ( node.op ) in _OPERATORS :
+        return _OPERATORS[ type ( node.op ) ] ( _evaluate ( node.operand , par , seen ) )
+    if isinstance ( node , ast.Name ) :
+        return par_number ( par , node.id , seen=seen )
+    raise ValueError ( "Only numbers, par keys and + - * / are supported" )
+
+
+def par_number(par , key , default=None , seen=None) :
+    """
+    Numerical value of a par entry. Entries may refer to other entries, e.g. sw = spin_rate
+    or sw = 2*spin_rate; the TCL forms $par(spin_rate) and [expr ...] are accepted too.
+    :param par: dict from parse_par
+    :param key: par key
+    :param default: returned when the key is missing
+    """
+    if key not in par :
+        if default is None :
+            raise KeyError ( f"par({key}) is not set" )
+        return float ( default )
+    seen = set () if seen is None else seen
+    if key in seen :
+        raise ValueError ( f"par({key}) refers to itself" )
+    seen = seen | { key }
+    expression = par[ key ].strip ()
+    expression = re.sub ( r'^\[\s*expr\s+(.*)\]$' , r'\1' , expression )
+    expression = re.sub ( r'\$par\((\w+)\)' , r'\1' , expression )
+    try :
+        return _evaluate ( ast.parse ( expression , mode='eval' ) , par , seen )
+    except SyntaxError :
+        raise ValueError ( f"Cannot read par({key}) = {par[ key ]}" ) from None
@@ -0,0 +1,146 @@
+#%% Header files
+import math
+import re
+
+from .par import parse_par , replace_block_entry
+from .shard import Shard
+from .spinsys import INTERACTION_FIELDS , parse_spinsys
+
+# One factor of a spin operator of par: I<spin number or n><component>, e.g. I1x, I2p, Inz
+OPERATOR_FACTOR = re.compile ( r'I(\d+|n)([a-z]+)' )
+
+
+#%% Functions
+def coupling_strength(interaction) :
+    """
+    Size in Hz of a dipole or jcoupling interaction, 0 for the others.
+    """
+    if interaction[ 'type' ] == 'dipole' :
+        return abs ( float ( interaction[ 'aniso' ] ) )
+    if interaction[ 'type' ] == 'jcoupling' :
+        return max ( abs ( float ( interaction[ 'iso' ] ) ) , abs ( float ( interaction[ 'aniso' ] ) ) )
+    return 0.0
+
+
+def coupling_clusters(spin_system , threshold=0.0) :
+    """
+    Groups of spins linked by dipolar or J couplings, the connected components of the coupling graph.
+    :param threshold: couplings below it (Hz) are cut; zero couplings are always cut
+    :return: (clusters as sorted lists of spin numbers from 1, ordered by their first spin,
+              cut couplings as (i, j, Hz) largest first)
+    """
+    parent = list ( range ( len ( spin_system.nuclei ) + 1 ) )
+
+    def root(k) :
+        while parent[ k ] != k :
+            parent[ k ] = parent[ parent[ k ] ]
+            k = parent[ k ]
+        return k
+
+    cut = [ ]
+    for interaction in spin_system.interactions :
+        if interaction[ 'type' ] not in ( 'dipole' , 'jcoupling' ) :
+            continue
+        strength = coupling_strength ( interaction )
+        if strength > 0 and strength >= threshold :
+            parent[ root ( interaction[ 'i' ] ) ] = root ( interaction[ 'j' ] )
+        elif strength > 0 :
+            cut.append ( (interaction[ 'i' ] , interaction[ 'j' ] , strength) )
+    clusters = { }
+    for spin in range ( 1 , len ( spin_system.nuclei ) + 1 ) :
+        clusters.setdefault ( root ( spin ) , [ ] ).append ( spin )
+    # weak couplings between spins that stronger ones join anyway stay in their cluster
+    member = { spin : k for k , cluster in enumerate ( clusters.values () ) for spin in cluster }
+    cut = [ (i , j , strength) for i , j , strength in cut if member[ i ] != member[ j ] ]
+    return sorted ( clusters.values () ) , sorted ( cut , key=lambda coupling : -coupling[ 2 ] )
+
+
+def spin_dimension(nucleus , nuclei=None) :
+    """
+    2I + 1 of a nucleus; spin 1/2 unless a NucleusRegistry is given.
+    """
+    return int ( round ( 2 * nuclei.spin ( nucleus ) + 1 ) ) if nuclei is not None else 2
+
+
+def _format(value) :
+    return value if isinstance ( value , str ) else f"{value:g}"
+
+
+def cluster_spinsys(spin_system , cluster) :
+    """
+    spinsys block of the spins of one cluster, numbered from 1 in their order, with the shifts,
+    quadrupoles and couplings among them. The channels of the whole system are kept so that the
+    pulses of the sequence still address the same channels.
+    """
+    number = { spin : k + 1 for k , spin in enumerate ( cluster ) }
+    lines = [ "spinsys {" , f"    channels {' '.join ( spin_system.channels )}" ,
+              f"    nuclei {' '.join ( spin_system.nuclei[ spin - 1 ] for spin in cluster )}" ]
+    for interaction in spin_system.interactions :
+        if interaction[ 'i' ] not in number or interaction.get ( 'j' , interaction[ 'i' ] ) not in number :
+            continue
+        values = [ number[ interaction[ name ] ] if name in ( 'i' , 'j' ) else _format ( interaction[ name ] )
+                   for name in INTERACTION_FIELDS[ interaction[ 'type' ] ] ]
+        lines.append ( f"    {interaction[ 'type' ]} {' '.join ( str ( value ) for value in values )}" )
+    return '\n'.join ( lines + [ "}" ] )
+
+
+def cluster_operator(operator , cluster) :
+    """
+    Part of a start or detect operator acting on one cluster, renumbered as in cluster_spinsys.
+    :param operator: sum of products of I<spin><component> factors, e.g. 'I1x', 'Inz', 'I1x+I2x'
+    :return: operator, or None if it has no term on the cluster
+    """
+    number = { spin : k + 1 for k , spin in enumerate ( cluster ) }
+    terms = [ ]
+    for term in operator.replace ( ' ' , '' ).split ( '+' ) :
+        factors = OPERATOR_FACTOR.findall ( term )
+        if not factors or ''.join ( f"I{spin}{component}" for spin , component in factors ) != term :
+            raise ValueError ( f"Cannot split the operator {operator} between clusters" )
+        spins = { int ( spin ) for spin , _ in factors if spin != 'n' }
+        if spins and not spins <= set ( number ) :
+            if spins & set ( number ) :
+                raise ValueError ( f"The operator {term} couples spins of different clusters" )
+            continue
+        terms.append ( ''.join ( f"I{spin if spin == 'n' else number[ int ( spin ) ]}{component}"
+                                 for spin , component in factors ) )
+    return '+'.join ( terms ) or None
+
+
+def split_clusters(text , threshold=0.0 , prefix='cluster' , nuclei=None) :
+    """
+    Splits a SIMPSON input into one input per cluster of coupled spins, see coupling_clusters.
+    Without couplings between the clusters the result of the whole input is the sum of the cluster
+    results, weighted by the dimension of the spins each cluster leaves out (SIMPSON takes the trace
+    over the whole space). With a threshold, couplings below it are dropped, which is approximate.
+    Clusters on which the start or detect operator vanishes give no signal and are left out.
+    :param nuclei: NucleusRegistry, for spins above 1/2
+    :return: list of Shard, merged with core.shard.merge_results like crystallite shards
+    """
+    spin_system = parse_spinsys ( text )
+    par = parse_par ( text )
+    operators = { key : par.get ( key ) for key in ( 'start_operator' , 'detect_operator' ) }
+    if None in operators.values () :
+        raise ValueError ( "The input needs a start_operator and a detect_operator" )
+    clusters , _ = coupling_clusters ( spin_system , threshold )
+    dimensions = [ spin_dimension ( nucleus , nuclei ) for nucleus in spin_system.nuclei ]
+    total = math.prod ( dimensions )
+    width = len ( str ( max ( len ( clusters ) - 1 , 0 ) ) )
+    shards = [ ]
+    for k , cluster in enumerate ( clusters ) :
+        parts = { key : cluster_operator ( operator , cluster ) for key , operator in operators.items () }
+        if None in parts.values () :
+            continue
+        name = f"{prefix}_{k:0{width}d}"
+        cluster_text = re.sub ( r'spinsys\s*\{.*?\}' , lambda _ : cluster_spinsys ( spin_system , cluster ) , text ,
+                                count=1 , flags=re.S )
+        for key , part in parts.items () :
+            cluster_text = replace_block_entry ( cluster_text , 'par' , rf'^(\s*{key}\s+)\S.*?$' ,
+                                                  lambda m , part=part : m.group ( 1 ) + part , None )
+        if 'name' in par :
+            cluster_text = replace_block_entry ( cluster_text , 'par' , r'^(\s*name\s+)\S.*?$' ,
+                                                  lambda m : m.group ( 1 ) + name , None )
+        weight = total / math.prod ( dimensions[ spin - 1 ] for spin in cluster )
+        shards.append ( Shard ( name=name , text=cluster_text , weight=float ( weight ) ) )
+    if not shards :
+        raise ValueError ( "The start or detect operator vanishes on every cluster" )
+    return shards
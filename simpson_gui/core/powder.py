@@ -0,0 +1,200 @@
+#%% Header files
+import os
+import re
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+RESOURCES = os.path.join ( os.path.dirname ( __file__ ) , '..' , 'resources' )
+REPULSION_SOURCES = tuple ( os.path.join ( RESOURCES , f'repangles_{part}.txt' ) for part in ( 'num' , 'alpha' , 'beta' ) )
+REPULSION_STORE = ( 'repangles_packed.npy' , 'repangles_index.npy' )
+
+# ZCW constants (c1, c2, c3) for the full sphere, a hemisphere and an octant,
+# Eden & Levitt, J. Magn. Reson. 132 (1998) 220
+ZCW_CONSTANTS = {
+    1 : (1.0 , 2.0 , 1.0) ,
+    0.5 : (-1.0 , 1.0 , 1.0) ,
+    0.25 : (-1.0 , 1.0 , 4.0) ,
+}
+
+# Held while the repulsion store is checked and built, so that the sessions of one server build it once
+_STORE_LOCK = threading.Lock ()
+
+
+#%% Functions
+def zcw_fibonacci(n) :
+    """
+    Fibonacci numbers behind a ZCW set of n orientations, from g_0 = 8, g_1 = 13.
+    The SIMPSON sets are named after g_M - 1 (zcw20, zcw33, ..., zcw28656): they leave
+    out the j = 0 point on the pole. A set of exactly g_M points keeps it.
+    :param n: number of orientations
+    :return: (g_M, g_{M-2}, first index j), or None if neither n nor n + 1 is a Fibonacci number
+    """
+    g = [ 5 , 8 , 13 ]
+    while g[ -1 ] < n + 1 :
+        g.append ( g[ -1 ] + g[ -2 ] )
+    for k in range ( 2 , len ( g ) ) :
+        if g[ k ] == n :
+            return g[ k ] , g[ k - 2 ] , 0
+        if g[ k ] == n + 1 :
+            return g[ k ] , g[ k - 2 ] , 1
+    return None
+
+
+def zcw_angles(n , zcw_type=1) :
+    """
+    ZCW orientations computed with the exact Fibonacci indices.
+    If neither n nor n + 1 is a Fibonacci number, g_{M-2} is estimated as round(n / 2.618).
+    :param n: number of orientations
+    :param zcw_type: 1 (sphere), 0.5 (hemisphere) or 0.25 (octant)
+    :return: (alpha, beta, weights) arrays, angles in degrees and weights summing to one
+    """
+    if zcw_type not in ZCW_CONSTANTS :
+        raise ValueError ( "Unsupported ZCW type. Use 1, 0.5, or 0.25." )
+    c1 , c2 , c3 = ZCW_CONSTANTS[ zcw_type ]
+    numbers = zcw_fibonacci ( n )
+    if numbers is None :
+        g_m , g_m2 , first = n , int ( round ( n / 2.618 ) ) , 0
+    else :
+        g_m , g_m2 , first = numbers
+
+    j = np.arange ( first , first + n , dtype=np.int64 )
+    beta = np.degrees ( np.arccos ( np.clip ( c1 * (c2 * ((j / g_m) % 1.0) - 1.0) , -1.0 , 1.0 ) ) )
+    # j * g_{M-2} is done in integers so that it stays exact for large sets
+    alpha = 360.0 * (((j * g_m2) % g_m) / g_m) / c3
+    weights = np.full ( n , 1.0 / n )
+    return alpha , beta , weights
+
+
+def bcr_angles(n) :
+    """
+    BCR orientations as generated on the Parameters page, with equal weights.
+    :return: (alpha, beta, weights) arrays, angles in degrees
+    """
+    indices = np.arange ( 0 , n , dtype=float ) + 0.5
+    phi = 2 * np.pi * indices / n
+    theta = np.arccos ( 1 - 2 * indices / n )
+    return np.degrees ( phi ) , np.degrees ( theta ) , np.full ( n , 1.0 / n )
+
+
+def build_repulsion_store(directory , sources=REPULSION_SOURCES) :
+    """
+    Packs the repulsion sets of the text tables into one binary array, set after set,
+    with an index of (number of orientations, offset, count) per set.
+    The tables hold one set per column, zero padded, with alpha in -180..180 and beta as
+    the elevation from the xy plane; the store holds alpha in 0..360 and the polar angle.
+    Each file is written under a temporary name and moved into place, so that a reader
+    never maps a partly written array.
+    :param directory: where the two .npy files are written
+    :return: paths of the packed array and of the index
+    """
+    num_file , alpha_file , beta_file = sources
+    sizes = np.atleast_1d ( np.loadtxt ( num_file , dtype=float ) ).astype ( np.int64 )
+    alpha = np.loadtxt ( alpha_file , dtype=float )
+    beta = np.loadtxt ( beta_file , dtype=float )
+
+    counts = np.minimum ( sizes , alpha.shape[ 0 ] )
+    offsets = np.concatenate ( ( [ 0 ] , np.cumsum ( counts )[ :-1 ] ) )
+    packed = np.empty ( (counts.sum () , 2) )
+    for column , (offset , count) in enumerate ( zip ( offsets , counts ) ) :
+        packed[ offset :offset + count , 0 ] = alpha[ :count , column ] % 360.0
+        packed[ offset :offset + count , 1 ] = 90.0 - beta[ :count , column ]
+
+    paths = tuple ( os.path.join ( directory , name ) for name in REPULSION_STORE )
+    os.makedirs ( directory , exist_ok=True )
+    for path , array in zip ( paths , ( packed , np.column_stack ( (sizes , offsets , counts) ) ) ) :
+        staging = f"{path}.{os.getpid ()}.{threading.get_ident ()}.tmp"
+        with open ( staging , 'wb' ) as handle :
+            np.save ( handle , array )
+        os.replace ( staging , path )
+    return paths
+
+
+def _store_directory() :
+    """
+    The resources folder if it can be written to, a user cache folder otherwise.
+    """
+    if os.access ( RESOURCES , os.W_OK ) :
+        return RESOURCES
+    return os.path.join ( os.path.expanduser ( '~' ) , '.cache' , 'simpson_gui' )
+
+
+@lru_cache ( maxsize=None )
+def repulsion_store() :
+    """
+    Memory-mapped repulsion store, built from the text tables on first use or when they changed.
+    :return: (dict number of orientations -> (offset, count), packed (M, 2) array)
+    """
+    directory = _store_directory ()
+    paths = tuple ( os.path.join ( directory , name ) for name in REPULSION_STORE )
+    newest_source = max ( os.path.getmtime ( source ) for source in REPULSION_SOURCES )
+    with _STORE_LOCK :
+        if not all ( os.path.exists ( path ) and os.path.getmtime ( path ) >= newest_source for path in paths ) :
+            paths = build_repulsion_store ( directory )
+    packed = np.load ( paths[ 0 ] , mmap_mode='r' )
+    index = { int ( n ) : (int ( offset ) , int ( count )) for n , offset , count in np.load ( paths[ 1 ] ) }
+    return index , packed
+
+
+def repulsion_sizes() :
+    """
+    Numbers of orientations for which a repulsion set exists.
+    """
+    return tuple ( repulsion_store ()[ 0 ] )
+
+
+def repulsion_angles(n) :
+    """
+    One repulsion set, read as a single slice of the memory-mapped store.
+    :param n: number of orientations, e.g. 144 for rep144
+    :return: (alpha, beta, weights) arrays, angles in degrees
+    """
+    index , packed = repulsion_store ()
+    if int ( n ) not in index :
+        raise KeyError ( f"No repulsion set with {n} orientations" )
+    offset , count = index[ int ( n ) ]
+    angles = np.array ( packed[ offset :offset + count ] )
+    return angles[ : , 0 ] , angles[ : , 1 ] , np.full ( count , 1.0 / count )
+
+
+def crystal_file_angles(name) :
+    """
+    Orientations of a SIMPSON crystal file name that can be generated here:
+    zcwN, bcrN, repN (for the tabulated sets), alpha0beta0 and alpha0beta90.
+    :return: (alpha, beta, weights) arrays, angles in degrees
+    """
+    if name == 'alpha0beta0' :
+        return np.zeros ( 1 ) , np.zeros ( 1 ) , np.ones ( 1 )
+    if name == 'alpha0beta90' :
+        return np.zeros ( 1 ) , np.full ( 1 , 90.0 ) , np.ones ( 1 )
+    match = re.fullmatch ( r'([A-Za-z]+)([0-9]+)' , name )
+    scheme , n = (match.group ( 1 ) , int ( match.group ( 2 ) )) if match else (None , 0)
+    if scheme == 'zcw' :
+        return zcw_angles ( n )
+    if scheme == 'bcr' :
+        return bcr_angles ( n )
+    if scheme == 'rep' and n in repulsion_sizes () :
+        return repulsion_angles ( n )
+    raise ValueError ( f"Cannot generate the crystal file {name}" )
+
+
+def crystal_file_text(alpha , beta , weights , gamma=None) :
+    """
+    SIMPSON crystal file: the number of crystallites on the first line, then
+    'alpha beta weight' (or 'alpha beta gamma weight') per line, angles in degrees.
+    """
+    columns = [ alpha , beta ] + ([ ] if gamma is None else [ gamma ]) + [ weights ]
+    table = np.column_stack ( columns )
+    lines = [ f"{len ( table )}" ]
+    row_format = ' '.join ( [ '%.6f' ] * (len ( columns ) - 1) + [ '%.10e' ] )
+    lines.extend ( row_format % tuple ( row ) for row in table )
+    return '\n'.join ( lines ) + '\n'
+
+
+def write_crystal_file(path , alpha , beta , weights , gamma=None) :
+    """
+    Writes a SIMPSON crystal file, see crystal_file_text.
+    """
+    with open ( path , 'w' ) as handle :
+        handle.write ( crystal_file_text ( alpha , beta , weights , gamma ) )
@@ -0,0 +1,412 @@
+#%% Header files
+import re
+
+import numpy as np
+
+from .lazy import LazyImport
+from .par import par_number
+from .powder import crystal_file_angles
+from .spinsys import to_hz
+
+Rot = LazyImport ( 'scipy.spatial.transform' , 'Rotation' )
+sparse = LazyImport ( 'scipy.sparse' )
+
+MAX_SPINS = 12
+# Larger spin systems go to the sparse Krylov engine of core.krylov
+DENSE_SPINS = 6
+MAGIC_ANGLE = np.degrees ( np.arccos ( 1 / np.sqrt ( 3 ) ) )
+# Bound on the matrix elements of the step propagators held at once, about 270 MB
+CHUNK_ELEMENTS = 1 << 24
+# maxdt values in µs tried by largest_maxdt, each half the previous one
+MAXDT_CANDIDATES = tuple ( 32.0 / 2 ** k for k in range ( 10 ) )
+
+_PAULI = {
+    'x' : np.array ( [ [ 0 , 0.5 ] , [ 0.5 , 0 ] ] , dtype=complex ) ,
+    'y' : np.array ( [ [ 0 , -0.5j ] , [ 0.5j , 0 ] ] ) ,
+    'z' : np.array ( [ [ 0.5 , 0 ] , [ 0 , -0.5 ] ] , dtype=complex ) ,
+    'p' : np.array ( [ [ 0 , 1 ] , [ 0 , 0 ] ] , dtype=complex ) ,
+    'm' : np.array ( [ [ 0 , 0 ] , [ 1 , 0 ] ] , dtype=complex ) ,
+}
+
+
+#%% Functions
+def spin_operator(n_spins , k , axis , sparse_format=False) :
+    """
+    Single-spin operator of spin k (from 0) in the product basis of n_spins spins 1/2.
+    :param axis: 'x', 'y', 'z', 'p' (raising) or 'm' (lowering)
+    :param sparse_format: return a scipy.sparse CSR matrix instead of a dense array
+    """
+    if sparse_format :
+        result = sparse.identity ( 1 , dtype=complex , format='csr' )
+        for spin in range ( n_spins ) :
+            factor = _PAULI[ axis ] if spin == k else sparse.identity ( 2 , format='csr' )
+            result = sparse.kron ( result , factor , format='csr' )
+        return result
+    result = np.ones ( (1 , 1) , dtype=complex )
+    for spin in range ( n_spins ) :
+        result = np.kron ( result , _PAULI[ axis ] if spin == k else np.eye ( 2 ) )
+    return result
+
+
+def parse_operator(text , n_spins , sparse_format=False) :
+    """
+    Reads a SIMPSON start or detect operator such as I1x, Inz or I1p+I2p (n means all spins).
+    :return: (2^n, 2^n) complex matrix, dense or CSR
+    """
+    terms = re.findall ( r'([+-]?)\s*I(\d+|n)([xyzpm])' , text )
+    if not terms or re.sub ( r'[+-]?\s*I(\d+|n)[xyzpm]' , '' , text ).strip () :
+        raise ValueError ( f"Unsupported operator {text}, use terms like I1x, Inz or I2p" )
+    shape = (2 ** n_spins , 2 ** n_spins)
+    operator = sparse.csr_matrix ( shape , dtype=complex ) if sparse_format else np.zeros ( shape , dtype=complex )
+    for sign , spin , axis in terms :
+        spins = range ( n_spins ) if spin == 'n' else [ int ( spin ) - 1 ]
+        for k in spins :
+            if not 0 <= k < n_spins :
+                raise ValueError ( f"Operator {text} refers to spin {k + 1} of a {n_spins}-spin system" )
+            operator = operator + (-1 if sign == '-' else 1) * spin_operator ( n_spins , k , axis , sparse_format )
+    return operator
+
+
+def _crystal_tensor(aniso , eta , alpha , beta , gamma) :
+    """
+    Traceless tensor in the crystal frame from its PAS values, as in core.convergence.
+    """
+    pas = np.diag ( [ -0.5 * aniso * (1 + eta) , -0.5 * aniso * (1 - eta) , aniso ] )
+    rotation = Rot.from_euler ( 'zyz' , [ alpha , beta , gamma ] , degrees=True ).as_matrix ()
+    return rotation @ pas @ rotation.T
+
+
+def _coupling_operators(n_spins , i , j , homonuclear , sparse_format=False) :
+    """
+    Secular two-spin operators: (isotropic part, anisotropic part). The anisotropic part is
+    2IzSz - IxSx - IySy between like spins and 2IzSz between unlike spins.
+    """
+    products = { axis : spin_operator ( n_spins , i , axis , sparse_format ) @ spin_operator ( n_spins , j , axis , sparse_format )
+                 for axis in 'xyz' }
+    if homonuclear :
+        return products[ 'x' ] + products[ 'y' ] + products[ 'z' ] , 2 * products[ 'z' ] - products[ 'x' ] - products[ 'y' ]
+    return products[ 'z' ] , 2 * products[ 'z' ]
+
+
+def spin_hamiltonian(spin_system , proton_frequency , nuclei , sparse_format=False) :
+    """
+    Secular rotating-frame Hamiltonian of a spin system of spins 1/2, in Hz.
+    :param spin_system: SpinSystem from core.spinsys.parse_spinsys
+    :param proton_frequency: 1H Larmor frequency in Hz, for values given in ppm
+    :param nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    :param sparse_format: build CSR matrices, the operators then come as a list
+    :return: (isotropic (d, d) matrix, (T, 3, 3) crystal-frame tensors, (T, d, d) operators),
+             the Hamiltonian being H0 + sum_t (b^T tensor_t b) operator_t for a field direction b
+    """
+    n_spins = len ( spin_system.nuclei )
+    if not 1 <= n_spins <= MAX_SPINS :
+        raise ValueError ( f"The preview handles 1 to {MAX_SPINS} spins, the spin system has {n_spins}" )
+    for name in spin_system.nuclei :
+        if nuclei.spin ( name ) != 0.5 :
+            raise ValueError ( f"The preview handles spins 1/2 only, {name} has spin {nuclei.spin ( name )}" )
+
+    dim = 2 ** n_spins
+    h_iso = sparse.csr_matrix ( (dim , dim) ) if sparse_format else np.zeros ( (dim , dim) , dtype=complex )
+    tensors , operators = [ ] , [ ]
+    for interaction in spin_system.interactions :
+        kind = interaction[ 'type' ]
+        i = interaction[ 'i' ] - 1
+        nucleus = spin_system.nuclei[ i ]
+        aniso = to_hz ( interaction[ 'aniso' ] , nucleus , proton_frequency , nuclei )
+        iso = to_hz ( interaction.get ( 'iso' , 0.0 ) , nucleus , proton_frequency , nuclei )
+        eta = float ( interaction.get ( 'eta' , 0.0 ) )
+        if kind == 'shift' :
+            iso_operator = aniso_operator = spin_operator ( n_spins , i , 'z' , sparse_format )
+        elif kind in ( 'jcoupling' , 'dipole' ) :
+            j = interaction[ 'j' ] - 1
+            homonuclear = spin_system.nuclei[ j ] == nucleus
+            iso_operator , aniso_operator = _coupling_operators ( n_spins , i , j , homonuclear , sparse_format )
+        else :
+            raise ValueError ( f"The preview does not handle {kind} interactions" )
+        h_iso = h_iso + iso * iso_operator
+        if aniso != 0.0 :
+            tensors.append ( _crystal_tensor ( aniso , eta , interaction[ 'alpha' ] , interaction[ 'beta' ] ,
+                                               interaction[ 'gamma' ] ) )
+            operators.append ( aniso_operator )
+    tensors = np.array ( tensors ).reshape ( -1 , 3 , 3 )
+    if not sparse_format :
+        operators = np.array ( operators ).reshape ( -1 , dim , dim )
+    return h_iso , tensors , operators
+
+
+class Rotor :
+    """
+    Anisotropic coefficients of a stack of crystallites under MAS. The field direction in the
+    rotor frame is (sin theta cos phi, sin theta sin phi, cos theta) with phi = gamma + wr t;
+    the crystal-frame tensors are rotated into the rotor frame once, so every step costs one contraction.
+    """
+
+    def __init__(self , tensors , alpha , beta , gamma , spin_rate , rotor_angle) :
+        rotation = Rot.from_euler ( 'ZY' , np.column_stack ( (alpha , beta) ) , degrees=True ).as_matrix ()
+        self.rotor_tensors = np.einsum ( 'kai,tab,kbj->ktij' , rotation , tensors , rotation )
+        self.gamma = np.broadcast_to ( np.radians ( gamma ) , (len ( rotation ) ,) )
+        self.spin_rate = spin_rate
+        self.theta = np.radians ( rotor_angle )
+
+    def scales(self , time) :
+        """
+        b^T tensor b for every crystallite and tensor at a given time, as a (K, T) array.
+        """
+        phase = self.gamma + 2 * np.pi * self.spin_rate * time
+        field = np.array ( [ np.sin ( self.theta ) * np.cos ( phase ) , np.sin ( self.theta ) * np.sin ( phase ) ,
+                             np.full_like ( phase , np.cos ( self.theta ) ) ] )
+        return np.einsum ( 'ik,ktij,jk->kt' , field , self.rotor_tensors , field )
+
+
+class _Stack ( Rotor ) :
+    """
+    Dense Hamiltonians and propagators of a stack of crystallites.
+    """
+
+    def __init__(self , h_iso , tensors , operators , alpha , beta , gamma , spin_rate , rotor_angle) :
+        super ().__init__ ( tensors , alpha , beta , gamma , spin_rate , rotor_angle )
+        self.h_iso = h_iso.real
+        self.operators = operators.real
+
+    def hamiltonians(self , time) :
+        return self.h_iso + np.einsum ( 'kt,tab->kab' , self.scales ( time ) , self.operators )
+
+    def step(self , time , dt) :
+        """
+        Propagators of the stack over one step of length dt centred on time, by diagonalisation.
+        """
+        energies , vectors = np.linalg.eigh ( self.hamiltonians ( time ) )
+        return (vectors * np.exp ( -2j * np.pi * energies * dt )[ : , None , : ]) @ vectors.transpose ( 0 , 2 , 1 )
+
+    def propagator(self , start , length , maxdt) :
+        """
+        Propagators over [start, start + length] as a product of steps no longer than maxdt.
+        """
+        n_steps = max ( int ( np.ceil ( length / maxdt - 1e-9 ) ) , 1 ) if self.spin_rate else 1
+        dt = length / n_steps
+        total = self.step ( start + 0.5 * dt , dt )
+        for step in range ( 1 , n_steps ) :
+            total = self.step ( start + (step + 0.5) * dt , dt ) @ total
+        return total
+
+
+def _synchronisation(dwell , spin_rate) :
+    """
+    How the dwell time relates to the rotor period: ('period', m) if it is m rotor periods,
+    ('segments', k) if a rotor period holds k dwell times, (None, 0) otherwise.
+    """
+    ratio = dwell * spin_rate
+    if ratio >= 1 and abs ( ratio - round ( ratio ) ) < 1e-9 :
+        return 'period' , int ( round ( ratio ) )
+    if 0 < ratio < 1 and abs ( 1 / ratio - round ( 1 / ratio ) ) < 1e-9 :
+        return 'segments' , int ( round ( 1 / ratio ) )
+    return None , 0
+
+
+def _periodic_fid(segments , rho0 , detect , weights , n_points) :
+    """
+    FID when the propagation repeats every len(segments) dwell times. The repeating propagator
+    is diagonalised once, so that every point costs a phase multiplication instead of a propagation.
+    :param segments: list of (K, d, d) propagators over consecutive dwell times
+    """
+    partial = [ np.broadcast_to ( np.eye ( rho0.shape[ 0 ] ) , segments[ 0 ].shape ) ]
+    for segment in segments[ :-1 ] :
+        partial.append ( segment @ partial[ -1 ] )
+    period = segments[ -1 ] @ partial[ -1 ]
+    eigenvalues , vectors = np.linalg.eig ( period )
+    inverse = np.linalg.inv ( vectors )
+    angles = np.angle ( eigenvalues )
+    phase = np.exp ( 1j * (angles[ : , : , None ] - angles[ : , None , : ]) )
+    rho = inverse @ rho0 @ vectors
+    # fid[point] is a dot product of fixed amplitudes with phases that advance once per repetition
+    amplitudes = [ (weights[ : , None , None ] * (inverse @ u.conj ().transpose ( 0 , 2 , 1 ) @ detect @ u @ vectors)
+                    .transpose ( 0 , 2 , 1 ) * rho).ravel () for u in partial ]
+    # only the coherences seen by the detect operator are followed
+    kept = np.flatnonzero ( np.max ( np.abs ( amplitudes ) , axis=0 ) > 1e-12 * max ( np.abs ( amplitudes ).max () , 1e-300 ) )
+    amplitudes = [ amplitude[ kept ] for amplitude in amplitudes ]
+    phase = phase.ravel ()[ kept ]
+    current = np.ones_like ( phase )
+    fid = np.zeros ( n_points , dtype=complex )
+    for point in range ( n_points ) :
+        offset = point % len ( segments )
+        fid[ point ] = amplitudes[ offset ] @ current
+        if offset == len ( segments ) - 1 :
+            current *= phase
+    return fid
+
+
+def _stepped_fid(stack , dwell , maxdt , rho0 , detect , weights , n_points) :
+    """
+    FID when nothing repeats: the density matrices are propagated point after point.
+    """
+    rho = np.broadcast_to ( rho0 , (len ( weights ) ,) + rho0.shape )
+    fid = np.zeros ( n_points , dtype=complex )
+    for point in range ( n_points ) :
+        fid[ point ] = np.einsum ( 'k,ab,kba->' , weights , detect , rho )
+        if point < n_points - 1 :
+            step = stack.propagator ( point * dwell , dwell , maxdt )
+            rho = step @ rho @ step.conj ().transpose ( 0 , 2 , 1 )
+    return fid
+
+
+def acquisition(par) :
+    """
+    Acquisition settings of a par block.
+    :return: (proton_frequency, spin_rate, rotor_angle, np, dwell time in s)
+    """
+    spin_rate = par_number ( par , 'spin_rate' , 0 )
+    return (par_number ( par , 'proton_frequency' ) , spin_rate ,
+            par_number ( par , 'rotor_angle' , MAGIC_ANGLE if spin_rate else 0 ) , int ( par_number ( par , 'np' ) ) ,
+            1.0 / par_number ( par , 'sw' ))
+
+
+def _powder(par) :
+    """
+    Crystal file orientations, their weights shared between the gamma angles, and the gamma angles.
+    """
+    alpha , beta , weights = crystal_file_angles ( par.get ( 'crystal_file' , 'alpha0beta0' ) )
+    n_gamma = max ( int ( par_number ( par , 'gamma_angles' , 1 ) ) , 1 )
+    return alpha , beta , weights / n_gamma , 360.0 * np.arange ( n_gamma ) / n_gamma
+
+
+def crystallites(par) :
+    """
+    Every crystallite of a par block: the crystal file orientations times gamma_angles equally spaced gamma angles.
+    :return: (alpha, beta, gamma, weights) arrays, angles in degrees
+    """
+    alpha , beta , weights , gammas = _powder ( par )
+    return (np.repeat ( alpha , len ( gammas ) ) , np.repeat ( beta , len ( gammas ) ) , np.tile ( gammas , len ( alpha ) ) ,
+            np.repeat ( weights , len ( gammas ) ))
+
+
+def conjugated(fid , par) :
+    """
+    The FID, complex conjugated if conjugate_fid is set in the par block.
+    """
+    if str ( par.get ( 'conjugate_fid' , 'false' ) ).lower () in ( 'true' , '1' ) :
+        return fid.conj ()
+    return fid
+
+
+def simulate_fid(spin_system , par , nuclei , maxdt=1e-6 , max_elements=CHUNK_ELEMENTS , rf=0.0) :
+    """
+    FID of a spin system under MAS, computed in-process as a preview of the SIMPSON run.
+    Only free evolution from start_operator is simulated: the pulse sequence is ignored.
+    When the dwell time is a whole number of rotor periods, or a rotor period a whole number of
+    dwell times, the step propagators of one rotor period are computed once and reused, like
+    store/prop in a SIMPSON pulseq; the gamma angles then only shift the steps in time.
+    Above DENSE_SPINS spins the sparse state-vector engine of core.krylov is used instead.
+    :param spin_system: SpinSystem from core.spinsys.parse_spinsys
+    :param par: dict from core.par.parse_par
+    :param nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    :param maxdt: longest step in s over which the Hamiltonian is taken as constant
+    :param max_elements: bound on the number of matrix elements held at once
+    :param rf: constant rf field along x on every spin in Hz, up to DENSE_SPINS spins
+    :return: (time in s, complex FID)
+    """
+    n_spins = len ( spin_system.nuclei )
+    if n_spins > DENSE_SPINS :
+        if rf :
+            raise ValueError ( f"An rf field is only simulated for up to {DENSE_SPINS} spins" )
+        from .krylov import krylov_fid
+        time , fid = krylov_fid ( spin_system , par , nuclei , maxdt=maxdt )
+        return time , conjugated ( fid , par )
+
+    proton_frequency , spin_rate , rotor_angle , n_points , dwell = acquisition ( par )
+    h_iso , tensors , operators = spin_hamiltonian ( spin_system , proton_frequency , nuclei )
+    h_iso = h_iso + rf * sum ( spin_operator ( n_spins , k , 'x' ) for k in range ( n_spins ) )
+    rho0 = parse_operator ( par.get ( 'start_operator' , 'Inx' ) , n_spins )
+    detect = parse_operator ( par.get ( 'detect_operator' , 'Inp' ) , n_spins )
+    alpha , beta , weights , gammas = _powder ( par )
+    n_gamma = len ( gammas )
+    mode , count = _synchronisation ( dwell , spin_rate )
+
+    if mode is not None :
+        # steps per rotor period, a multiple of the gamma angles and of the dwell times per period
+        per_period = 1 if mode == 'period' else count
+        multiple = np.lcm ( n_gamma , per_period )
+        n_steps = multiple * max ( int ( np.ceil ( 1.0 / (spin_rate * maxdt * multiple) - 1e-9 ) ) , 1 )
+        dt = 1.0 / (spin_rate * n_steps)
+    else :
+        n_steps = 1
+    chunk = max ( max_elements // (n_steps * 4 ** n_spins) , 1 )
+
+    fid = np.zeros ( n_points , dtype=complex )
+    for first in range ( 0 , len ( alpha ) , chunk ) :
+        part = slice ( first , first + chunk )
+        if mode is None :
+            for gamma in gammas :
+                stack = _Stack ( h_iso , tensors , operators , alpha[ part ] , beta[ part ] , gamma , spin_rate ,
+                                 rotor_angle )
+                if spin_rate :
+                    fid += _stepped_fid ( stack , dwell , maxdt , rho0 , detect , weights[ part ] , n_points )
+                else :
+                    fid += _periodic_fid ( [ stack.step ( 0.0 , dwell ) ] , rho0 , detect , weights[ part ] , n_points )
+            continue
+        stack = _Stack ( h_iso , tensors , operators , alpha[ part ] , beta[ part ] , 0.0 , spin_rate , rotor_angle )
+        steps = np.array ( [ stack.step ( (k + 0.5) * dt , dt ) for k in range ( n_steps ) ] )
+        # a gamma angle is a shift in time by a whole number of steps: all gamma angles are stacked together
+        length = n_steps // per_period
+        segments = [ ]
+        for first_step in range ( 0 , n_steps , length ) :
+            order = (np.arange ( first_step , first_step + length )[ : , None ] +
+                     np.arange ( n_gamma )[ None , : ] * (n_steps // n_gamma)) % n_steps
+            total = np.concatenate ( steps[ order[ 0 ] ] )
+            for k in order[ 1 : ] :
+                total = np.concatenate ( steps[ k ] ) @ total
+            segments.append ( total )
+        if mode == 'period' :
+            segments = [ np.linalg.matrix_power ( segments[ 0 ] , count ) ]
+        fid += _periodic_fid ( segments , rho0 , detect , np.tile ( weights[ part ] , n_gamma ) , n_points )
+
+    return np.arange ( n_points ) * dwell , conjugated ( fid , par )
+
+
+def largest_maxdt(spin_system , par , nuclei , tolerance=1e-2 , candidates=MAXDT_CANDIDATES , rf=0.0 ,
+                  crystal_file='zcw54' , max_points=128) :
+    """
+    Largest maxdt for which halving the step changes the FID by less than tolerance, from
+    preview FIDs at decreasing steps (step doubling). The step error comes from the rotor
+    modulation of terms that do not commute with the rest of the Hamiltonian, so a small crystal
+    file, one gamma angle and at most max_points points are enough. The pulses of the sequence
+    are not simulated: a constant rf field of their amplitude stands in for them.
+    :param spin_system: SpinSystem from core.spinsys.parse_spinsys, up to DENSE_SPINS spins
+    :param par: dict from core.par.parse_par
+    :param nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    :param tolerance: largest relative difference ||fid(dt) - fid(dt/2)|| / ||fid(dt/2)||
+    :param candidates: maxdt values in µs, from the largest, each half the previous one
+    :param rf: rf amplitude of the sequence in Hz
+    :return: (maxdt in µs, or None if even the smallest candidate does not converge,
+             list of (maxdt, relative difference to the next candidate))
+    """
+    if len ( spin_system.nuclei ) > DENSE_SPINS :
+        raise ValueError ( f"The step size search handles up to {DENSE_SPINS} spins" )
+    n_points = min ( int ( par_number ( par , 'np' , max_points ) ) , max_points )
+    par = dict ( par , crystal_file=crystal_file , gamma_angles='1' , np=str ( n_points ) )
+    history = [ ]
+    previous = None
+    for maxdt in candidates :
+        _ , fid = simulate_fid ( spin_system , par , nuclei , maxdt=maxdt * 1e-6 , rf=rf )
+        if previous is not None :
+            difference = np.linalg.norm ( previous[ 1 ] - fid ) / max ( np.linalg.norm ( fid ) , 1e-300 )
+            history.append ( (previous[ 0 ] , float ( difference )) )
+            if difference <= tolerance :
+                return previous[ 0 ] , history
+        previous = (maxdt , fid)
+    return None , history
+
+
+def fid_to_spectrum(fid , sw , zero_fill=1 , lb=0.0) :
+    """
+    Spectrum of a FID with exponential line broadening, as fzerofill / faddlb / fft in SIMPSON.
+    :param sw: spectral width in Hz
+    :param zero_fill: zero-filling factor
+    :param lb: line broadening in Hz (FWHM)
+    :return: (frequency in Hz, complex spectrum)
+    """
+    time = np.arange ( len ( fid ) ) / sw
+    signal = fid * np.exp ( -np.pi * lb * time )
+    signal[ 0 ] *= 0.5
+    size = len ( fid ) * max ( int ( zero_fill ) , 1 )
+    spectrum = np.fft.fftshift ( np.fft.fft ( signal , size ) )
+    return np.fft.fftshift ( np.fft.fftfreq ( size , 1.0 / sw ) ) , spectrum
@@ -0,0 +1,197 @@
+#%% Header files
+import math
+import time
+
+import numpy as np
+
+from .lazy import LazyImport
+from .preview import MAGIC_ANGLE , Rotor , spin_hamiltonian , spin_operator
+from .spinsys import to_hz
+
+linalg = LazyImport ( 'scipy.linalg' )
+jv = LazyImport ( 'scipy.special' , 'jv' )
+
+# Propagator algorithms selected with the method entry of par
+PROPAGATOR_METHODS = ( 'dysev' , 'dysevr' , 'pade' , 'taylor' , 'cheby1' , 'cheby2' )
+# How the evolution under MAS is computed, also selected with the method entry
+DOMAIN_METHODS = ( 'direct' , 'gcompute' , 'freq' )
+# Largest element error of a propagator still taken as exact
+METHOD_TOLERANCE = 1e-8
+# Largest Hilbert space dimension benchmarked, nine spins 1/2: every method runs several times on a
+# dense matrix, which already takes tens of seconds at this size and grows as N^3
+BENCHMARK_MAX_DIMENSION = 512
+
+
+#%% Functions
+def exp_diagonal(h , dt , driver='ev') :
+    """
+    exp(-i 2 pi h dt) from the eigenvalues of the Hermitian h (Hz), with the LAPACK driver
+    SIMPSON names dsyev ('ev') or dsyevr ('evr').
+    """
+    energies , vectors = linalg.eigh ( h , driver=driver )
+    return (vectors * np.exp ( -2j * np.pi * energies * dt )) @ vectors.conj ().T
+
+
+def exp_pade(h , dt) :
+    """
+    exp(-i 2 pi h dt) by scaling and squaring with a Padé approximant.
+    """
+    return linalg.expm ( -2j * np.pi * dt * h )
+
+
+def exp_taylor(h , dt , tolerance=1e-12) :
+    """
+    exp(-i 2 pi h dt) by scaling and squaring with a Taylor series, cut when the terms
+    fall below tolerance.
+    """
+    a = -2j * np.pi * dt * h
+    squarings = max ( 0 , int ( np.ceil ( np.log2 ( max ( np.linalg.norm ( a , 1 ) , 1e-300 ) ) ) ) + 1 )
+    a = a / 2 ** squarings
+    result = np.eye ( len ( h ) , dtype=complex )
+    term = result
+    for k in range ( 1 , 30 ) :
+        term = term @ a / k
+        result = result + term
+        if np.abs ( term ).max () < tolerance :
+            break
+    for _ in range ( squarings ) :
+        result = result @ result
+    return result
+
+
+def _chebyshev_terms(h , dt , tolerance) :
+    """
+    Bound on the spectral radius of h and the Chebyshev coefficients of exp(-i 2 pi h dt).
+    """
+    half_width = max ( np.linalg.norm ( h , 1 ) , 1e-300 )
+    x = 2 * np.pi * dt * half_width
+    # J_k(x) falls faster than tolerance once k exceeds x by a few x^(1/3)
+    n_terms = int ( x + 4 * np.cbrt ( x ) * np.log10 ( 1 / tolerance ) ** 0.5 + 12 )
+    coefficients = (2 - (np.arange ( n_terms ) == 0)) * (-1j) ** np.arange ( n_terms ) * jv ( np.arange ( n_terms ) , x )
+    return half_width , coefficients
+
+
+def apply_chebyshev(h , dt , matrix , tolerance=1e-12) :
+    """
+    exp(-i 2 pi h dt) @ matrix from the Chebyshev expansion, without forming the propagator.
+    """
+    half_width , coefficients = _chebyshev_terms ( h , dt , tolerance )
+    scaled = h / half_width
+    previous , current = matrix , scaled @ matrix
+    result = coefficients[ 0 ] * previous + coefficients[ 1 ] * current
+    for coefficient in coefficients[ 2 : ] :
+        previous , current = current , 2 * (scaled @ current) - previous
+        result = result + coefficient * current
+    return result
+
+
+def exp_chebyshev(h , dt , tolerance=1e-12) :
+    """
+    exp(-i 2 pi h dt) from the Chebyshev expansion.
+    """
+    return apply_chebyshev ( h , dt , np.eye ( len ( h ) , dtype=complex ) , tolerance )
+
+
+def propagator(h , dt , method='dysev') :
+    """
+    exp(-i 2 pi h dt) with the algorithm of one of PROPAGATOR_METHODS. cheby2 applies the
+    expansion to the density matrix in SIMPSON; as a propagator it is the same as cheby1.
+    :param h: Hermitian (N, N) Hamiltonian in Hz
+    :param dt: time step in s
+    """
+    if method in ( 'dysev' , 'dysevr' ) :
+        return exp_diagonal ( h , dt , 'ev' if method == 'dysev' else 'evr' )
+    if method == 'pade' :
+        return exp_pade ( h , dt )
+    if method == 'taylor' :
+        return exp_taylor ( h , dt )
+    if method in ( 'cheby1' , 'cheby2' ) :
+        return exp_chebyshev ( h , dt )
+    raise ValueError ( f"Unknown propagator method {method}, use one of {', '.join ( PROPAGATOR_METHODS )}" )
+
+
+def time_call(function , repeats) :
+    """
+    Best wall time of a few calls, in s.
+    """
+    best = math.inf
+    for _ in range ( repeats ) :
+        start = time.perf_counter ()
+        function ()
+        best = min ( best , time.perf_counter () - start )
+    return best
+
+
+def benchmark(h , dt , repeats=5 , methods=PROPAGATOR_METHODS) :
+    """
+    Time and accuracy of every propagator algorithm for one Hamiltonian and step. cheby2 is
+    timed applied to a density matrix, as SIMPSON uses it. The reference is the propagator
+    from the divide-and-conquer eigensolver, which none of the methods uses.
+    :param h: Hermitian (N, N) Hamiltonian in Hz
+    :param dt: time step in s, maxdt
+    :return: list of dicts with method, seconds and error (largest element difference), fastest first
+    """
+    reference = exp_diagonal ( h , dt , 'evd' )
+    rho = np.array ( h )
+    results = [ ]
+    for method in methods :
+        if method == 'cheby2' :
+            seconds = time_call ( lambda : apply_chebyshev ( h , dt , rho ) , repeats )
+            error = np.abs ( apply_chebyshev ( h , dt , rho ) - reference @ rho ).max () / max ( np.abs ( rho ).max () , 1e-300 )
+        else :
+            seconds = time_call ( lambda : propagator ( h , dt , method ) , repeats )
+            error = np.abs ( propagator ( h , dt , method ) - reference ).max ()
+        results.append ( { 'method' : method , 'seconds' : seconds , 'error' : float ( error ) } )
+    return sorted ( results , key=lambda result : result[ 'seconds' ] )
+
+
+def recommend_method(results , tolerance=METHOD_TOLERANCE) :
+    """
+    Fastest method of benchmark whose error stays within tolerance, or None.
+    """
+    return next ( ( result[ 'method' ] for result in results if result[ 'error' ] <= tolerance ) , None )
+
+
+def recommend_domain(spin_rate , sw , gamma_angles) :
+    """
+    direct for static samples or when the dwell time is not a whole fraction of the rotor period,
+    gcompute otherwise: its propagators over one rotor period serve every gamma angle.
+    """
+    if not spin_rate or gamma_angles < 2 :
+        return 'direct'
+    ratio = sw / spin_rate
+    return 'gcompute' if ratio >= 1 and abs ( ratio - round ( ratio ) ) < 1e-9 else 'direct'
+
+
+def benchmark_hamiltonian(spin_system , proton_frequency , nuclei , rf=0.0 , seed=0) :
+    """
+    A Hamiltonian of the spin system as SIMPSON meets it: one random crystallite at the magic
+    angle, plus an rf field of amplitude rf (Hz) along x on every spin. Spin systems the preview
+    cannot build (spins above 1/2) get a random Hermitian matrix of the same dimension whose norm
+    is the sum of the interactions and of the rf.
+    :return: (N, N) Hermitian matrix in Hz
+    :raises ValueError: above BENCHMARK_MAX_DIMENSION, where the benchmark itself would take minutes
+    """
+    dimension = math.prod ( int ( round ( 2 * nuclei.spin ( name ) + 1 ) ) for name in spin_system.nuclei )
+    if dimension > BENCHMARK_MAX_DIMENSION :
+        raise ValueError ( f"The Hilbert space of the spin system has dimension {dimension}, the benchmark is limited to "
+                           f"{BENCHMARK_MAX_DIMENSION}: run it on a smaller part of the spin system" )
+    rng = np.random.default_rng ( seed )
+    n_spins = len ( spin_system.nuclei )
+    try :
+        h_iso , tensors , operators = spin_hamiltonian ( spin_system , proton_frequency , nuclei )
+    except ValueError :
+        norm = rf * n_spins / 2
+        for interaction in spin_system.interactions :
+            nucleus = spin_system.nuclei[ interaction[ 'i' ] - 1 ]
+            norm += abs ( to_hz ( interaction.get ( 'aniso' , 0.0 ) , nucleus , proton_frequency , nuclei ) ) + \
+                    abs ( to_hz ( interaction.get ( 'iso' , 0.0 ) , nucleus , proton_frequency , nuclei ) )
+        a = rng.normal ( size=(dimension , dimension) ) + 1j * rng.normal ( size=(dimension , dimension) )
+        h = a + a.conj ().T
+        return h * norm / max ( np.linalg.norm ( h , 2 ) , 1e-300 )
+    alpha , beta , gamma = rng.uniform ( 0 , 360 ) , np.degrees ( np.arccos ( rng.uniform ( -1 , 1 ) ) ) , rng.uniform ( 0 , 360 )
+    coefficients = Rotor ( tensors , [ alpha ] , [ beta ] , [ gamma ] , 0.0 , MAGIC_ANGLE ).scales ( 0.0 )[ 0 ]
+    h = h_iso + np.einsum ( 't,tab->ab' , coefficients , operators )
+    for k in range ( n_spins ) :
+        h = h + rf * spin_operator ( n_spins , k , 'x' )
+    return h
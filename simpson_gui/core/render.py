@@ -0,0 +1,216 @@
+#%% Header files
+import collections
+import itertools
+import json
+import os
+import threading
+from functools import lru_cache
+
+from .par import par_number , parse_par
+from .sequence import pulseq_code
+
+SECTIONS = ( 'spinsys' , 'par' , 'pulseq' , 'main' )
+
+
+#%% Functions
+def _row(row) :
+    return row if isinstance ( row , str ) else ' '.join ( str ( value ) for value in row )
+
+
+def distance_row(row , nuclei , table_of_nuclei=None) :
+    """
+    dipole line of a distance row: ['distance', i, j, r in Angstrom, alpha, beta, gamma].
+    """
+    from .dipolar import dipolar_constant
+    from .nuclei import load_nuclei
+    _ , i , j , distance , *angles = row
+    gyr1 , gyr2 = (table_of_nuclei or load_nuclei ()).gyr_hz ( [ nuclei[ int ( i ) - 1 ] , nuclei[ int ( j ) - 1 ] ] )
+    angles = list ( angles ) + [ 0 ] * (3 - len ( angles ))
+    return _row ( [ 'dipole' , i , j , round ( float ( dipolar_constant ( float ( distance ) , gyr1 , gyr2 ) ) , 2 ) ] + angles )
+
+
+def spinsys_block(nuclei , interactions=() , channels=None) :
+    """
+    spinsys section.
+    :param nuclei: list of nucleus names, e.g. ['13C', '1H']
+    :param interactions: lines of the interactions, each a string or a list such as
+                         ['shift', 1, '10p', '100p', 0.5, 0, 0, 0]; ['distance', i, j, r, ...] rows
+                         are turned into dipole lines from the distance in Angstrom
+    :param channels: channels, the nuclei in order of appearance by default
+    """
+    channels = channels or list ( dict.fromkeys ( nuclei ) )
+    lines = [ distance_row ( row , nuclei ) if not isinstance ( row , str ) and row[ 0 ] == 'distance' else _row ( row )
+              for row in interactions ]
+    return ("spinsys { \n"
+            + '\t nuclei    ' + ' '.join ( nuclei ) + '\n'
+            + '\t channels  ' + '   ' + ' '.join ( channels ) + '\n'
+            + ''.join ( f"\t {line}\n" for line in lines )
+            + "}")
+
+
+def par_block(proton_frequency=400e6 , spin_rate=10000 , crystal_file='zcw232' , gamma_angles=8 ,
+              start_operator='I1x' , detect_operator='I1p' , verbose='1101' , np=16 , sw='spin_rate' ,
+              conjugate_fid='false' , method='direct' , **entries) :
+    """
+    par section with the entries of the Parameters page, followed by any other entries.
+    :param proton_frequency: in Hz
+    :param method: string or list of methods
+    """
+    values = { 'proton_frequency' : f"{float ( proton_frequency ):.4e}" , 'spin_rate' : spin_rate ,
+               'crystal_file' : crystal_file , 'gamma_angles' : gamma_angles , 'start_operator' : start_operator ,
+               'detect_operator' : detect_operator , 'verbose' : verbose , 'np' : np , 'sw' : sw ,
+               'conjugate_fid' : conjugate_fid ,
+               'method' : method if isinstance ( method , str ) else ' '.join ( method ) }
+    values.update ( entries )
+    return " par {  \n" + ''.join ( f"\t {key} \t{value} \n" for key , value in values.items () ) + "}"
+
+
+@lru_cache ( maxsize=1024 )
+def _pulseq(sequence , maxdt , spin_rate , sw , coherence_filter) :
+    return pulseq_code ( sequence , maxdt , spin_rate , sw , coherence_filter )[ 0 ]
+
+
+def pulseq_block(sequence , maxdt=1.0 , dq_filter=False , spin_rate=10000.0 , sw=20000.0) :
+    """
+    pulseq section of a sequence of core.sequence.SEQUENCES.
+    :param dq_filter: double quantum filter between excitation and reconversion of recoupling
+    :param spin_rate: in Hz, for the propagators stored by compile_pulseq
+    :param sw: spectral width in Hz, likewise
+    """
+    return _pulseq ( sequence , float ( maxdt ) , float ( spin_rate ) , float ( sw ) , (2 , -2) if dq_filter else None )
+
+
+def main_block(domain='time' , zero_fill=1 , lb=0.0 , gaussian_ratio=0) :
+    """
+    main section saving the result as $par(name).txt in x, real, imaginary columns.
+    :param domain: 'fft' for a spectrum, 'time' for the FID
+    """
+    text_time_or_frequency = " "
+    if domain == 'fft' :
+        text_time_or_frequency += f" fzerofill $f {zero_fill} \n \tfaddlb $f {lb} {gaussian_ratio}"
+        text_time_or_frequency += "\n \t fft $f"
+    elif domain != 'time' :
+        raise ValueError ( f"Unknown domain {domain}, use fft or time" )
+    return f"""
+        proc main {{}} {{
+        global par
+        set f [fsimpson]
+        {text_time_or_frequency}
+        fsave $f $par(name).txt -xreim
+        funload $f
+        }}
+    """
+
+
+def full_file(sections) :
+    """
+    Input file from the code of its sections, in the order spinsys, par, pulseq, main; missing
+    sections are left out.
+    """
+    return ''.join ( sections[ name ] + "\n\n" for name in SECTIONS if sections.get ( name ) )
+
+
+def render(spec) :
+    """
+    Complete input file from a spec: a dict with the sections spinsys, par, pulseq and main, each
+    TCL code or the keyword arguments of spinsys_block, par_block, pulseq_block or main_block.
+    The spin rate and spectral width of pulseq default to those of the par section.
+    """
+    unknown = set ( spec ) - set ( SECTIONS ) - { 'name' }
+    if unknown :
+        raise ValueError ( f"Unknown sections {', '.join ( sorted ( unknown ) )}, use {', '.join ( SECTIONS )}" )
+    builders = { 'spinsys' : spinsys_block , 'par' : par_block , 'main' : main_block }
+    sections = { }
+    for name in ( 'spinsys' , 'par' , 'main' ) :
+        value = spec.get ( name )
+        sections[ name ] = value if value is None or isinstance ( value , str ) else builders[ name ] ( **value )
+    pulseq = spec.get ( 'pulseq' )
+    if isinstance ( pulseq , dict ) :
+        pulseq = dict ( pulseq )
+        if sections[ 'par' ] :
+            par = parse_par ( sections[ 'par' ] )
+            for key in ( 'spin_rate' , 'sw' ) :
+                if key not in pulseq and key in par :
+                    pulseq[ key ] = par_number ( par , key )
+        pulseq = pulseq_block ( **pulseq )
+    sections[ 'pulseq' ] = pulseq
+    return full_file ( sections )
+
+
+def _merge(base , override) :
+    """
+    Spec with the sections of override merged into those of base.
+    """
+    merged = dict ( base )
+    for key , value in override.items () :
+        merged[ key ] = { **merged[ key ] , **value } if isinstance ( value , dict ) and isinstance ( merged.get ( key ) , dict ) else value
+    return merged
+
+
+def expand_specs(document) :
+    """
+    Specs of a spec document: one spec, a list of specs, or a dict with defaults (merged into every
+    spec), inputs (list of specs) and grid (dotted keys such as 'par.spin_rate' mapped to lists of
+    values; every combination gives one spec per input).
+    :return: list of specs, each with a name
+    """
+    if isinstance ( document , list ) :
+        document = { 'inputs' : document }
+    elif not { 'defaults' , 'inputs' , 'grid' } & set ( document ) :
+        document = { 'inputs' : [ document ] }
+    defaults , inputs , grid = document.get ( 'defaults' , { } ) , document.get ( 'inputs' ) or [ { } ] , document.get ( 'grid' , { } )
+    keys = list ( grid )
+    combinations = list ( itertools.product ( *(grid[ key ] for key in keys) ) )
+    input_width , width = len ( str ( len ( inputs ) - 1 ) ) , len ( str ( len ( combinations ) - 1 ) )
+    specs = [ ]
+    for index , spec in enumerate ( inputs ) :
+        for combination , values in enumerate ( combinations ) :
+            expanded = _merge ( defaults , spec )
+            for key , value in zip ( keys , values ) :
+                section , _ , entry = key.partition ( '.' )
+                if not entry :
+                    raise ValueError ( f"Grid key {key} must be section.entry" )
+                expanded = _merge ( expanded , { section : { entry : value } } )
+            name = expanded.get ( 'name' ) or f"input_{index:0{input_width}d}"
+            if len ( combinations ) > 1 :
+                name = f"{name}_{combination:0{width}d}"
+            specs.append ( { **expanded , 'name' : name } )
+    return specs
+
+
+def load_document(path) :
+    """
+    Spec document of a JSON file, or of a YAML file (.yaml, .yml) when PyYAML is installed.
+    """
+    with open ( path ) as handle :
+        text = handle.read ()
+    if os.path.splitext ( path )[ 1 ].lower () in ( '.yaml' , '.yml' ) :
+        try :
+            import yaml
+        except ImportError :
+            raise ValueError ( f"Reading {path} needs PyYAML (pip install pyyaml), or write the spec as JSON" )
+        return yaml.safe_load ( text )
+    return json.loads ( text )
+
+
+def write_inputs(specs , directory) :
+    """
+    Renders every spec into <directory>/<name>.in. Nothing is written when two specs have the same name
+    or one of them fails to render; each file is staged and moved in place, so it is either whole or untouched.
+    :return: list of the paths written
+    """
+    names = collections.Counter ( spec[ 'name' ] for spec in specs )
+    repeated = sorted ( name for name , count in names.items () if count > 1 )
+    if repeated :
+        raise ValueError ( f"Several inputs are named {', '.join ( repeated )}, give every input its own name" )
+    texts = [ render ( spec ) for spec in specs ]
+    os.makedirs ( directory , exist_ok=True )
+    paths = [ ]
+    for spec , text in zip ( specs , texts ) :
+        path = os.path.join ( directory , f"{spec[ 'name' ]}.in" )
+        staging = f"{path}.{os.getpid ()}.{threading.get_ident ()}.tmp"
+        with open ( staging , 'w' ) as handle :
+            handle.write ( text )
+        os.replace ( staging , path )
+        paths.append ( path )
+    return paths
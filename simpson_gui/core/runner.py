@@ -0,0 +1,201 @@
+#%% Header files
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import cache_key , simpson_version
+
+# Path of the SIMPSON executable, a stand-in script can be given instead
+SIMPSON_EXECUTABLE = os.environ.get ( 'SIMPSON_EXECUTABLE' , 'simpson' )
+# Progress lines printed with the second verbose flag, e.g. "Crystallite 12/232" or "crystallite 12 of 232"
+PROGRESS_PATTERN = re.compile ( r'crystallite\D*?(\d+)\s*(?:/|of)\s*(\d+)' , flags=re.I )
+LOG_LINES = 200
+
+
+#%% Functions
+def resolve_executable(executable=None) :
+    """
+    Full path of the SIMPSON executable.
+    :param executable: name or path, SIMPSON_EXECUTABLE by default
+    :return: path, or None if it cannot be found
+    """
+    executable = executable or SIMPSON_EXECUTABLE
+    if os.path.isfile ( executable ) and os.access ( executable , os.X_OK ) :
+        return os.path.abspath ( executable )
+    return shutil.which ( executable )
+
+
+def parse_progress(line) :
+    """
+    Fraction of the crystallites done according to one line of verbose output, or None.
+    """
+    match = PROGRESS_PATTERN.search ( line )
+    if match is None or int ( match.group ( 2 ) ) == 0 :
+        return None
+    return min ( int ( match.group ( 1 ) ) / int ( match.group ( 2 ) ) , 1.0 )
+
+
+class SimpsonJob :
+    """
+    One SIMPSON input run in its own working directory, next to the files it reads. State goes
+    from queued to running, then to done, failed or cancelled. The output files are read into
+    memory at the end.
+    """
+
+    def __init__(self , name , text , executable , files=None) :
+        self.name = name
+        self.text = text
+        self.executable = executable
+        self.files = dict ( files or { } )
+        self.state = 'queued'
+        self.progress = 0.0
+        self.returncode = None
+        self.log = deque ( maxlen=LOG_LINES )
+        self.outputs = { }
+        self.error = None
+        self.cached = False
+        self.cache = None
+        self.cache_key = None
+        self._process = None
+        self._future = None
+        self._cancelled = threading.Event ()
+        self._lock = threading.Lock ()
+
+    @property
+    def finished(self) :
+        return self.state in ( 'done' , 'failed' , 'cancelled' )
+
+    def cancel(self) :
+        """
+        Removes a queued job from the pool, or stops a running one.
+        """
+        self._cancelled.set ()
+        if self._future is not None and self._future.cancel () :
+            self.state = 'cancelled'
+            return
+        with self._lock :
+            if self._process is not None and self._process.poll () is None :
+                self._process.terminate ()
+
+    def _read_output(self , stream) :
+        """
+        Stores the output line by line; SIMPSON rewrites progress lines with carriage returns.
+        """
+        buffer = ''
+        for chunk in iter ( lambda : stream.read1 ( 4096 ) , b'' ) :
+            buffer += chunk.decode ( errors='replace' )
+            *lines , buffer = re.split ( r'[\r\n]' , buffer )
+            for line in lines :
+                self._add_line ( line )
+        self._add_line ( buffer )
+
+    def _add_line(self , line) :
+        if not line.strip () :
+            return
+        self.log.append ( line )
+        progress = parse_progress ( line )
+        if progress is not None :
+            self.progress = progress
+
+    def run(self) :
+        if self._cancelled.is_set () :
+            self.state = 'cancelled'
+            return self
+        with tempfile.TemporaryDirectory ( prefix='simpson_' ) as workdir :
+            input_file = os.path.join ( workdir , f"{self.name}.in" )
+            with open ( input_file , 'w' ) as handle :
+                handle.write ( self.text )
+            for file_name , content in self.files.items () :
+                with open ( os.path.join ( workdir , os.path.basename ( file_name ) ) ,
+                           'wb' if isinstance ( content , bytes ) else 'w' ) as handle :
+                    handle.write ( content )
+            try :
+                with self._lock :
+                    if self._cancelled.is_set () :
+                        self.state = 'cancelled'
+                        return self
+                    self._process = subprocess.Popen ( [ self.executable , os.path.basename ( input_file ) ] ,
+                                                       cwd=workdir , stdout=subprocess.PIPE , stderr=subprocess.STDOUT )
+                    self.state = 'running'
+                self._read_output ( self._process.stdout )
+                self.returncode = self._process.wait ()
+            except OSError as error :
+                self.error = str ( error )
+                self.state = 'failed'
+                return self
+            if self._cancelled.is_set () :
+                self.state = 'cancelled'
+                return self
+            for entry in sorted ( os.listdir ( workdir ) ) :
+                path = os.path.join ( workdir , entry )
+                if path != input_file and entry not in self.files and os.path.isfile ( path ) :
+                    with open ( path , 'rb' ) as handle :
+                        self.outputs[ entry ] = handle.read ()
+        self.state = 'done' if self.returncode == 0 else 'failed'
+        if self.state == 'done' :
+            self.progress = 1.0
+            if self.cache is not None :
+                try :
+                    self.cache.put ( self.cache_key , self.outputs , name=self.name )
+                except OSError :
+                    pass
+        return self
+
+    def restore(self , outputs) :
+        """
+        Finishes the job with the outputs of an identical earlier run, renamed after this job.
+        """
+        stems = { file_name.rsplit ( '.' , 1 )[ 0 ] for file_name in outputs }
+        stem = stems.pop () if len ( stems ) == 1 else None
+        self.outputs = { (self.name + file_name[ len ( stem ) : ] if stem else file_name) : content
+                         for file_name , content in outputs.items () }
+        self.cached = True
+        self.progress = 1.0
+        self.returncode = 0
+        self.state = 'done'
+
+
+class SimpsonRunner :
+    """
+    Bounded pool running SIMPSON inputs in parallel, at most one process per core.
+    Each worker thread only waits on its SIMPSON process, the computation happens in the processes.
+    With a ResultCache, inputs already run with the same SIMPSON version are not run again.
+    """
+
+    def __init__(self , max_workers=None , cache=None) :
+        cores = os.cpu_count () or 1
+        self.max_workers = max ( 1 , min ( max_workers or cores , cores ) )
+        self.cache = cache
+        self._pool = ThreadPoolExecutor ( max_workers=self.max_workers , thread_name_prefix='simpson' )
+
+    def submit(self , name , text , executable=None , files=None) :
+        """
+        Queues one input.
+        :param name: base name of the input, SIMPSON names its output files after it by default
+        :param text: content of the input file
+        :param executable: SIMPSON executable, SIMPSON_EXECUTABLE by default
+        :param files: dict file name -> content of other files put next to the input, e.g. crystal files
+        :return: SimpsonJob
+        """
+        path = resolve_executable ( executable )
+        if path is None :
+            raise ValueError ( f"SIMPSON executable not found: {executable or SIMPSON_EXECUTABLE}" )
+        job = SimpsonJob ( re.sub ( r'[^\w.-]' , '_' , name ) or 'simpson' , text , path , files )
+        if self.cache is not None :
+            job.cache , job.cache_key = self.cache , cache_key ( text , simpson_version ( path ) , files )
+            outputs = self.cache.get ( job.cache_key )
+            if outputs is not None :
+                job.restore ( outputs )
+                return job
+        job._future = self._pool.submit ( job.run )
+        return job
+
+    def cancel(self , jobs) :
+        for job in jobs :
+            if not job.finished :
+                job.cancel ()
@@ -0,0 +1,836 @@
+#%% Header files
+import math
+from dataclasses import dataclass , field , replace
+
+# Most propagators compile_pulseq stores for the rotor positions of a repeated block
+MAX_VARIANTS = 64
+# Relative tolerance on the ratios of cycle, dwell and rotor period
+SYNC_TOLERANCE = 1e-6
+
+
+@dataclass ( frozen=True )
+class Term :
+    """
+    Time in µs or rf amplitude in Hz, as fixed + rotor x (rotor period, or spin rate for an
+    amplitude), so that sequences tied to the spinning keep working at any spin_rate. A named
+    term is written as the Tcl variable $name, set once at the start of the pulseq.
+    """
+    fixed: float = 0.0
+    rotor: float = 0.0
+    name: str = None
+
+    def value(self , spin_rate , amplitude=False) :
+        if not self.rotor :
+            return self.fixed
+        if amplitude :
+            return self.fixed + self.rotor * spin_rate
+        if not spin_rate :
+            raise ValueError ( "A time given in rotor periods needs a spin rate" )
+        return self.fixed + self.rotor * 1e6 / spin_rate
+
+    def expression(self , amplitude=False) :
+        """
+        TCL expression of the value, without the expr command.
+        """
+        if not self.rotor :
+            return f"{self.fixed:.10g}"
+        rotor = f"{self.rotor:.10g}*$par(spin_rate)" if amplitude else f"{self.rotor * 1e6:.10g}/$par(spin_rate)"
+        return f"{self.fixed:.10g}+{rotor}" if self.fixed else rotor
+
+    def tcl(self , amplitude=False) :
+        if self.name :
+            return f"${self.name}"
+        return f"[expr {self.expression ( amplitude )}]" if self.rotor else self.expression ( amplitude )
+
+    def __add__(self , other) :
+        return Term ( self.fixed + other.fixed , self.rotor + other.rotor )
+
+    def __mul__(self , factor) :
+        return Term ( self.fixed * factor , self.rotor * factor )
+
+    __rmul__ = __mul__
+
+
+@dataclass ( frozen=True )
+class Phase :
+    """
+    Phase in degrees following the Tcl variable $name, set to value: offset + sign x $name, so that
+    the phase of a sequence (the TPPM angle, the phase of an R element, ...) can be swept or edited.
+    """
+    value: float
+    name: str = 'ph'
+    sign: int = 1
+    offset: float = 0.0
+
+    def degrees(self) :
+        return self.offset + self.sign * self.value
+
+    def tcl(self) :
+        variable = f"${self.name}" if self.sign > 0 else f"-${self.name}"
+        offset = self.offset % 360
+        offset = offset - 360 if offset > 180 else offset
+        if not offset :
+            return variable if self.sign > 0 else f"[expr {variable}]"
+        return f"[expr {variable}{offset:+.10g}]"
+
+    def __add__(self , degrees) :
+        return replace ( self , offset=self.offset + degrees )
+
+    __radd__ = __add__
+
+    def __sub__(self , degrees) :
+        return replace ( self , offset=self.offset - degrees )
+
+    def __neg__(self) :
+        return replace ( self , sign=-self.sign , offset=-self.offset )
+
+    def __mul__(self , sign) :
+        if sign not in ( 1 , -1 ) :
+            raise ValueError ( "A phase can only be multiplied by 1 or -1" )
+        return self if sign > 0 else -self
+
+    __rmul__ = __mul__
+
+
+def _phase_tcl(phase) :
+    return phase.tcl () if isinstance ( phase , Phase ) else f"{phase % 360:.10g}"
+
+
+@dataclass ( frozen=True )
+class Pulse :
+    """
+    pulse duration rf phase [rf phase ...]: one rf amplitude and phase (degrees or Phase) per channel.
+    """
+    duration: Term
+    rf: tuple
+    phase: tuple
+
+    def tcl(self) :
+        channels = ' '.join ( f"{rf.tcl ( amplitude=True )} {_phase_tcl ( phase )}" for rf , phase in zip ( self.rf , self.phase ) )
+        return f"pulse {self.duration.tcl ()} {channels}"
+
+
+@dataclass ( frozen=True )
+class PulseId :
+    """
+    Ideal pulse taking no time: pulseid duration rf phase [rf phase ...] gives the flip angle.
+    """
+    duration: Term
+    rf: tuple
+    phase: tuple
+
+    def tcl(self) :
+        channels = ' '.join ( f"{rf.tcl ( amplitude=True )} {_phase_tcl ( phase )}" for rf , phase in zip ( self.rf , self.phase ) )
+        return f"pulseid {self.duration.tcl ()} {channels}"
+
+
+@dataclass ( frozen=True )
+class Delay :
+    duration: Term
+
+    def tcl(self) :
+        return f"delay {self.duration.tcl ()}"
+
+
+@dataclass ( frozen=True )
+class Prop :
+    """
+    Stored propagator applied count times, covering duration in total.
+    """
+    slot: int
+    duration: Term
+    count: int = 1
+
+    def tcl(self) :
+        return f"prop {self.slot} {self.count}" if self.count > 1 else f"prop {self.slot}"
+
+
+@dataclass
+class Loop :
+    """
+    count passes of the same events.
+    """
+    count: int
+    events: list = field ( default_factory=list )
+
+
+@dataclass
+class Sequence :
+    """
+    One cycle of a pulse sequence. A 'mixing' cycle is repeated between the acquired points
+    (recoupling build-up); an 'acquisition' cycle is repeated during each dwell time (decoupling).
+    """
+    name: str
+    events: list
+    role: str = 'mixing'
+
+
+#%% Functions
+def expand(events) :
+    """
+    Events with the loops unrolled.
+    """
+    flat = [ ]
+    for event in events :
+        if isinstance ( event , Loop ) :
+            flat.extend ( expand ( event.events ) * event.count )
+        else :
+            flat.append ( event )
+    return flat
+
+
+def cycle_time(events , spin_rate) :
+    """
+    Length of a list of events in µs; ideal pulses take no time.
+    """
+    return sum ( event.duration.value ( spin_rate ) for event in expand ( events ) if not isinstance ( event , PulseId ) )
+
+
+def cycle_term(events) :
+    """
+    Length of a list of events as a Term, when every event is given as a Term.
+    """
+    total = Term ()
+    for event in expand ( events ) :
+        if not isinstance ( event , PulseId ) :
+            total = total + event.duration
+    return total
+
+
+def events_tcl(events , indent='    ' , depth=0 , level=1) :
+    """
+    TCL lines of a list of events, loops as for loops over i1, i2, ...
+    :param depth: indentation of the first line
+    """
+    lines = [ ]
+    for event in events :
+        if isinstance ( event , Loop ) :
+            variable = f"i{level}"
+            lines.append ( f"{indent * depth}for {{set {variable} 1}} {{${variable} <= {event.count}}} {{incr {variable}}} {{" )
+            lines.extend ( events_tcl ( event.events , indent , depth + 1 , level + 1 ) )
+            lines.append ( f"{indent * depth}}}" )
+        else :
+            lines.append ( indent * depth + event.tcl () )
+    return lines
+
+
+def _define(variables , name , value) :
+    if variables.setdefault ( name , value ) != value :
+        raise ValueError ( f"The variable {name} is set to both {variables[ name ]} and {value}" )
+
+
+def sequence_variables(events , variables=None) :
+    """
+    Tcl variables of the named terms and phases of events, in order of appearance.
+    :return: dict name -> TCL value
+    """
+    variables = { } if variables is None else variables
+    for event in events :
+        if isinstance ( event , Loop ) :
+            sequence_variables ( event.events , variables )
+            continue
+        if event.duration.name :
+            _define ( variables , event.duration.name , replace ( event.duration , name=None ).tcl () )
+        for rf in getattr ( event , 'rf' , () ) :
+            if rf.name :
+                _define ( variables , rf.name , replace ( rf , name=None ).tcl ( amplitude=True ) )
+        for phase in getattr ( event , 'phase' , () ) :
+            if isinstance ( phase , Phase ) :
+                _define ( variables , phase.name , f"{phase.value:.10g}" )
+    return variables
+
+
+def variables_tcl(events , indent='    ' , depth=0) :
+    """
+    set lines of the variables of sequence_variables, to be run before the events.
+    """
+    return [ f"{indent * depth}set {name} {value}" for name , value in sequence_variables ( events ).items () ]
+
+
+def _whole(ratio) :
+    return abs ( ratio - round ( ratio ) ) <= SYNC_TOLERANCE * max ( abs ( ratio ) , 1.0 )
+
+
+def rotor_variants(length , spin_rate , max_variants=MAX_VARIANTS) :
+    """
+    Number of different propagators of a block of length µs repeated back to back: the smallest
+    k for which k blocks last a whole number of rotor periods (1 for static samples).
+    :return: k, or None if it is above max_variants
+    """
+    if not spin_rate :
+        return 1
+    periods = length * spin_rate / 1e6
+    for k in range ( 1 , max_variants + 1 ) :
+        if _whole ( k * periods ) :
+            return k
+    return None
+
+
+def _same_phase(first , second) :
+    """
+    Whether two phases are the same angle; a Phase only matches a Phase of the same variable,
+    so that merged pulses still follow it when it is changed.
+    """
+    if isinstance ( first , Phase ) or isinstance ( second , Phase ) :
+        return isinstance ( first , Phase ) and isinstance ( second , Phase ) and \
+            (first.name , first.sign) == (second.name , second.sign) and \
+            abs ( (first.offset - second.offset + 180) % 360 - 180 ) < 1e-9
+    return abs ( (first - second + 180) % 360 - 180 ) < 1e-9
+
+
+def _same_phases(first , second) :
+    """
+    Whether two pulses have the same rf and, on the channels with rf, the same phases.
+    """
+    return first.rf == second.rf and all ( not rf.fixed and not rf.rotor or _same_phase ( a , b )
+                                           for rf , a , b in zip ( first.rf , first.phase , second.phase ) )
+
+
+def merge_events(events) :
+    """
+    Joins consecutive pulses with the same rf and phases, and consecutive delays, into one event.
+    Pulses without rf become delays and a loop of a single pulse or delay becomes one long event.
+    """
+    merged = [ ]
+    for event in events :
+        if isinstance ( event , Loop ) :
+            event = Loop ( event.count , merge_events ( event.events ) )
+            if len ( event.events ) == 1 and isinstance ( event.events[ 0 ] , (Pulse , Delay) ) :
+                event = replace ( event.events[ 0 ] , duration=event.events[ 0 ].duration * event.count )
+        if isinstance ( event , Pulse ) and not any ( rf.fixed or rf.rotor for rf in event.rf ) :
+            event = Delay ( event.duration )
+        previous = merged[ -1 ] if merged else None
+        if isinstance ( event , Pulse ) and isinstance ( previous , Pulse ) and _same_phases ( previous , event ) :
+            merged[ -1 ] = replace ( previous , duration=previous.duration + event.duration )
+        elif isinstance ( event , Delay ) and isinstance ( previous , Delay ) :
+            merged[ -1 ] = Delay ( previous.duration + event.duration )
+        else :
+            merged.append ( event )
+    return merged
+
+
+def fold_repeats(events) :
+    """
+    Replaces runs of an identical block of events by a loop, taking at every position the block
+    whose repetition removes the most events.
+    """
+    events = [ Loop ( event.count , fold_repeats ( event.events ) ) if isinstance ( event , Loop ) else event
+               for event in events ]
+    folded , i = [ ] , 0
+    while i < len ( events ) :
+        best_length , best_count = 1 , 1
+        for length in range ( 1 , (len ( events ) - i) // 2 + 1 ) :
+            block , count = events[ i : i + length ] , 1
+            while events[ i + count * length : i + (count + 1) * length ] == block :
+                count += 1
+            if length * (count - 1) > best_length * (best_count - 1) :
+                best_length , best_count = length , count
+        folded.append ( Loop ( best_count , events[ i : i + best_length ] ) if best_count > 1 else events[ i ] )
+        i += best_length * best_count
+    return folded
+
+
+def compress_events(events) :
+    """
+    Fewest events giving the same evolution: merge_events, fold_repeats, then merge_events again
+    for the loops of a single event.
+    """
+    return merge_events ( fold_repeats ( merge_events ( events ) ) )
+
+
+def store_repeats(events , spin_rate , first_slot) :
+    """
+    Replaces the loops of events whose body lasts a whole number of rotor periods by the propagator
+    of one pass, stored once and applied count times. Only loops at the top level are replaced,
+    and events must itself start at the same rotor position every time it runs.
+    :return: (list of (slot, start Term, body) to compute and store first, new events)
+    """
+    stored , compressed , start = [ ] , [ ] , Term ()
+    for event in events :
+        if isinstance ( event , Loop ) and rotor_variants ( cycle_time ( event.events , spin_rate ) , spin_rate ) == 1 :
+            slot = first_slot + len ( stored )
+            stored.append ( (slot , start , event.events) )
+            event = Prop ( slot , cycle_term ( event.events ) * event.count , event.count )
+        compressed.append ( event )
+        start = start + cycle_term ( [ event ] )
+    return stored , compressed
+
+
+def propagator_count(events , spin_rate , maxdt) :
+    """
+    Propagators SIMPSON computes for events: one per pulse or delay for static samples, one per
+    maxdt step under MAS, one per ideal pulse, none for stored propagators.
+    """
+    count = 0
+    for event in expand ( events ) :
+        if isinstance ( event , PulseId ) or not spin_rate and not isinstance ( event , Prop ) :
+            count += 1
+        elif not isinstance ( event , Prop ) :
+            count += max ( math.ceil ( event.duration.value ( spin_rate ) / maxdt - SYNC_TOLERANCE ) , 1 )
+    return count
+
+
+def analyse(sequence , spin_rate , sw) :
+    """
+    Cycle time and rotor synchronisation of a sequence.
+    :param spin_rate: in Hz, 0 for static
+    :param sw: spectral width in Hz, for acquisition cycles
+    :return: dict with cycle (µs), rotor_periods, variants (propagators to store, None if too many),
+             synchronised, and for acquisition cycles cycles_per_dwell (None if the dwell is not a
+             whole number of cycles)
+    """
+    cycle = cycle_time ( sequence.events , spin_rate )
+    if cycle <= 0 :
+        raise ValueError ( f"{sequence.name} has no duration" )
+    report = { 'cycle' : cycle , 'rotor_periods' : cycle * spin_rate / 1e6 if spin_rate else None }
+    if sequence.role == 'acquisition' :
+        per_dwell = 1e6 / sw / cycle
+        report[ 'cycles_per_dwell' ] = int ( round ( per_dwell ) ) if _whole ( per_dwell ) and per_dwell >= 0.5 else None
+        report[ 'variants' ] = rotor_variants ( 1e6 / sw , spin_rate ) if report[ 'cycles_per_dwell' ] else None
+    else :
+        report[ 'variants' ] = rotor_variants ( cycle , spin_rate )
+    report[ 'synchronised' ] = report[ 'variants' ] == 1
+    return report
+
+
+def describe(sequence , report) :
+    """
+    One line summary of analyse, with the propagator counts of compile_pulseq when present.
+    """
+    text = f"{sequence.name}: cycle {report[ 'cycle' ]:.4g} µs"
+    if report[ 'rotor_periods' ] is not None :
+        text += f" = {report[ 'rotor_periods' ]:.4g} rotor periods"
+    if sequence.role == 'acquisition' and report[ 'cycles_per_dwell' ] is None :
+        text += "; the dwell time is not a whole number of cycles, acq_block is kept"
+    elif sequence.role == 'acquisition' :
+        text += f", {report[ 'cycles_per_dwell' ]} cycles per dwell"
+    if sequence.role == 'acquisition' and report[ 'cycles_per_dwell' ] is None :
+        pass
+    elif report[ 'variants' ] is None :
+        text += f"; more than {MAX_VARIANTS} rotor positions, nothing is stored"
+    elif report[ 'synchronised' ] :
+        text += "; rotor synchronised, one propagator is computed and reused"
+    else :
+        text += f"; {report[ 'variants' ]} propagators are computed, one per rotor position, and reused"
+    if 'propagators' in report :
+        text += "; {} propagator computations per block, {} after compression".format ( *report[ 'propagators' ] )
+    return text
+
+
+def _stored_blocks(events , variants , length , indent , stored=()) :
+    """
+    Stores the propagators of a block at its first variants rotor positions in 1 ... variants,
+    after the blocks of store_repeats it applies.
+    """
+    lines = [ ]
+    for slot , start , body in stored :
+        lines += [ f"{indent}reset {start.tcl ()}" if start.fixed or start.rotor else f"{indent}reset" ]
+        lines += events_tcl ( body , indent , 1 ) + [ f"{indent}store {slot}" ]
+    body = events_tcl ( events , indent , 2 if variants > 1 else 1 )
+    if variants == 1 :
+        return lines + [ f"{indent}reset" ] + body + [ f"{indent}store 1" ]
+    return lines + ([ f"{indent}for {{set k 1}} {{$k <= {variants}}} {{incr k}} {{" ,
+                      f"{indent * 2}reset [expr ($k-1)*{length}]" ] + body +
+                    [ f"{indent * 2}store $k" , f"{indent}}}" ])
+
+
+def compile_pulseq(sequence , spin_rate , sw , maxdt , coherence_filter=None , indent='    ' , compress=True) :
+    """
+    pulseq procedure of a sequence in which every distinct propagator of the repeated cycle is
+    computed once, stored and reused with prop. A mixing cycle is acquired after each repetition,
+    with excitation and reconversion by the accumulated propagator (and sw set to one cycle); an
+    acquisition cycle fills each dwell time. When the repetition is not periodic with the rotor
+    within MAX_VARIANTS positions, the cycle is written out as before (a loop, or an acq_block).
+    The number of stored propagators depends on spin_rate and sw, so compile again when they change.
+    With compress, the events are reduced by compress_events and, when one propagator serves every
+    cycle, repeated rotor-synchronised blocks inside it by store_repeats. The named rf amplitudes and
+    phases of the sequence are set as Tcl variables first (set rf ..., set ph ...), so that they can
+    be edited or swept in the generated input; durations are written as numbers, as the stored
+    propagators only hold for the timing they were compiled for.
+    :param coherence_filter: coherence orders kept between excitation and reconversion, e.g. (2, -2)
+    :return: (TCL code, analyse report with propagators: (computations before, after compression))
+    """
+    report = analyse ( sequence , spin_rate , sw )
+    variants = report[ 'variants' ]
+    block = sequence.events
+    if sequence.role == 'acquisition' and report[ 'cycles_per_dwell' ] not in ( None , 1 ) :
+        block = [ Loop ( report[ 'cycles_per_dwell' ] , block ) ]
+    before , stored = propagator_count ( block , spin_rate , maxdt ) , [ ]
+    if compress :
+        block = compress_events ( block )
+        if variants == 1 :
+            stored , block = store_repeats ( block , spin_rate , 2 if sequence.role == 'acquisition' else 3 )
+    report[ 'propagators' ] = (before , propagator_count ( block , spin_rate , maxdt ) +
+                               sum ( propagator_count ( body , spin_rate , maxdt ) for _ , _ , body in stored ))
+    lines = [ "proc pulseq {} {" , f"{indent}global par" , f"{indent}maxdt {maxdt:g}" ,
+              f"{indent}# {describe ( sequence , report )}" ] + variables_tcl ( sequence.events , indent , 1 )
+    if sequence.role == 'acquisition' :
+        if variants is None :
+            lines += [ f"{indent}acq_block {{" ] + events_tcl ( block , indent , 2 ) + [ f"{indent}}}" , "}" ]
+            return '\n'.join ( lines ) + '\n' , report
+        lines += _stored_blocks ( block , variants , "1e6/$par(sw)" , indent , stored )
+        lines += [ f"{indent}reset" , f"{indent}acq" ,
+                   f"{indent}for {{set j 1}} {{$j < $par(np)}} {{incr j}} {{" ,
+                   f"{indent * 2}prop {'1' if variants == 1 else f'[expr ($j-1)%{variants}+1]'}" ,
+                   f"{indent * 2}acq" , f"{indent}}}" , "}" ]
+        return '\n'.join ( lines ) + '\n' , report
+
+    length = cycle_term ( sequence.events )
+    lines.append ( f"{indent}set par(sw) [expr $par(spin_rate)/{length.rotor:.10g}]" if length.rotor and not length.fixed
+                   else f"{indent}set par(sw) [expr 1e6/({length.expression ()})]" )
+    if coherence_filter :
+        lines.append ( f"{indent}matrix set 2 totalcoherence {{{' '.join ( str ( order ) for order in coherence_filter )}}}" )
+    if variants is None :
+        # no reuse possible: the cycles are run again for every point
+        lines += [ f"{indent}for {{set j 0}} {{$j < $par(np)}} {{incr j}} {{" , f"{indent * 2}reset" ,
+                   f"{indent * 2}for {{set n 0}} {{$n < $j}} {{incr n}} {{" ]
+        lines += events_tcl ( block , indent , 3 )
+        lines += [ f"{indent * 2}}}" ] + ([ f"{indent * 2}filter 2" ] if coherence_filter else [ ]) + [
+            f"{indent * 2}acq" , f"{indent}}}" , "}" ]
+        return '\n'.join ( lines ) + '\n' , report
+    accumulated = variants + 1
+    lines += _stored_blocks ( block , variants , f"({length.expression ()})" , indent , stored )
+    lines += [ f"{indent}reset" , f"{indent}store {accumulated}" , f"{indent}acq" ,
+               f"{indent}for {{set j 1}} {{$j < $par(np)}} {{incr j}} {{" , f"{indent * 2}reset" ,
+               f"{indent * 2}prop {accumulated}" ,
+               f"{indent * 2}prop {'1' if variants == 1 else f'[expr ($j-1)%{variants}+1]'}" ,
+               f"{indent * 2}store {accumulated}" ]
+    lines += ([ f"{indent * 2}filter 2" ] if coherence_filter else [ ]) + [
+        f"{indent * 2}prop {accumulated}" , f"{indent * 2}acq" , f"{indent}}}" , "}" ]
+    return '\n'.join ( lines ) + '\n' , report
+
+
+#%% Sequences
+def _rotor(periods) :
+    return Term ( rotor=periods )
+
+
+def _rf(times_spin_rate) :
+    """
+    rf amplitude of a recoupling sequence, a multiple of the spin rate, written as $rf.
+    """
+    return Term ( rotor=times_spin_rate , name='rf' )
+
+
+def recoupling_s3() :
+    """
+    S3 at an rf field of half the spin rate; 16 rotor periods per cycle.
+    """
+    rf , t90 , t270 , t360 = (_rf ( 0.5 ) ,) , _rotor ( 0.5 ) , _rotor ( 1.5 ) , _rotor ( 2.0 )
+    phase = Phase ( 90.0 )
+    events = [ ]
+    for swap in ( 0 , 180 ) :
+        for i in ( 1 , 2 ) :
+            ph = phase + (i % 2) * 180 + swap
+            events += [ Pulse ( t360 , rf , (ph ,) ) , Pulse ( t270 , rf , (ph + 180 ,) ) , Pulse ( t90 , rf , (ph ,) ) ]
+    return Sequence ( 's3' , events )
+
+
+def recoupling_brs3() :
+    """
+    S3 between ideal 90 degree pulses.
+    """
+    s3 = recoupling_s3 ()
+    flip = PulseId ( Term ( 1.0 ) , (Term ( 250000.0 ) ,) , (0 ,) )
+    return Sequence ( 'brs3' , [ flip ] + s3.events + [ PulseId ( flip.duration , flip.rf , (180 ,) ) ] )
+
+
+def recoupling_sr26(nu=11) :
+    """
+    SR26_4^nu: R elements 90-270 at 6.5 times the spin rate, with the supercycle of the k and j loops.
+    """
+    rf = (_rf ( 6.5 ) ,)
+    t90 , t270 = _rotor ( 0.25 / 6.5 ) , _rotor ( 0.75 / 6.5 )
+    ph = Phase ( 180.0 * nu / 26 )
+    events = [ ]
+    for k in ( 1 , 2 ) :
+        for j in ( 1 , 2 ) :
+            sign = (-1) ** (k - 1) * (-1) ** (j - 1)
+            events.append ( Loop ( 13 , [ Pulse ( t90 , rf , (sign * ph + ((k + 1) % 2) * 180 ,) ) ,
+                                          Pulse ( t270 , rf , (sign * ph + (k % 2) * 180 ,) ) ,
+                                          Pulse ( t90 , rf , (-sign * ph + ((k + 1) % 2) * 180 ,) ) ,
+                                          Pulse ( t270 , rf , (-sign * ph + (k % 2) * 180 ,) ) ] ) )
+    return Sequence ( 'sr26' , events )
+
+
+def recoupling_postc7() :
+    """
+    POST-C7 at 7 times the spin rate; 2 rotor periods per cycle.
+    """
+    rf = (_rf ( 7.0 ) ,)
+    t90 = _rotor ( 0.25 / 7 )
+    events = [ ]
+    for i in range ( 1 , 8 ) :
+        phase = i * 360.0 / 7.0
+        events += [ Pulse ( t90 , rf , (phase ,) ) , Pulse ( 4 * t90 , rf , (phase + 180 ,) ) ,
+                    Pulse ( 3 * t90 , rf , (phase ,) ) ]
+    return Sequence ( 'postc7' , events )
+
+
+def recoupling_rseq(n_elements=20 , n_periods=2 , nu=9) :
+    """
+    R N_n^nu with 90-270 elements, e.g. R20_2^9: N elements in n rotor periods.
+    """
+    rf = (_rf ( n_elements / n_periods ) ,)
+    t90 = _rotor ( 0.25 * n_periods / n_elements )
+    phase = Phase ( 180.0 * nu / n_elements )
+    return Sequence ( 'rseq' , [ Loop ( n_elements // 2 , [ Pulse ( t90 , rf , (phase ,) ) ,
+                                                            Pulse ( 3 * t90 , rf , (phase + 180 ,) ) ,
+                                                            Pulse ( t90 , rf , (-phase ,) ) ,
+                                                            Pulse ( 3 * t90 , rf , (-(phase + 180) ,) ) ] ) ] )
+
+
+def recoupling_baba() :
+    """
+    BABA block at 10 times the spin rate, one rotor period.
+    """
+    rf = (_rf ( 10.0 ) ,)
+    t90 = _rotor ( 0.025 )
+    td = _rotor ( 0.5 ) + t90 * -2
+    return Sequence ( 'baba' , [ Pulse ( t90 , rf , (0 ,) ) , Delay ( td ) , Pulse ( t90 , rf , (0 ,) ) ,
+                                 Pulse ( t90 , rf , (90 ,) ) , Delay ( td ) , Pulse ( t90 , rf , (270 ,) ) ] )
+
+
+def _decoupling(name , pulses , rf) :
+    """
+    Acquisition cycle of (duration Term, phase) pulses on the second channel, at the amplitude $rf.
+    """
+    return Sequence ( name , [ Pulse ( duration , (Term () , Term ( rf , name='rf' )) , (0 , phase) ) for duration , phase in pulses ] ,
+                      role='acquisition' )
+
+
+def decoupling_cw(rf=100000.0) :
+    tdec = Term ( 0.5e6 / rf )
+    return _decoupling ( 'cw' , [ (tdec , 0) , (tdec , 0) ] , rf )
+
+
+def decoupling_tppm(rf=100000.0 , phase=15.0) :
+    tdec , phase = Term ( 0.5e6 / rf ) , Phase ( phase )
+    return _decoupling ( 'tppm' , [ (tdec , phase) , (tdec , -phase) ] , rf )
+
+
+def decoupling_swftppm(rf=100000.0 , phase=15.0) :
+    tdec , phase = 0.5e6 / rf , Phase ( phase )
+    pulses = [ ]
+    for mul in ( 0.78 , 0.86 , 0.94 , 0.96 , 0.98 , 1 , 1.02 , 1.04 , 1.06 , 1.14 , 1.22 ) :
+        pulses += [ (Term ( mul * tdec ) , phase) , (Term ( mul * tdec ) , -phase) ]
+    return _decoupling ( 'swftppm' , pulses , rf )
+
+
+def decoupling_xix(rf=100000.0 , ratio=2.85) :
+    """
+    XiX with pulses of ratio rotor periods.
+    """
+    return _decoupling ( 'xix' , [ (_rotor ( ratio ) , 0) , (_rotor ( ratio ) , 180) ] , rf )
+
+
+def decoupling_spinal64(rf=100000.0 , phase=15.0) :
+    tdec , phase = Term ( 0.5e6 / rf ) , Phase ( phase )
+    pulses = [ ]
+    for sup in ( 1 , -1 , -1 , 1 , -1 , 1 , 1 , -1 ) :
+        for alpha , beta in ( (phase , -phase) , (phase + 5 , -phase - 5) , (phase + 10 , -phase - 10) ,
+                              (phase + 5 , -phase - 5) ) :
+            pulses += [ (tdec , sup * alpha) , (tdec , sup * beta) ]
+    return _decoupling ( 'spinal64' , pulses , rf )
+
+
+def decoupling_rcw(rf=100000.0) :
+    """
+    Rotor-synchronised CW with 90 degree phase shifted pulses, four rotor periods.
+    """
+    tdec = Term ( 0.5e6 / rf )
+    return _decoupling ( 'rcw' , [ (_rotor ( 1 ) + tdec * -0.5 , 0) , (tdec , 90) , (_rotor ( 1 ) + tdec * -1 , 0) ,
+                                   (tdec , 0) , (_rotor ( 1 ) + tdec * -1 , 0) , (tdec , 90) ,
+                                   (_rotor ( 1 ) + tdec * -0.5 , 0) ] , rf )
+
+
+def decoupling_wpmlg(rf=100000.0 , n_pulses=5 , window=4.6) :
+    """
+    Windowed PMLG on one channel: phase ramps of n_pulses up and down for both signs, then the window.
+    """
+    lg_offset = rf / math.sqrt ( 2.0 )
+    tau_lg = 1.0 / math.sqrt ( rf ** 2 + lg_offset ** 2 )
+    step = tau_lg * lg_offset * 360 / n_pulses
+    tau = Term ( tau_lg * 1e6 / n_pulses )
+    events = [ ]
+    phase = 180.0 - step / 2
+    for sup in ( 0 , 180 ) :
+        for _ in range ( n_pulses ) :
+            events.append ( Pulse ( tau , (Term ( rf , name='rf' ) ,) , (phase + sup ,) ) )
+            phase -= step
+        phase += step + 180
+        for _ in range ( n_pulses ) :
+            events.append ( Pulse ( tau , (Term ( rf , name='rf' ) ,) , (phase + sup ,) ) )
+            phase += step
+        events.append ( Delay ( Term ( window ) ) )
+    return Sequence ( 'wpmlg' , events , role='acquisition' )
+
+
+RECOUPLING = {
+    's3' : recoupling_s3 ,
+    'brs3' : recoupling_brs3 ,
+    'sr26' : recoupling_sr26 ,
+    'postc7' : recoupling_postc7 ,
+    'rseq' : recoupling_rseq ,
+    'baba' : recoupling_baba ,
+}
+DECOUPLING = {
+    'cw' : decoupling_cw ,
+    'tppm' : decoupling_tppm ,
+    'swftppm' : decoupling_swftppm ,
+    'xix' : decoupling_xix ,
+    'spinal64' : decoupling_spinal64 ,
+    'rcw' : decoupling_rcw ,
+    'wpmlg' : decoupling_wpmlg ,
+}
+# Sequences that acquire inside their cycle or manage their own stored propagators, kept as
+# written: pulseq_code puts them in a pulseq procedure as they are
+WRITTEN_OUT = {
+    'fslg' : """
+set rfk 100
+set rf [expr $rfk*1000]
+set lgoffset [expr $rf/sqrt(2.0)] ;# calculation of the LG offset
+set taulg [expr 1e6/sqrt(pow($rf,2)+pow($lgoffset,2))] ;# calculation of the total length of the LG pulse
+set window 4.6
+set pma [expr 2.5*54.74/90]
+
+for {set i 1} {$i <= $par(np)/$par(N)} {incr i} {
+    pulseid $pma 100000 y
+    offset $lgoffset
+    pulse $taulg $rf 0
+    offset [expr -1*$lgoffset]
+    pulse $taulg $rf 180
+    offset 0
+    pulseid $pma 100000 -y
+    acq
+    delay $window
+}
+""" ,
+    'lg4' : """
+set rfk 100
+set rf [expr $rfk*1000]
+set lgoffset [expr $rf/sqrt(2.0)] ;# calculation of the LG offset
+set taulg [expr 1e6/sqrt(pow($rf,2)+pow($lgoffset,2))] ;# calculation of the total length of the LG pulse
+set window 4.6
+set phadd 70
+
+for {set i 1} {$i <= $par(np)/2} {incr i} {
+    offset $lgoffset
+    pulse $taulg $rf [expr 90-$phadd]
+    offset [expr -1*$lgoffset]
+    pulse $taulg $rf [expr 270-$phadd]
+    offset 0
+    delay $window
+    acq
+    offset [expr -1*$lgoffset]
+    pulse $taulg $rf [expr -90+$phadd]
+    offset $lgoffset
+    pulse $taulg $rf [expr -270+$phadd]
+    offset 0
+    acq
+    delay $window
+}
+""" ,
+    'tedor' : """
+matrix set 10 elements {{1 3} {2 4} {3 1} {4 2}}
+
+set rfC  150000
+set rfP  150000
+set tr    [expr 1.0e6/$par(spin_rate)]
+set t90C  [expr 0.25e6/$rfC]
+set t180C [expr 2.0*$t90C]
+set t90P  [expr 0.25e6/$rfP]
+set t180P [expr 2.0*$t90P]
+
+
+reset
+delay [expr $tr/2.0-$t180P]
+pulse $t180P 0 x $rfP x
+delay [expr $tr/2.0-$t180P]
+pulse $t180P 0 x $rfP y
+store 1
+
+reset
+delay [expr 1*$tr-$t180C/2]
+pulse $t180C $rfC x 0 x
+delay [expr 1*$tr-$t180C/2]
+store 2
+reset
+
+reset
+pulse $t180P 0 x $rfP x
+delay [expr $tr/2.0-$t180P]
+pulse $t180P 0 x $rfP y
+delay [expr $tr/2.0-$t180P]
+store 3
+
+
+for {set s 0}{$s < $par(np)} {incr s} {
+reset
+
+prop 1 $s
+prop 2
+prop 3 $s
+
+
+pulseid 1 250000 x 250000 x
+pulseid 1 250000 x 250000 $ph
+filter 10
+
+prop 1 $s
+prop 2
+prop 3 $s
+
+acq
+}
+""" ,
+    'redor' : """
+set rf 100000
+set t180 [expr 0.5e6/$rf]
+set tr   [expr 1.0e6/$par(spin_rate)]
+set tr2  [expr $tr-$t180]
+
+reset
+delay $tr2
+pulse $t180 0 x $rf x
+delay $tr2
+pulse $t180 0 x $rf y
+store 1
+
+reset
+acq
+delay $tr2
+pulse $t180 0 x $rf x
+delay $tr2
+pulse $t180 $rf x 0 x
+prop 1
+store 2
+acq
+
+for {set i 2} {$i < $par(np)} {incr i} {
+reset
+prop 1
+prop 2
+prop 1
+store 2
+acq
+}
+""" ,
+}
+SEQUENCES = tuple ( RECOUPLING ) + tuple ( DECOUPLING ) + tuple ( WRITTEN_OUT )
+
+
+def pulseq_code(name , maxdt , spin_rate , sw , coherence_filter=None , indent='    ') :
+    """
+    pulseq procedure of a sequence of RECOUPLING or DECOUPLING, compiled by compile_pulseq, or
+    of WRITTEN_OUT, as written.
+    :param name: one of SEQUENCES
+    :return: (TCL code, report of compile_pulseq or None for a written out sequence)
+    """
+    if name in WRITTEN_OUT :
+        body = '\n'.join ( indent + line if line else line for line in WRITTEN_OUT[ name ].strip ( '\n' ).split ( '\n' ) )
+        return f"proc pulseq {{}} {{\n{indent}global par\n{indent}maxdt {maxdt:g}\n{body}\n}}\n" , None
+    builders = { **RECOUPLING , **DECOUPLING }
+    if name not in builders :
+        raise ValueError ( f"Unknown sequence {name}, use one of {', '.join ( SEQUENCES )}" )
+    return compile_pulseq ( builders[ name ] () , spin_rate , sw , maxdt , coherence_filter , indent )
@@ -0,0 +1,166 @@
+#%% Header files
+import io
+import json
+import os
+from dataclasses import dataclass , field
+
+import numpy as np
+
+from .par import parse_par , replace_block_entry
+from .powder import crystal_file_angles , crystal_file_text
+from .sweep import read_xreim
+
+MANIFEST = 'shards.json'
+# Runs one shard of a folder written by write_shards: the shard number is the first argument or the
+# array index of the batch scheduler (SLURM, PBS Pro, SGE or LSF; SGE and LSF count from 1)
+RUN_SCRIPT = """#!/bin/sh
+cd "$(dirname "$0")" || exit 1
+index=${1:-${SLURM_ARRAY_TASK_ID:-${PBS_ARRAY_INDEX:-$(( ${SGE_TASK_ID:-${LSB_JOBINDEX:-1}} - 1 ))}}}
+name=$(sed -n "$(( index + 1 ))p" shards.txt)
+[ -n "$name" ] || { echo "No shard $index" >&2 ; exit 1 ; }
+exec "${SIMPSON_EXECUTABLE:-simpson}" "$name.in"
+"""
+
+
+@dataclass
+class Shard :
+    """
+    One part of the crystallites of a powder average. The crystal file of the shard has its
+    weights normalised to one, and weight is the share of the shard in the whole powder, so
+    the full result is the sum of the shard results times their weights.
+    """
+    name: str
+    text: str
+    weight: float
+    files: dict = field ( default_factory=dict )
+
+
+#%% Functions
+def shard_indices(n , n_shards) :
+    """
+    Crystallites of every shard, taken one every n_shards so that each shard covers the whole
+    sphere and costs the same.
+    :return: list of index arrays, without empty shards
+    """
+    return [ np.arange ( k , n , n_shards ) for k in range ( min ( n_shards , n ) ) ]
+
+
+def split_input(text , n_shards , prefix='shard' , angles=None) :
+    """
+    Splits the crystallites of a SIMPSON input into shards, each with its own crystal file.
+    The gamma angles are not split: every shard keeps gamma_angles.
+    The main section must be linear in the FID (fsave, fft, zero filling and line broadening are,
+    magnitude spectra are not) for the merged result to equal the result of the whole input.
+    :param text: full input file
+    :param n_shards: number of shards, at most the number of crystallites
+    :param prefix: base name of the inputs and crystal files
+    :param angles: (alpha, beta, weights) of the crystal file, needed when it cannot be generated here
+    :return: list of Shard
+    """
+    par = parse_par ( text )
+    if angles is None :
+        if 'crystal_file' not in par :
+            raise ValueError ( "The input has no crystal_file" )
+        angles = crystal_file_angles ( par[ 'crystal_file' ].split ()[ 0 ] )
+    alpha , beta , weights = ( np.asarray ( a , dtype=float ) for a in angles )
+    total = weights.sum ()
+    if total <= 0 :
+        raise ValueError ( "The weights of the crystal file sum to zero" )
+    parts = shard_indices ( len ( alpha ) , max ( int ( n_shards ) , 1 ) )
+    width = len ( str ( max ( len ( parts ) - 1 , 0 ) ) )
+    shards = [ ]
+    for k , part in enumerate ( parts ) :
+        name = f"{prefix}_{k:0{width}d}"
+        weight = weights[ part ].sum ()
+        shard_text = replace_block_entry ( text , 'par' , r'^(\s*crystal_file\s+)\S.*?$' ,
+                                            lambda m : m.group ( 1 ) + name , f"crystal_file {name}" )
+        if 'name' in par :
+            shard_text = replace_block_entry ( shard_text , 'par' , r'^(\s*name\s+)\S.*?$' ,
+                                                lambda m : m.group ( 1 ) + name , None )
+        crystal = crystal_file_text ( alpha[ part ] , beta[ part ] ,
+                                      weights[ part ] / weight if weight else weights[ part ] )
+        shards.append ( Shard ( name=name , text=shard_text , weight=float ( weight / total ) ,
+                                files={ f"{name}.cry" : crystal } ) )
+    return shards
+
+
+def merge_results(shards , outputs) :
+    """
+    Weighted sum of the results of the shards.
+    :param shards: list of Shard
+    :param outputs: list, in shard order, of the content of the fsave -xreim file of each shard
+    :return: content of the merged file in the same x, real, imaginary format
+    """
+    if len ( outputs ) != len ( shards ) or any ( content is None for content in outputs ) :
+        raise ValueError ( "Every shard needs a result before merging" )
+    x , total = None , None
+    for shard , content in zip ( shards , outputs ) :
+        shard_x , data = read_xreim ( content )
+        if x is None :
+            x , total = shard_x , np.zeros ( len ( shard_x ) , dtype=complex )
+        elif len ( shard_x ) != len ( x ) :
+            raise ValueError ( f"{shard.name} has {len ( shard_x )} points instead of {len ( x )}" )
+        total += shard.weight * data
+    buffer = io.StringIO ()
+    np.savetxt ( buffer , np.column_stack ( (x , total.real , total.imag) ) , fmt='%.10e' )
+    return buffer.getvalue ()
+
+
+def shard_files(shards) :
+    """
+    Files of a folder for a batch scheduler: the inputs and crystal files of the shards, the
+    manifest used by merge_directory, the list of shard names and run_shard.sh.
+    :return: dict file name -> content
+    """
+    contents = { }
+    for shard in shards :
+        contents[ f"{shard.name}.in" ] = shard.text
+        contents.update ( shard.files )
+    contents[ MANIFEST ] = json.dumps ( { 'shards' : [ { 'name' : shard.name , 'weight' : shard.weight }
+                                                       for shard in shards ] } , indent=1 )
+    contents[ 'shards.txt' ] = ''.join ( f"{shard.name}\n" for shard in shards )
+    contents[ 'run_shard.sh' ] = RUN_SCRIPT
+    return contents
+
+
+def write_shards(directory , shards) :
+    """
+    Writes the files of shard_files into a folder.
+    :return: list of the paths written
+    """
+    os.makedirs ( directory , exist_ok=True )
+    paths = [ ]
+    for file_name , content in shard_files ( shards ).items () :
+        path = os.path.join ( directory , file_name )
+        with open ( path , 'w' ) as handle :
+            handle.write ( content )
+        paths.append ( path )
+    os.chmod ( os.path.join ( directory , 'run_shard.sh' ) , 0o755 )
+    return paths
+
+
+def read_manifest(content) :
+    """
+    Shards listed in a manifest written by write_shards, without their inputs.
+    :return: list of Shard
+    """
+    return [ Shard ( name=entry[ 'name' ] , text='' , weight=float ( entry[ 'weight' ] ) )
+             for entry in json.loads ( content )[ 'shards' ] ]
+
+
+def merge_directory(directory , suffix='.txt') :
+    """
+    Merges the results of a folder written by write_shards once every shard has run.
+    :param suffix: ending of the result files, <shard name><suffix>
+    :return: content of the merged file
+    """
+    with open ( os.path.join ( directory , MANIFEST ) ) as handle :
+        shards = read_manifest ( handle.read () )
+    missing = [ shard.name for shard in shards if not os.path.exists ( os.path.join ( directory , shard.name + suffix ) ) ]
+    if missing :
+        raise ValueError ( f"No result yet for {', '.join ( missing )}" )
+    outputs = [ ]
+    for shard in shards :
+        with open ( os.path.join ( directory , shard.name + suffix ) , 'rb' ) as handle :
+            outputs.append ( handle.read () )
+    return merge_results ( shards , outputs )
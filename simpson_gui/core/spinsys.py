@@ -0,0 +1,84 @@
+#%% Header files
+import re
+from dataclasses import dataclass , field
+
+# Number of values after the keyword for each interaction of a spinsys block
+INTERACTION_FIELDS = {
+    'shift' : ( 'i' , 'iso' , 'aniso' , 'eta' , 'alpha' , 'beta' , 'gamma' ) ,
+    'jcoupling' : ( 'i' , 'j' , 'iso' , 'aniso' , 'eta' , 'alpha' , 'beta' , 'gamma' ) ,
+    'dipole' : ( 'i' , 'j' , 'aniso' , 'alpha' , 'beta' , 'gamma' ) ,
+    'quadrupole' : ( 'i' , 'order' , 'aniso' , 'eta' , 'alpha' , 'beta' , 'gamma' ) ,
+}
+
+
+@dataclass
+class SpinSystem :
+    """
+    Content of a SIMPSON spinsys block. Interactions are dicts with the keys of
+    INTERACTION_FIELDS, spins numbered from 1 as in SIMPSON. Values given in ppm
+    (with a trailing p) are kept as strings until converted with to_hz.
+    """
+    nuclei: list
+    channels: list
+    interactions: list = field ( default_factory=list )
+
+    def of_type(self , kind) :
+        return [ interaction for interaction in self.interactions if interaction[ 'type' ] == kind ]
+
+
+#%% Functions
+def _value(token) :
+    if token.endswith ( 'p' ) :
+        return token
+    return float ( token )
+
+
+def parse_spinsys(text) :
+    """
+    Reads the spinsys block of a SIMPSON input (the block itself or a whole file).
+    :param text: SIMPSON input text
+    :return: SpinSystem
+    """
+    match = re.search ( r'spinsys\s*\{(.*?)\}' , text , flags=re.S )
+    body = match.group ( 1 ) if match else text
+    tokens = [ ]
+    for line in body.splitlines () :
+        line = line.split ( '#' , 1 )[ 0 ]
+        tokens.extend ( line.split () )
+
+    nuclei , channels , interactions = [ ] , [ ] , [ ]
+    pos = 0
+    current = None
+    while pos < len ( tokens ) :
+        token = tokens[ pos ]
+        if token in ( 'nuclei' , 'channels' ) :
+            current = nuclei if token == 'nuclei' else channels
+        elif token in INTERACTION_FIELDS :
+            names = INTERACTION_FIELDS[ token ]
+            values = tokens[ pos + 1 :pos + 1 + len ( names ) ]
+            if len ( values ) < len ( names ) :
+                raise ValueError ( f"Incomplete {token} line in spinsys" )
+            interaction = { 'type' : token }
+            for name , value in zip ( names , values ) :
+                interaction[ name ] = int ( float ( value ) ) if name in ( 'i' , 'j' , 'order' ) else _value ( value )
+            interactions.append ( interaction )
+            pos += len ( names ) + 1
+            current = None
+            continue
+        elif current is not None :
+            current.append ( token )
+        pos += 1
+    return SpinSystem ( nuclei=nuclei , channels=channels , interactions=interactions )
+
+
+def to_hz(value , nucleus , proton_frequency , nuclei) :
+    """
+    Converts a spinsys value to Hz, values in ppm carry a trailing p.
+    :param value: float in Hz or string such as '120p'
+    :param nucleus: name of the nucleus the value belongs to
+    :param proton_frequency: 1H Larmor frequency in Hz
+    :param nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    """
+    if isinstance ( value , str ) :
+        return float ( value[ :-1 ] ) * 1e-6 * abs ( nuclei.larmor_frequency ( nucleus , proton_frequency ) )
+    return float ( value )
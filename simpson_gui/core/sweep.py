@@ -0,0 +1,164 @@
+#%% Header files
+import io
+import itertools
+import re
+from dataclasses import dataclass , field
+
+import numpy as np
+
+from .dipolar import dipolar_constant
+from .par import replace_block_entry
+from .spinsys import parse_spinsys
+
+# Fields a sweep can bind values to:
+#   par.<key>         value of a par entry, e.g. par.spin_rate
+#   set.<name>        value of a Tcl variable, e.g. set.rf for "set rf ..." in the pulseq
+#   dipole.<i>.<j>    dipolar coupling in Hz between spins i and j
+#   distance.<i>.<j>  the same dipolar coupling given as a distance in Å
+FIELD_KINDS = ( 'par' , 'set' , 'dipole' , 'distance' )
+
+
+@dataclass
+class Sweep :
+    """
+    Values bound to fields of a SIMPSON input. In 'grid' mode every combination is run; in
+    'zip' mode the value lists have the same length and are run side by side.
+    """
+    axes: list = field ( default_factory=list )
+    mode: str = 'grid'
+
+    @property
+    def shape(self) :
+        if self.mode == 'zip' :
+            return ( len ( self.axes[ 0 ][ 1 ] ) ,) if self.axes else ( )
+        return tuple ( len ( values ) for _ , values in self.axes )
+
+    def points(self) :
+        """
+        Values of every point as dicts field -> value, in C order of shape.
+        """
+        names = [ name for name , _ in self.axes ]
+        if self.mode == 'zip' :
+            if len ( { len ( values ) for _ , values in self.axes } ) > 1 :
+                raise ValueError ( "All value lists of a zip sweep must have the same length" )
+            combinations = zip ( *[ values for _ , values in self.axes ] )
+        elif self.mode == 'grid' :
+            combinations = itertools.product ( *[ values for _ , values in self.axes ] )
+        else :
+            raise ValueError ( f"Unknown sweep mode {self.mode}, use grid or zip" )
+        return [ dict ( zip ( names , combination ) ) for combination in combinations ]
+
+
+#%% Functions
+def parse_values(text) :
+    """
+    Values of one axis: a comma separated list (1000, 2000, 5000) or start:stop:count for
+    count evenly spaced values from start to stop included.
+    :return: NumPy array
+    """
+    text = text.strip ()
+    if text.count ( ':' ) == 2 :
+        start , stop , count = ( part.strip () for part in text.split ( ':' ) )
+        return np.linspace ( float ( start ) , float ( stop ) , int ( count ) )
+    values = [ part.strip () for part in text.split ( ',' ) if part.strip () ]
+    if not values :
+        raise ValueError ( "An axis needs at least one value" )
+    return np.array ( [ float ( value ) for value in values ] )
+
+
+def _number(value) :
+    return f"{float ( value ):.10g}"
+
+
+def apply_value(text , name , value , nuclei=None) :
+    """
+    Sets one field of a SIMPSON input.
+    :param text: full input file
+    :param name: field, see FIELD_KINDS
+    :param value: number
+    :param nuclei: NucleusRegistry, needed for distance fields
+    :return: new input text
+    """
+    kind , _ , target = name.partition ( '.' )
+    if kind == 'par' :
+        return replace_block_entry ( text , 'par' , rf'^(\s*{re.escape ( target )}\s+)\S.*?$' ,
+                                      lambda m : m.group ( 1 ) + _number ( value ) ,
+                                      f"{target} {_number ( value )}" )
+    if kind == 'set' :
+        result , count = re.subn ( rf'^(\s*set\s+{re.escape ( target )}\s+)(\[[^\n]*\]|\S+)' ,
+                                   lambda m : m.group ( 1 ) + _number ( value ) , text , flags=re.M )
+        if count == 0 :
+            raise ValueError ( f"No 'set {target}' in the input" )
+        return result
+    if kind in ( 'dipole' , 'distance' ) :
+        i , j = ( int ( k ) for k in target.split ( '.' ) )
+        coupling = value
+        if kind == 'distance' :
+            if nuclei is None :
+                raise ValueError ( "Distance sweeps need the table of nuclei" )
+            spin_names = parse_spinsys ( text ).nuclei
+            coupling = dipolar_constant ( value , nuclei[ spin_names[ i - 1 ] ].gyr_hz , nuclei[ spin_names[ j - 1 ] ].gyr_hz )
+        return replace_block_entry ( text , 'spinsys' , rf'^(\s*dipole\s+{i}\s+{j}\s+)(\S+)' ,
+                                      lambda m : m.group ( 1 ) + _number ( coupling ) , None )
+    raise ValueError ( f"Unknown sweep field {name}, use one of {', '.join ( FIELD_KINDS )}" )
+
+
+def expand_sweep(text , sweep , nuclei=None , prefix='sweep') :
+    """
+    Input files of every point of a sweep.
+    :return: list of (name, input text, values of the point)
+    """
+    points = sweep.points ()
+    width = len ( str ( max ( len ( points ) - 1 , 0 ) ) )
+    inputs = [ ]
+    for index , point in enumerate ( points ) :
+        point_text = text
+        for name , value in point.items () :
+            point_text = apply_value ( point_text , name , value , nuclei )
+        inputs.append ( (f"{prefix}_{index:0{width}d}" , point_text , point) )
+    return inputs
+
+
+def read_xreim(content) :
+    """
+    Data saved with fsave -xreim: one line per point with x, real and imaginary parts.
+    :return: (x, complex data)
+    """
+    data = np.loadtxt ( io.BytesIO ( content ) if isinstance ( content , bytes ) else io.StringIO ( content ) , ndmin=2 )
+    return data[ : , 0 ] , data[ : , 1 ] + 1j * data[ : , 2 ]
+
+
+def stack_results(sweep , outputs) :
+    """
+    Stacks the results of every point into one array, NaN where a point has no result.
+    :param sweep: Sweep
+    :param outputs: list, in point order, of the content of the fsave -xreim file or None
+    :return: dict with 'data' (shape + (np,) complex array), 'x', 'mode', 'axes' (the field names)
+             and one array of values per field
+    """
+    curves = [ read_xreim ( content ) if content is not None else None for content in outputs ]
+    first = next ( ( curve for curve in curves if curve is not None ) , None )
+    if first is None :
+        raise ValueError ( "No point of the sweep has a result" )
+    x = first[ 0 ]
+    data = np.full ( (len ( curves ) , len ( x )) , np.nan + 1j * np.nan )
+    for index , curve in enumerate ( curves ) :
+        if curve is not None and len ( curve[ 1 ] ) == len ( x ) :
+            data[ index ] = curve[ 1 ]
+    result = { 'data' : data.reshape ( sweep.shape + (len ( x ) ,) ) , 'x' : x , 'mode' : np.array ( sweep.mode ) ,
+               'axes' : np.array ( [ name for name , _ in sweep.axes ] ) }
+    result.update ( { name : np.asarray ( values ) for name , values in sweep.axes } )
+    return result
+
+
+def point_output(outputs , name) :
+    """
+    The data file among the output files of one point: <name>.txt as written by the Main page,
+    otherwise the only .txt file.
+    :param outputs: dict file name -> content
+    :return: content, or None
+    """
+    if f"{name}.txt" in outputs :
+        return outputs[ f"{name}.txt" ]
+    candidates = [ content for file_name , content in outputs.items () if file_name.endswith ( '.txt' ) ]
+    return candidates[ 0 ] if len ( candidates ) == 1 else None
@@ -0,0 +1,130 @@
+#%% Header files
+import warnings
+from itertools import combinations
+
+import numpy as np
+
+from .dipolar import dipolar_constant
+from .lazy import LazyImport
+
+Rot = LazyImport ( 'scipy.spatial.transform' , 'Rotation' )
+
+
+#%% Reading
+def _text_lines(xyzfile) :
+    """
+    Line iterator over a path, a text file or a binary file such as a Streamlit upload.
+    """
+    if isinstance ( xyzfile , (str , bytes) ) or hasattr ( xyzfile , '__fspath__' ) :
+        with open ( xyzfile , 'r' ) as handle :
+            yield from handle
+        return
+    for line in xyzfile :
+        yield line.decode ( 'utf-8' , errors='replace' ) if isinstance ( line , bytes ) else line
+
+
+def iter_xyz_frames(xyzfile) :
+    """
+    Streams the frames of a (multi-frame) .xyz file one at a time, so that the memory
+    used does not depend on the number of frames.
+    :param xyzfile: path or file-like object of the format .xyz
+    :return: generator of (atoms, coordinates) with coordinates a (N, 3) array in Angstrom
+    """
+    lines = _text_lines ( xyzfile )
+    for header in lines :
+        if not header.strip () :
+            continue
+        num_atoms = int ( header.split ()[ 0 ] )
+        next ( lines )  # comment line
+        atoms = [ ]
+        coord_xyz = np.empty ( (num_atoms , 3) )
+        for k in range ( num_atoms ) :
+            fields = next ( lines ).split ()
+            atoms.append ( fields[ 0 ] )
+            coord_xyz[ k ] = fields[ 1 :4 ]
+        yield atoms , coord_xyz
+
+
+def align_to(reference , coord_xyz) :
+    """
+    Removes overall translation and rotation of a frame by superposing it onto a
+    reference frame (Kabsch, through scipy's Rotation.align_vectors).
+    """
+    ref_centred = reference - reference.mean ( axis=0 )
+    centred = coord_xyz - coord_xyz.mean ( axis=0 )
+    rotation , _ = Rot.align_vectors ( ref_centred , centred )
+    return rotation.apply ( centred ) + reference.mean ( axis=0 )
+
+
+#%% Averaging
+def dipolar_tensors(coord_xyz , idx_i , idx_j , gyr_i , gyr_j) :
+    """
+    Traceless dipolar tensors D (3 e e^T - 1) / 2 in Hz for a set of pairs, so that a static
+    pair has its zz principal value equal to the dipolar coupling constant.
+    :return: (P, 3, 3) array
+    """
+    vectors = coord_xyz[ idx_j ] - coord_xyz[ idx_i ]
+    dist = np.linalg.norm ( vectors , axis=1 )
+    unit = vectors / dist[ : , None ]
+    dip = dipolar_constant ( dist , gyr_i , gyr_j )
+    tensors = 1.5 * unit[ : , : , None ] * unit[ : , None , : ] - 0.5 * np.eye ( 3 )
+    return dip[ : , None , None ] * tensors
+
+
+def tensor_to_pas(tensors) :
+    """
+    Principal values and orientation of symmetric traceless tensors in the Haeberlen
+    convention |zz| >= |xx| >= |yy|.
+    :param tensors: (P, 3, 3) array
+    :return: (anisotropy zz, eta, Euler angles (P, 3) zyz in degrees from PAS to the molecular frame)
+    """
+    values , vectors = np.linalg.eigh ( tensors )
+    order = np.argsort ( np.abs ( values ) , axis=1 )[ : , [ 1 , 0 , 2 ] ]
+    values = np.take_along_axis ( values , order , axis=1 )
+    vectors = np.take_along_axis ( vectors , order[ : , None , : ] , axis=2 )
+    # right-handed PAS so that it is a proper rotation
+    vectors[ : , : , 2 ] *= np.sign ( np.linalg.det ( vectors ) )[ : , None ]
+    zz = values[ : , 2 ]
+    with np.errstate ( divide='ignore' , invalid='ignore' ) :
+        eta = np.where ( zz != 0 , (values[ : , 1 ] - values[ : , 0 ]) / zz , 0.0 )
+    with warnings.catch_warnings () :
+        # gimbal lock is the normal case for a PAS z axis along the molecular z axis
+        warnings.simplefilter ( 'ignore' , UserWarning )
+        angles = Rot.from_matrix ( vectors ).as_euler ( 'zyz' , degrees=True )
+    return zz , np.abs ( eta ) , angles
+
+
+def average_dipolar(frames , atoms_in_spinsys , gyr_atom , align=False) :
+    """
+    Motionally averaged dipolar tensors of all pairs of the chosen atoms, accumulated
+    frame by frame so that any number of frames can be streamed.
+    :param frames: iterable of (atoms, coordinates), e.g. iter_xyz_frames(file)
+    :param atoms_in_spinsys: 0-based atom indices of the spins, in spin system order
+    :param gyr_atom: gyromagnetic ratios in MHz/T of those atoms, same order
+    :param align: superpose every frame onto the first one before averaging
+    :return: (dict of arrays 'i', 'j' (0-based spin numbers), 'dip', 'eta', 'alpha', 'beta', 'gamma',
+              number of frames)
+    """
+    atoms_in_spinsys = np.asarray ( atoms_in_spinsys , dtype=np.intp )
+    gyr_atom = np.asarray ( gyr_atom , dtype=float )
+    spin_i , spin_j = (np.array ( p , dtype=np.intp ) for p in
+                       zip ( *combinations ( range ( len ( atoms_in_spinsys ) ) , 2 ) ))
+    idx_i , idx_j = atoms_in_spinsys[ spin_i ] , atoms_in_spinsys[ spin_j ]
+
+    total = np.zeros ( (len ( spin_i ) , 3 , 3) )
+    reference = None
+    count = 0
+    for _ , coord_xyz in frames :
+        if align :
+            if reference is None :
+                reference = coord_xyz
+            else :
+                coord_xyz = align_to ( reference , coord_xyz )
+        total += dipolar_tensors ( coord_xyz , idx_i , idx_j , gyr_atom[ spin_i ] , gyr_atom[ spin_j ] )
+        count += 1
+    if count == 0 :
+        raise ValueError ( "The trajectory has no frames" )
+
+    dip , eta , angles = tensor_to_pas ( total / count )
+    return { 'i' : spin_i , 'j' : spin_j , 'dip' : dip , 'eta' : eta ,
+             'alpha' : angles[ : , 0 ] , 'beta' : angles[ : , 1 ] , 'gamma' : angles[ : , 2 ] } , count
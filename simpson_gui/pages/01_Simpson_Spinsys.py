@@ -1,100 +1,253 @@
 #%% Header files
+import io
 import numpy as np
 import streamlit as st
-import os
-import pandas as pd
-from scipy.spatial.transform import Rotation as Rot
+from core.lazy import LazyImport
+from core.dipolar import read_xyz , dipolar_constant , pairwise_dipolar , dipolar_table
+from core.nuclei import load_nuclei
+from core.render import spinsys_block
+from core.neighbours import isotope_names , StructureIndex
+from core.bath import reduce_bath
+from core.trajectory import iter_xyz_frames , average_dipolar
+from core.lattice import read_cif , read_cell_text , periodic_dipolar , select_sites , rss_couplings
+
+pd = LazyImport ( 'pandas' )
 
 
 
 #%% Functions
-def dist2dipole(choice_nuc1 , choice_nuc2 , distance, table_of_nuclei) :
-    """
-    The function calculates the dipolar coupling in
-    Hz for two nuclei
-    :param table_of_nuclei:
-    :param choice_nuc1: The nucleus should be of the format 1H, 13C etc.
-    :param choice_nuc2: The nucleus should be of the format 1H, 13C etc.
-    :param distance: The distance should be in Angstrom
-    :return: Dipolar coupling between the two nuclei in Hz
-    """
-    gyr_ratio_m_hz_t = table_of_nuclei[ "GyrHz" ]
-    name_nuc = table_of_nuclei[ "Name" ]
-    pl = 6.62607015e-34 # Planck's constant
-    nuc1idx = name_nuc[ name_nuc.str.match ( choice_nuc1 ) ].index
-    nuc2idx = name_nuc[ name_nuc.str.match ( choice_nuc2 ) ].index
-
-    gyr1 = gyr_ratio_m_hz_t[ nuc1idx[ 0 ] ] * 1e6
-    gyr2 = gyr_ratio_m_hz_t[ nuc2idx[ 0 ] ] * 1e6
-
-    dip = -1.0e-7 * (gyr1 * gyr2 * pl) / ((float ( distance ) * 1.0e-10) ** 3.0)
-    return round ( dip , 2 )
-
-
-# noinspection PyArgumentList
-def angle_between_vectors(vec1 , vec2) :
-    """
-    The function calculates the Euler angles between two vectors
-    in the zyz convention. The conventions can be found in scipy's transform module
-    :param vec1: a vector of the format [i1, j1, k1]
-    :param vec2: b vector of the format [i2, j2, k2]
-    :return: a vector of three Euler angles connecting the two vectors
-    """
-    vec1 = vec1 / np.linalg.norm ( vec1 )
-    vec2 = vec2 / np.linalg.norm ( vec2 )
-    cp = np.cross ( vec1 , vec2 )
-    dp = np.dot ( vec1 , vec2 )
-    cosine_ang = dp
-    ssc = np.array ( [ [ 0 , -cp[ 2 ] , cp[ 1 ] ] , [ cp[ 2 ] , 0 , -cp[ 0 ] ] , [ -cp[ 1 ] , cp[ 0 ] , 0 ] ] )
-    rot_mat = np.identity ( 3 ) + ssc + np.dot ( ssc , ssc ) / (1 + cosine_ang)
-    ff = Rot.from_matrix ( rot_mat )
-    euler_angles = ff.as_euler ( 'zyz' , degrees='True' )
-    return euler_angles
+def distances_to_dipoles(result_df_dist , nuc , table_of_nuclei) :
+    """
+    Converts the distance column of the Distance table into dipolar couplings in one call.
+    :param result_df_dist: dataframe with columns i, j (1-based) and dist in Angstrom
+    :param nuc: the list of nuclei chosen
+    :param table_of_nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    :return: the same dataframe with dist replaced by the coupling in Hz
+    """
+    gyr_atom = table_of_nuclei.gyr_hz ( nuc )
+    idx_i = result_df_dist[ 'i' ].to_numpy ( dtype=int ) - 1
+    idx_j = result_df_dist[ 'j' ].to_numpy ( dtype=int ) - 1
+    dist = result_df_dist[ 'dist' ].to_numpy ( dtype=float )
+    result_df_dist[ 'dist' ] = np.round ( dipolar_constant ( dist , gyr_atom[ idx_i ] , gyr_atom[ idx_j ] ) , 2 )
+    return result_df_dist
+
+
+@st.cache_data ( max_entries=16 )
+def xyz_structure(content) :
+    """
+    Atoms and coordinates of an .xyz file, parsed once per file content.
+    :param content: bytes of the uploaded file
+    :return: (atoms, coordinates) as read_xyz
+    """
+    return read_xyz ( io.BytesIO ( content ) )
+
+@st.cache_data ( max_entries=16 )
+def xyz_couplings(content , nuc) :
+    """
+    Dipole table of every pair of atoms of an .xyz file, cached on the file content and the nuclei.
+    :param nuc: tuple of the nuclei of the atoms
+    """
+    _ , coord_xyz = xyz_structure ( content )
+    return dipolar_table ( pairwise_dipolar ( coord_xyz , load_nuclei ().gyr_hz ( list ( nuc ) ) ) )
+
+@st.cache_resource ( max_entries=8 )
+def structure_index(content) :
+    """
+    StructureIndex of an .xyz file, built once per file content and shared between sessions.
+    """
+    atoms , coord_xyz = xyz_structure ( content )
+    table_of_nuclei = load_nuclei ()
+    return StructureIndex ( coord_xyz , isotope_names ( atoms , table_of_nuclei ) , table_of_nuclei.gyr_by_name )
+
+@st.cache_data ( max_entries=32 )
+def reduced_bath(content , centres , bath , explicit , effective , radius) :
+    """
+    core.bath.reduce_bath of an .xyz file, cached on the file content and the reduction arguments.
+    :param centres: tuple of 0-based centre atoms
+    """
+    atoms , coord_xyz = xyz_structure ( content )
+    table_of_nuclei = load_nuclei ()
+    nuclei = isotope_names ( atoms , table_of_nuclei )
+    return reduce_bath ( coord_xyz , nuclei , table_of_nuclei.gyr_hz ( nuclei ) , list ( centres ) , bath=bath ,
+                         explicit=explicit , effective=effective , radius=radius )
+
+@st.cache_data ( max_entries=16 )
+def crystal_couplings(content , file_name , cutoff) :
+    """
+    Nuclei of the sites of a unit cell and their couplings within the cutoff, see core.lattice.periodic_dipolar,
+    cached on the file content and the cutoff.
+    :param file_name: name of the uploaded file, .cif or .cell
+    :return: (nuclei, pair data)
+    """
+    if file_name.endswith ( '.cif' ) :
+        atoms , fract , lattice = read_cif ( io.BytesIO ( content ) )
+    else :
+        atoms , fract , lattice = read_cell_text ( content.decode () )
+    table_of_nuclei = load_nuclei ()
+    nuclei = isotope_names ( atoms , table_of_nuclei )
+    return nuclei , periodic_dipolar ( fract , lattice , table_of_nuclei.gyr_hz ( nuclei ) , cutoff )
+
+@st.cache_data ( max_entries=8 )
+def trajectory_average(content , picked , gyr_atom , align) :
+    """
+    Averaged dipolar tensors of a trajectory, see core.trajectory.average_dipolar, cached on the
+    file content and the chosen atoms.
+    :return: (averaged pair data, number of frames)
+    """
+    return average_dipolar ( iter_xyz_frames ( io.BytesIO ( content ) ) , list ( picked ) , list ( gyr_atom ) ,
+                             align=align )
 
 def xyz_file_to_dipolar_data(xyzfile , nuc, num_nuc_func, table_of_nuclei) :
     """
     The function takes an .xyz file of a molecular structure and calculates the
     dipolar coupling and Euler angle between the different nuclei in the principal axis frame.
     :param nuc: the list of nuclei chosen
-    :param table_of_nuclei: The table containing all nuclear parameters
+    :param table_of_nuclei: NucleusRegistry from core.nuclei.load_nuclei
     :param xyzfile: Molecular structure file of the format .xyz
     :param num_nuc_func: nuber of nuclei
     :return: a pandas Dataframe containing the pair of nuclei, the dipolar coupling in Hz,
     and the Euler angles between the two tensors.
     """
 
-    mol = pd.read_csv ( xyzfile , sep=r'\s+' , skiprows=2 , names=[ 'atom' , 'x' , 'y' , 'z' ] , index_col=False )
-    if len ( mol ) != num_nuc_func :
+    _ , coord_xyz = xyz_structure ( xyzfile.getvalue () )
+    if len ( coord_xyz ) != num_nuc_func :
         raise ValueError ( "The number of Nuclei do not match" )
-    coord_xyz = mol[ [ 'x' , 'y' , 'z' ] ].to_numpy ()
-    pl = 6.62607015e-34
-    df_xyz_to_dip = pd.DataFrame ( columns=[ 'i' , 'j' , 'dip' , 'alpha' , 'beta' , 'gamma' ] )
-
-    gyr_atom = np.zeros(len(nuc))
 
-    for idx, nucleus in enumerate(nuc):
-        gyr_atom[idx] = table_of_nuclei[table_of_nuclei.Name.isin([nucleus]) == True]['GyrHz'].values
+    df_xyz_to_dip = xyz_couplings ( xyzfile.getvalue () , tuple ( nuc ) )
 
+    return df_xyz_to_dip
 
+def xyz_file_to_truncated_dipolar_data(xyzfile , nuc , num_nuc_func , table_of_nuclei) :
+    """
+    Picks a spin system of num_nuc_func spins out of a larger structure. The structure
+    is indexed once, the spins most strongly coupled to the chosen centre atom are kept
+    and couplings below the |D| threshold are dropped.
+    :param xyzfile: Molecular structure file of the format .xyz, atom labels are element symbols or nuclei
+    :param nuc: the list of nuclei chosen
+    :param num_nuc_func: number of nuclei in the spin system
+    :param table_of_nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    :return: a pandas Dataframe containing the pair of nuclei, the dipolar coupling in Hz,
+    and the Euler angles between the two tensors.
+    """
+    structure = structure_index ( xyzfile.getvalue () )
 
-    dist = np.zeros ( [ np.shape ( coord_xyz )[ 0 ] , np.shape ( coord_xyz )[ 0 ] ] )
-    dip = np.zeros ( [ np.shape ( coord_xyz )[ 0 ] , np.shape ( coord_xyz )[ 0 ] ] )
-    for idx in range ( 0 , np.shape ( coord_xyz )[ 0 ] ) :
-        gyr1 = gyr_atom[ idx ] * 1e6
-        for j in range ( idx + 1 , np.shape ( coord_xyz )[ 0 ] ) :
-            dist[ idx ][ j ] = np.sqrt ( np.sum ( (coord_xyz[ idx ] - coord_xyz[ j ]) ** 2 ) )
-            gyr2 = gyr_atom[ j ] * 1e6
-            dip[ idx ][ j ] = -1e-7 * (gyr1 * gyr2 * pl) / ((dist[ idx ][ j ] * 1e-10) ** 3)
+    centre = st.number_input ( "Centre atom (line number in the file)" , min_value=1 , max_value=len ( structure ) ,
+                               value=1 , step=1 , format='%d' )
+    threshold = st.number_input ( "Smallest |D| kept (Hz)" , min_value=1.0 , value=500.0 )
+    only_nucleus = st.selectbox ( "Couple to" , [ "any nucleus" ] + list ( structure.trees ) )
+    only_nucleus = None if only_nucleus == "any nucleus" else only_nucleus
 
-    for idx in range ( 0 , np.shape ( coord_xyz )[ 0 ] ) :
-        for j in range ( idx + 1 , np.shape ( coord_xyz )[ 0 ] ) :
-            euler_angles = np.round ( angle_between_vectors ( coord_xyz[ idx ] , coord_xyz[ j ] ) , 2 )
-            df_xyz_to_dip.loc[ idx * np.shape ( coord_xyz )[ 0 ] + j ] = [ idx + 1 , j + 1 ,
-                                                                           np.round ( dip[ idx ][ j ] , 2 ) ,
-                                                                           *euler_angles ]
+    picked , picked_nuclei , df_xyz_to_dip = structure.truncated_spin_system (
+        centre - 1 , threshold , max_spins=num_nuc_func , nucleus=only_nucleus )
+    st.write ( f"Atoms kept: {' '.join ( str ( a + 1 ) for a in picked )}" )
+    if picked_nuclei != list ( nuc ) :
+        st.warning ( f"Set the nuclei above to: {' '.join ( picked_nuclei )}" )
 
     return df_xyz_to_dip
 
+def xyz_file_to_reduced_dipolar_data(xyzfile , nuc , num_nuc_func , table_of_nuclei) :
+    """
+    Reduces the bath of a structure, e.g. the protons around a 13C, to a few spins: the most strongly
+    coupled bath atoms are kept and the others are merged into effective spins with root-sum-square
+    couplings, see core.bath.reduce_bath. The second moment retained per spin is reported.
+    :param xyzfile: Molecular structure file of the format .xyz, atom labels are element symbols or nuclei
+    :param nuc: the list of nuclei chosen
+    :param num_nuc_func: number of nuclei in the spin system
+    :param table_of_nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    :return: a pandas Dataframe containing the pair of nuclei, the dipolar coupling in Hz,
+    and the Euler angles between the two tensors.
+    """
+    atoms , _ = xyz_structure ( xyzfile.getvalue () )
+    nuclei = isotope_names ( atoms , table_of_nuclei )
+
+    present = list ( dict.fromkeys ( nuclei ) )
+    bath = st.selectbox ( "Bath nucleus" , present , index=present.index ( '1H' ) if '1H' in present else 0 )
+    centres = st.multiselect ( "Centre atoms (line number in the file)" ,
+                               [ k + 1 for k , name in enumerate ( nuclei ) if name != bath ] )
+    col1 , col2 , col3 = st.columns ( 3 )
+    explicit = col1.number_input ( "Bath atoms kept" , min_value=0 , value=1 , step=1 , format='%d' )
+    effective = col2.number_input ( "Effective spins" , min_value=0 ,
+                                    value=max ( 0 , num_nuc_func - len ( centres ) - explicit ) , step=1 , format='%d' )
+    radius = col3.number_input ( "Bath radius (A), 0 for all" , min_value=0.0 , value=0.0 )
+    if not centres :
+        st.info ( "Pick the centre atoms, e.g. the 13C of interest." )
+        return pd.DataFrame ()
+
+    reduced = reduced_bath ( xyzfile.getvalue () , tuple ( c - 1 for c in centres ) , bath , explicit , effective ,
+                             radius or None )
+    st.markdown ( "**Second moment retained per spin**" )
+    st.dataframe ( reduced.second_moment , hide_index=True ,
+                   column_config={ 'full' : st.column_config.NumberColumn ( 'RSS coupling in the structure (Hz)' , format='%.0f' ) ,
+                                   'reduced' : st.column_config.NumberColumn ( 'RSS coupling kept (Hz)' , format='%.0f' ) ,
+                                   'retained' : st.column_config.ProgressColumn ( 'Retained' , min_value=0.0 , max_value=1.0 ) } )
+    if reduced.nuclei != list ( nuc ) :
+        st.warning ( f"Set the nuclei above to: {' '.join ( reduced.nuclei )}" )
+
+    return reduced.table
+
+def crystal_file_to_dipolar_data(cellfile , nuc , num_nuc_func , table_of_nuclei) :
+    """
+    Dipolar couplings between sites of a crystal, including the periodic images in the
+    neighbouring cells. The closest image of every pair of the chosen sites goes into the
+    spin system, and the root-sum-square coupling of every site over all images within
+    the cutoff is shown for reference.
+    :param cellfile: .cif file, or .cell file (a b c alpha beta gamma, then label fx fy fz per line)
+    :param nuc: the list of nuclei chosen
+    :param num_nuc_func: number of nuclei in the spin system
+    :param table_of_nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    :return: a pandas Dataframe containing the pair of nuclei, the dipolar coupling in Hz,
+    and the Euler angles of the internuclear vectors.
+    """
+    cutoff = st.number_input ( "Cutoff radius (A)" , min_value=1.0 , max_value=30.0 , value=8.0 )
+    nuclei , pair_data = crystal_couplings ( cellfile.getvalue () , cellfile.name , cutoff )
+    site_labels = [ f"{k + 1}: {n}" for k , n in enumerate ( nuclei ) ]
+    chosen = st.multiselect ( "Sites in the spin system" , site_labels , max_selections=num_nuc_func )
+
+    rss_df = pd.DataFrame ( { 'site' : site_labels ,
+                              'rss dip (Hz)' : np.round ( rss_couplings ( pair_data , len ( nuclei ) ) , 2 ) } )
+    with st.expander ( "Root-sum-square couplings per site" ) :
+        st.dataframe ( rss_df , hide_index=True )
+
+    sites = np.array ( [ site_labels.index ( label ) for label in chosen ] , dtype=np.intp )
+    if [ nuclei[ k ] for k in sites ] != list ( nuc[ :len ( sites ) ] ) :
+        st.warning ( f"Set the nuclei above to: {' '.join ( nuclei[ k ] for k in sites )}" )
+    closest = select_sites ( pair_data , sites )
+
+    return dipolar_table ( closest )
+
+def trajectory_file_to_dipolar_data(xyzfile , nuc , num_nuc_func , table_of_nuclei) :
+    """
+    Motionally averaged dipolar couplings from an MD trajectory. The frames are streamed
+    and the dipolar tensors of the chosen atoms are averaged frame by frame.
+    SIMPSON's dipole line is axially symmetric, so the asymmetry of the averaged tensor
+    is only reported.
+    :param xyzfile: multi-frame .xyz file
+    :param nuc: the list of nuclei chosen
+    :param num_nuc_func: number of nuclei in the spin system
+    :param table_of_nuclei: NucleusRegistry from core.nuclei.load_nuclei
+    :return: a pandas Dataframe containing the pair of nuclei, the averaged dipolar coupling in Hz,
+    and the Euler angles of its principal axis frame.
+    """
+    atoms , _ = next ( iter_xyz_frames ( io.BytesIO ( xyzfile.getvalue () ) ) )
+    nuclei = isotope_names ( atoms , table_of_nuclei )
+    atom_labels = [ f"{k + 1}: {n}" for k , n in enumerate ( nuclei ) ]
+    chosen = st.multiselect ( "Atoms in the spin system" , atom_labels , max_selections=num_nuc_func )
+    align = st.checkbox ( "Remove overall rotation (superpose frames on the first one)" , value=True )
+    if len ( chosen ) < 2 :
+        return pd.DataFrame ()
+
+    picked = [ atom_labels.index ( label ) for label in chosen ]
+    if [ nuclei[ k ] for k in picked ] != list ( nuc[ :len ( picked ) ] ) :
+        st.warning ( f"Set the nuclei above to: {' '.join ( nuclei[ k ] for k in picked )}" )
+    averaged , num_frames = trajectory_average ( xyzfile.getvalue () , tuple ( picked ) ,
+                                                 tuple ( table_of_nuclei.gyr_hz ( [ nuclei[ k ] for k in picked ] ) ) , align )
+    st.write ( f"Averaged over {num_frames} frames" )
+    if np.any ( averaged[ 'eta' ] > 0.05 ) :
+        st.warning ( "Some averaged tensors are not axially symmetric (eta = "
+                     + ' '.join ( f"{e:.2f}" for e in averaged[ 'eta' ] ) + ")" )
+
+    return dipolar_table ( averaged )
+
 ### Functions for the different Interactions
 
 #%%% Chemical Shift
@@ -143,19 +296,20 @@ def j_coupling_tensor(num_nuc_j):
 
 #%%% Dipolar coupling
 
+@st.fragment
 def dipolar_coupling_tensor(num_nuc_d, nuc, table_of_nuclei):
     """
     Calculates the dipolar coupling for a given distance or a .xyz file
     :param num_nuc_d: number of nuclei
     :param nuc: name of nuclei to look for from the table
-    :param table_of_nuclei: database of nuclei
+    :param table_of_nuclei: NucleusRegistry from core.nuclei.load_nuclei
     :return: dataframe containing the dipolar coupling, euler angles and the nuclei numbers.
     """
     result_df_d_fn = pd.DataFrame ()
     st.subheader ( "Dipolar Coupling" , divider=True )
     # if 'select_dipolar_method' not in st.session_state :
     st.session_state.select_dipolar_method = result_df_d_fn
-    select_dipolar_method = st.segmented_control ( "Method" , options=[ "Direct" , "Distance" , "File" ] , selection_mode="single")
+    select_dipolar_method = st.segmented_control ( "Method" , options=[ "Direct" , "Distance" , "File" , "Crystal" , "Trajectory" ] , selection_mode="single")
     if select_dipolar_method == 'Direct' :
         d_coupling_df = pd.DataFrame ( columns=[ 'i' , 'j' , 'dip' , 'alpha' , 'beta' , 'gamma' ] )
         config_d = {
@@ -183,10 +337,7 @@ def dipolar_coupling_tensor(num_nuc_d, nuc, table_of_nuclei):
         }
         st.markdown ( "**Dipolar coupling**" )
         result_df_d_fn = st.data_editor ( d_coupling_df , column_config=config_d , num_rows='dynamic' )
-        for index , row in result_df_d_fn.iterrows () :
-            # result_df_d(3, 'Dipolar Coupling (Hz)', dist2dipole(nuc[row['i']-1], nuc[row['j']-1], row['dist']))
-            result_df_d_fn.at[ index , 'dist' ] = dist2dipole ( nuc[ row[ 'i' ] - 1 ] ,
-                                                                nuc[ row[ 'j' ] - 1 ] , row[ 'dist' ] , table_of_nuclei)
+        result_df_d_fn = distances_to_dipoles ( result_df_d_fn , nuc , table_of_nuclei )
         result_df_d_fn.insert ( 0 , 'Interaction' , "dipole" )
     elif select_dipolar_method == "File" :
         st.session_state.select_dipolar_method = "File"
@@ -211,7 +362,29 @@ def dipolar_coupling_tensor(num_nuc_d, nuc, table_of_nuclei):
         st.divider ()
         xyz_file = st.file_uploader ( 'xyz file' , type=[ 'xyz' ] )
         if xyz_file is not None :
-            result_df_d_fn = xyz_file_to_dipolar_data ( xyz_file , nuc, num_nuc_d, table_of_nuclei )
+            larger = st.radio ( "Structure" , [ "Same as the spin system" , "Larger, keep the strongest couplings" ,
+                                                "Larger, reduce the bath to effective spins" ] , horizontal=True )
+            if larger == "Larger, keep the strongest couplings" :
+                result_df_d_fn = xyz_file_to_truncated_dipolar_data ( xyz_file , nuc , num_nuc_d , table_of_nuclei )
+            elif larger == "Larger, reduce the bath to effective spins" :
+                result_df_d_fn = xyz_file_to_reduced_dipolar_data ( xyz_file , nuc , num_nuc_d , table_of_nuclei )
+            else :
+                result_df_d_fn = xyz_file_to_dipolar_data ( xyz_file , nuc, num_nuc_d, table_of_nuclei )
+            result_df_d_fn.insert ( 0 , 'Interaction' , "dipole" )
+    elif select_dipolar_method == "Crystal" :
+        st.session_state.select_dipolar_method = "Crystal"
+        st.markdown ( "A *.cif file, or a *.cell file with a b c alpha beta gamma on the first line "
+                      "followed by one line per atom: :red[Nucleus-Name] and fractional coordinates." )
+        cif_file = st.file_uploader ( 'Unit cell' , type=[ 'cif' , 'cell' ] )
+        if cif_file is not None :
+            result_df_d_fn = crystal_file_to_dipolar_data ( cif_file , nuc , num_nuc_d , table_of_nuclei )
+            result_df_d_fn.insert ( 0 , 'Interaction' , "dipole" )
+    elif select_dipolar_method == "Trajectory" :
+        st.session_state.select_dipolar_method = "Trajectory"
+        st.markdown ( "A multi-frame *.xyz file, i.e. frames of the format above one after the other." )
+        trajectory_file = st.file_uploader ( 'xyz trajectory' , type=[ 'xyz' ] )
+        if trajectory_file is not None :
+            result_df_d_fn = trajectory_file_to_dipolar_data ( trajectory_file , nuc , num_nuc_d , table_of_nuclei )
             result_df_d_fn.insert ( 0 , 'Interaction' , "dipole" )
 
     return result_df_d_fn
@@ -244,12 +417,8 @@ def main():
     """
     :return: spinsys section of the SIMPSON file.
     """
-    #%% Load nuclei data from file
-    script_dir = os.path.dirname ( __file__ )
-    csv_file = os.path.join ( script_dir, '../resources/NMR_freq_table.csv' )
-
-
-    table_of_nuclei = pd.read_csv ( csv_file )
+    #%% Load nuclei data, read once per process and shared by all sessions
+    table_of_nuclei = load_nuclei ()
 
 
     #%% Spin System Inputs
@@ -258,7 +427,7 @@ def main():
     num_nuc = st.number_input ( "How many nuclei?" , min_value=1 , max_value=10 , value=1 , step=1 , format='%d' )
     nuc = [ ]
     for i in range ( num_nuc ) :
-        nuc.append ( st.selectbox ( f"Nucleus {i + 1} : " , table_of_nuclei.Name.values.tolist () , index=2 ) )
+        nuc.append ( st.selectbox ( f"Nucleus {i + 1} : " , table_of_nuclei.names , index=2 ) )
 
     channels = list ( {k : None for k in nuc}.keys () )
 
@@ -266,10 +435,11 @@ def main():
 
     st.header ( "*Interactions*" , divider=True )
     st.info("Click on the check boxes to add interactions. You can add rows by clicking on the + sign as you hover")
-    result_df_cs = pd.DataFrame ()
-    result_df_j = pd.DataFrame ()
-    result_df_d = pd.DataFrame ()
-    result_df_q = pd.DataFrame ()
+    # tables of the interactions that are switched on, pandas is only loaded for those
+    result_df_cs = None
+    result_df_j = None
+    result_df_d = None
+    result_df_q = None
 
 
     if st.checkbox("Chemical Shift"):
@@ -284,9 +454,7 @@ def main():
             result_df_d = dipolar_coupling_tensor(num_nuc, nuc, table_of_nuclei)
 
 
-    mask = table_of_nuclei[ "Name" ].isin ( nuc )
-    spin_num = table_of_nuclei[ mask ][ "Spin" ]
-    if spin_num.gt ( 0.5 ).any () and st.checkbox("Quadrupolar Interaction"):
+    if any ( table_of_nuclei.spin ( n ) > 0.5 for n in nuc ) and st.checkbox("Quadrupolar Interaction"):
         result_df_q = quadrupolar_coupling_tensor(num_nuc)
 
 
@@ -295,22 +463,22 @@ def main():
 
     options = ['CS', 'J', 'dip', 'quad']
 
-    if not result_df_cs.empty :
+    if result_df_cs is not None and not result_df_cs.empty :
         str_cs = result_df_cs.to_string(index=False, header=False)
     else:
         str_cs = " "
 
-    if not result_df_d.empty :
+    if result_df_d is not None and not result_df_d.empty :
         str_d = result_df_d.to_string(index=False, header=False)
     else:
         str_d = " "
 
-    if result_df_j.empty:
+    if result_df_j is None or result_df_j.empty:
         str_j = " "
     else:
         str_j = result_df_j.to_string(index=False, header=False)
 
-    if not result_df_q.empty :
+    if result_df_q is not None and not result_df_q.empty :
         str_q = result_df_q.to_string(index=False, header=False)
     else:
         str_q = " "
@@ -333,11 +501,8 @@ def main():
     st.subheader ( 'Please press generate to get the code for SIMPSON file:' )
 
     if st.button("Generate"):
-        spinsys_code = ("spinsys { \n"
-                        + '\t nuclei    ' + ' '.join ( nuc ) + '\n'
-                        + '\t channels  ' + '   ' + ' '.join ( channels ) + '\n'
-                        + "\t " + code_text + '\n'
-                        + "}")
+        spinsys_code = spinsys_block ( nuc , [ line.strip () for line in code_text.splitlines () if line.strip () ] ,
+                                       channels )
         st.code(spinsys_code, language='tcl')
 
 
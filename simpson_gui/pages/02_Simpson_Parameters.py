@@ -1,9 +1,16 @@
 #%% Header files
-import re
 import streamlit as st
 import numpy as np
-import plotly.graph_objects as go
-import os
+from core.lazy import LazyImport
+from core.convergence import tensors_from_spinsys , powder_convergence , recommend_scheme
+from core.nuclei import load_nuclei
+from core.par import par_number
+from core.propagators import benchmark , benchmark_hamiltonian , recommend_domain , recommend_method
+from core.render import par_block
+from core.spinsys import parse_spinsys
+from core.powder import zcw_angles , zcw_fibonacci , bcr_angles , repulsion_angles , crystal_file_angles , crystal_file_text
+
+go = LazyImport ( 'plotly.graph_objects' )
 
 def zcw_sequence(n, zcw_type = 1) :
     """
@@ -15,141 +22,154 @@ def zcw_sequence(n, zcw_type = 1) :
         zcw_type (float): Type parameter which modifies behavior (1, 0.5, or 0.25).
 
     Returns:
-        tuple: (alpha, beta, gamma) NumPy arrays of angles.
-    """
-    # Match the `type` parameter
-    if zcw_type == 1 :
-        c = [ 1 , 2 , 1 ]
-    elif zcw_type == 0.5 :
-        c = [ -1 , 1 , 1 ]
-    elif zcw_type == 0.25 :
-        c = [ -1 , 1 , 4 ]
-    else :
-        raise ValueError ( "Unsupported ZCW type. Use 1, 0.5, or 0.25." )
-
-    # Use an approximate Fibonacci value for g2
-    # g2 is typically g(M-2), but we use N to calculate an estimate
-    g2 = int ( n / 2.618 )  # Use the golden ratio approximation for a balanced g2
-
-    # Initialize output arrays
-    beta = np.zeros ( n )
-    alpha = np.zeros ( n )
-    gamma = np.zeros ( n )  # Gamma is always 0.0
-
-    # Loop to calculate alpha, beta, and gamma
-    for m in range ( 1 , n + 1 ) :  # Loop from 1 to n (inclusive)
-        beta[ m - 1 ] = (180 / np.pi) * np.arccos ( c[ 0 ] * (c[ 1 ] * ((m / n) % 1.0) - 1.0) )
-        alpha[ m - 1 ] = (180 / np.pi) * 2.0 * np.pi * ((m * g2 / n) % 1.0) / c[ 2 ]
-        gamma[ m - 1 ] = 0.0  # Gamma is always 0 in the original logic
-
+        tuple: (alpha, beta) NumPy arrays of angles in degrees.
+    """
+    alpha , beta , _ = zcw_angles ( n , zcw_type )
     return alpha , beta
 
 
 def repulsion_sequence(n) :
-    script_dir = os.path.dirname ( __file__ )
-    num_orientations_file = os.path.join ( script_dir , '../resources/repangles_num.txt' )
-    num_orientations = np.loadtxt( num_orientations_file , dtype=float )
+    """
+    Repulsion set with n orientations, sliced out of the binary store of core.powder.
 
-    alpha_file = os.path.join ( script_dir , '../resources/repangles_alpha.txt' )
-    alpha_angles = np.loadtxt( alpha_file , dtype=float )
+    Parameters:
+        n (int): Number of orientations.
 
-    beta_file = os.path.join ( script_dir , '../resources/repangles_beta.txt' )
-    beta_angles = np.loadtxt ( beta_file , dtype=float )
-    idx = np.where(num_orientations == n)[0]
+    Returns:
+        tuple: (alpha, beta) NumPy arrays of angles in degrees.
+    """
+    alpha_rep , beta_rep , _ = repulsion_angles ( n )
+    return alpha_rep, beta_rep
 
-    alpha_rep = alpha_angles[:, idx].flatten()
-    beta_rep = beta_angles[:, idx].flatten()
 
-    alpha_rep = alpha_rep[ np.flatnonzero( alpha_rep ) ]
-    beta_rep = beta_rep[(np.flatnonzero(beta_rep))]
+def bcr_sequence(n) :
+    """
+    Generate BCR (Backus-Collins-Reinisch) sequence for powder averaging.
 
-    alpha_rep = np.where( alpha_rep < 0 , alpha_rep , 360.0 + alpha_rep )
-    beta_rep = np.where( beta_rep < 0 , beta_rep , 360.0 + beta_rep )
+    Parameters:
+        n (int): Number of orientations.
 
-    return alpha_rep, beta_rep
+    Returns:
+        tuple: (alpha, beta) NumPy arrays of angles in degrees.
+    """
+    alpha , beta , _ = bcr_angles ( n )
+    return alpha , beta
 
 
+@st.cache_data ( max_entries=8 )
+def custom_crystal_text(scheme , n , zcw_type) :
+    """
+    Content of a generated crystal file, cached on the generator arguments.
+
+    Parameters:
+        scheme (str): "zcw" or "bcr".
+        n (int): Number of orientations.
+        zcw_type (float): part of the sphere of a ZCW set (1, 0.5, or 0.25), ignored for BCR.
 
+    Returns:
+        str: the crystal file.
+    """
+    if scheme == "zcw" :
+        alpha , beta , weights = zcw_angles ( n , zcw_type )
+    else :
+        alpha , beta , weights = bcr_angles ( n )
+    return crystal_file_text ( alpha , beta , weights )
 
 
-def bcr_sequence(n) :
+@st.fragment
+def custom_crystal_file() :
     """
-    Generate BCR (Backus-Collins-Reinisch) sequence for powder averaging.
+    Lets the user generate a ZCW or BCR set of any size and download it as a SIMPSON crystal file.
+    """
+    with st.expander ( "Custom crystal file" ) :
+        scheme = st.selectbox ( "Scheme" , [ "zcw" , "bcr" ] )
+        n = st.number_input ( "Number of orientations" , min_value=1 , max_value=1000000 , value=4181 , format='%d' )
+        zcw_type = 1
+        if scheme == "zcw" :
+            zcw_type = st.selectbox ( "Part of the sphere" , [ 1 , 0.5 , 0.25 ] ,
+                                      format_func=lambda t : { 1 : "sphere" , 0.5 : "hemisphere" , 0.25 : "octant" }[ t ] )
+            if zcw_fibonacci ( n ) is None :
+                st.warning ( "Neither N nor N+1 is a Fibonacci number, the ZCW set is only approximate" )
+        file_name = f"{scheme}{n}.cry"
+        st.download_button ( label="Download crystal file" , data=custom_crystal_text ( scheme , n , zcw_type ) ,
+                             file_name=file_name , mime="text/plain" )
+        st.caption ( f"Use it with crystal_file {file_name[ :-4 ]} next to the input file" )
+
+
+@st.cache_data ( max_entries=64 )
+def powder_angles(powder_file) :
+    """
+    Orientations of one of the crystal files offered on the page, generated once per crystal file.
 
     Parameters:
-        n (int): Number of orientations.
+        powder_file (str): name of the crystal file, e.g. zcw232.
 
     Returns:
-        np.ndarray: Array of angles (alpha, beta) in radians.
+        tuple: (alpha, beta) NumPy arrays of angles in degrees, or None if the set cannot be generated.
     """
-    indices = np.arange ( 0 , n , dtype=float ) + 0.5
-    phi = 2 * np.pi * indices / n  # Uniform distribution of azimuthal angle
-    theta = np.arccos ( 1 - 2 * indices / n )  # Uniform distribution of polar angle
-    return phi*180./np.pi , theta * 180./np.pi
+    try :
+        alpha , beta , _ = crystal_file_angles ( powder_file )
+    except ValueError :
+        return None
+    return alpha , beta
 
 
+@st.cache_resource
+def sphere_meshes() :
+    """
+    Unit sphere and the two guide planes, built once per process.
+    The planes are flat, so a 2x2 grid draws them as well as a 100x100 one.
+    """
+    u = np.linspace ( 0 , 2 * np.pi , 48 )  # Azimuthal angles
+    v = np.linspace ( 0 , np.pi , 24 )  # Polar angles
+    sphere = (np.outer ( np.sin ( v ) , np.cos ( u ) ) , np.outer ( np.sin ( v ) , np.sin ( u ) ) ,
+              np.outer ( np.cos ( v ) , np.ones_like ( u ) ))
+    plane_a , plane_b = np.meshgrid ( [ -1.0 , 1.0 ] , [ -1.0 , 1.0 ] )
+    plane_xy = (plane_a , plane_b , np.zeros_like ( plane_a ))
+    plane_xz = (plane_a , np.zeros_like ( plane_a ) , plane_b)
+    return sphere , plane_xy , plane_xz
 
 
+def decimate(num_points , max_points) :
+    """
+    Indices of an evenly spaced subset of at most max_points out of num_points.
+    """
+    if max_points is None or num_points <= max_points :
+        return np.arange ( num_points )
+    return np.unique ( np.linspace ( 0 , num_points - 1 , max_points ).round ().astype ( int ) )
+
+
+def equal_area_density(theta , phi , n_azimuth=72 , n_bands=36) :
+    """
+    Histogram of orientations on equal-area cells: equal steps in azimuth and in cos(theta).
+
+    Returns:
+        tuple: (azimuth centres in degrees, cos(theta) centres, density relative to a uniform sphere)
+    """
+    counts , az_edges , cos_edges = np.histogram2d ( np.mod ( phi , 360.0 ) , np.cos ( np.radians ( theta ) ) ,
+                                                     bins=[ n_azimuth , n_bands ] , range=[ [ 0 , 360 ] , [ -1 , 1 ] ] )
+    density = counts * (n_azimuth * n_bands) / max ( len ( theta ) , 1 )
+    return 0.5 * (az_edges[ 1 : ] + az_edges[ :-1 ]) , 0.5 * (cos_edges[ 1 : ] + cos_edges[ :-1 ]) , density.T
+
 
-def plot_points_on_sphere_with_plotly(theta , phi) :
+def sphere_figure(theta , phi , max_points=None) :
     """
-    Plot points on a sphere using Plotly based on theta and phi angles.
+    Points on a sphere from theta (polar) and phi (azimuth) angles in degrees,
+    at most max_points of them.
     """
-    theta = theta * np.pi / 180.
-    phi = phi * np.pi / 180.
+    keep = decimate ( len ( theta ) , max_points )
+    theta = np.asarray ( theta )[ keep ] * np.pi / 180.
+    phi = np.asarray ( phi )[ keep ] * np.pi / 180.
     # Convert spherical coordinates to Cartesian
     x = np.sin ( theta ) * np.cos ( phi )
     y = np.sin ( theta ) * np.sin ( phi )
     z = np.cos ( theta )
 
-    # Create sphere surface
-    u = np.linspace ( 0 , 2 * np.pi , 100 )  # Azimuthal angles
-    v = np.linspace ( 0 , np.pi , 100 )  # Polar angles
-    x_sphere = np.outer ( np.sin ( v ) , np.cos ( u ) )
-    y_sphere = np.outer ( np.sin ( v ) , np.sin ( u ) )
-    z_sphere = np.outer ( np.cos ( v ) , np.ones_like ( u ) )
-
-    # Create Plotly figure
     fig = go.Figure ()
-
-    # Add the sphere surface
-    fig.add_trace ( go.Surface (
-        x=x_sphere ,
-        y=y_sphere ,
-        z=z_sphere ,
-        colorscale='Blues' ,
-        opacity=0.5 ,
-        showscale=False
-    ))
-    # Add the plane (let's say at z=0.5, define its size)
-    plane_z = 0.  # The Z-value where the plane will be placed
-    plane_x , plane_y = np.meshgrid ( np.linspace ( -1 , 1 , 100 ) , np.linspace ( -1 , 1 , 100 ) )  # Define a meshgrid
-    plane_z_values = np.full ( plane_x.shape , plane_z )  # All Z-values will have the value 0.5
-
-    # Add the plane to the figure
-    fig.add_trace ( go.Surface (
-        x=plane_x ,
-        y=plane_y ,
-        z=plane_z_values ,
-        colorscale='Reds' ,  # Give a different color to the plane
-        opacity=0.2 ,
-        showscale=False
-    ) )
-
-    # Add the plane (let's say at z=0.5, define its size)
-    plane_y = 0.  # The y-value where the plane will be placed
-    plane_x , plane_z = np.meshgrid ( np.linspace ( -1 , 1 , 100 ) , np.linspace ( -1 , 1 , 100 ) )  # Define a meshgrid
-    plane_y_values = np.full ( plane_x.shape , plane_y )  # All Z-values will have the value 0.5
-
-    # Add the plane to the figure
-    fig.add_trace ( go.Surface (
-        x=plane_x ,
-        z=plane_z ,
-        y=plane_y_values ,
-        colorscale='Reds' ,  # Give a different color to the plane
-        opacity=0.2 ,
-        showscale=False
-    ) )
+    for (mesh_x , mesh_y , mesh_z) , colorscale , opacity in zip ( sphere_meshes () , ( 'Blues' , 'Reds' , 'Reds' ) ,
+                                                                  ( 0.5 , 0.2 , 0.2 ) ) :
+        fig.add_trace ( go.Surface ( x=mesh_x , y=mesh_y , z=mesh_z , colorscale=colorscale ,
+                                     opacity=opacity , showscale=False ) )
 
     # Add data points on the sphere
     fig.add_trace ( go.Scatter3d (
@@ -161,8 +181,6 @@ def plot_points_on_sphere_with_plotly(theta , phi) :
         name='Points'
     ) )
 
-
-
     # Update layout
     fig.update_layout ( scene=dict (
         xaxis=dict ( visible=False ) ,
@@ -170,9 +188,159 @@ def plot_points_on_sphere_with_plotly(theta , phi) :
         zaxis=dict ( visible=False ) ,
         aspectmode='data'
     ) )
+    return fig
+
+
+def density_figure(theta , phi) :
+    """
+    Equal-area density map of the orientations, 1 means as dense as a uniform sphere.
+    """
+    azimuth , cos_theta , density = equal_area_density ( theta , phi )
+    fig = go.Figure ( go.Heatmap ( x=azimuth , y=cos_theta , z=density , colorscale='Viridis' ,
+                                   colorbar=dict ( title='density' ) ) )
+    fig.update_layout ( xaxis_title='azimuth (deg)' , yaxis_title='cos(polar angle)' )
+    return fig
+
+
+@st.cache_data ( max_entries=64 )
+def powder_figure(powder_file , view , max_points) :
+    """
+    Figure of a powder scheme, cached per scheme and view so that switching back is free.
+
+    Returns:
+        tuple: (figure or None, number of orientations)
+    """
+    angles = powder_angles ( powder_file )
+    if angles is None :
+        return None , 0
+    alpha , beta = angles
+    if view == "Density" :
+        return density_figure ( beta , alpha ) , len ( alpha )
+    return sphere_figure ( beta , alpha , max_points ) , len ( alpha )
+
+
+@st.fragment
+def powder_view(powder_file) :
+    """
+    Orientations of a crystal file on the sphere or as a density map. Changing the view only reruns this part.
+    """
+    view = st.segmented_control ( "View" , [ "Sphere" , "Density" ] , default="Sphere" )
+    show_all = st.toggle ( "Show every orientation" , value=False )
+    fig , num_points = powder_figure ( powder_file , view , None if show_all else 2000 )
+    if fig is None :
+        st.write ( 'Cannot generate figure' )
+    else :
+        if view != "Density" and not show_all and num_points > 2000 :
+            st.caption ( f"Showing 2000 of {num_points} orientations" )
+        st.plotly_chart ( fig )
+
+
+def plot_points_on_sphere_with_plotly(theta , phi , max_points=None) :
+    """
+    Plot points on a sphere using Plotly based on theta (polar) and phi (azimuth) angles.
+    """
+    st.plotly_chart ( sphere_figure ( theta , phi , max_points ) )
+
+
+@st.cache_data ( max_entries=16 )
+def convergence_table(spinsys_text , proton_frequency , options_crystal_file) :
+    """
+    Runs the powder convergence benchmark for every crystal file that can be generated.
 
-    # Show plot
-    st.plotly_chart ( fig )
+    Returns:
+        list: (name, number of orientations, relative error) sorted by orientation count.
+    """
+    tensors = tensors_from_spinsys ( parse_spinsys ( spinsys_text ) , proton_frequency , load_nuclei () )
+    schemes = { }
+    for powder_file in options_crystal_file :
+        angles = powder_angles ( powder_file )
+        if angles is not None and len ( angles[ 0 ] ) > 1 :
+            schemes[ powder_file ] = (*angles , np.full ( len ( angles[ 0 ] ) , 1.0 / len ( angles[ 0 ] ) ))
+    return powder_convergence ( tensors , schemes )
+
+
+@st.fragment
+def powder_convergence_benchmark(options_crystal_file , field) :
+    """
+    Recommends the smallest crystal file whose static powder pattern for the spin system
+    stays within a tolerance of a dense ZCW reference.
+    """
+    with st.expander ( "Which crystal file is enough? (powder convergence)" ) :
+        spinsys_text = st.session_state.get ( 'simpson_spinsys' ) or st.text_area (
+            "Paste the spinsys here:" , key='convergence_spinsys' , value=None )
+        tolerance = st.number_input ( "Tolerated relative error of the powder pattern" , min_value=0.001 ,
+                                      max_value=1.0 , value=0.05 , format='%.3f' )
+        if not spinsys_text or not st.button ( "Run the benchmark" ) :
+            return
+        try :
+            results = convergence_table ( spinsys_text , float ( field ) * 1e6 , tuple ( options_crystal_file ) )
+        except ValueError as error :
+            st.error ( str ( error ) )
+            return
+        st.dataframe ( { 'crystal file' : [ r[ 0 ] for r in results ] ,
+                         'orientations' : [ r[ 1 ] for r in results ] ,
+                         'error' : [ round ( r[ 2 ] , 4 ) for r in results ] } , hide_index=True )
+        fig = go.Figure ( go.Scatter ( x=[ r[ 1 ] for r in results ] , y=[ r[ 2 ] for r in results ] ,
+                                       mode='markers' , text=[ r[ 0 ] for r in results ] ) )
+        fig.add_hline ( y=tolerance , line_dash='dash' )
+        fig.update_layout ( xaxis_type='log' , yaxis_type='log' , xaxis_title='orientations' ,
+                            yaxis_title='relative error' )
+        st.plotly_chart ( fig )
+        best = recommend_scheme ( results , tolerance )
+        if best is None :
+            st.warning ( "None of the crystal files reaches this tolerance" )
+        else :
+            st.success ( f"Smallest adequate crystal file: {best[ 0 ]} ({best[ 1 ]} orientations, error {best[ 2 ]:.3f})" )
+
+
+@st.cache_data ( max_entries=16 )
+def method_benchmark(spinsys_text , proton_frequency , maxdt , rf) :
+    """
+    Times the propagator algorithms on a Hamiltonian of the spin system.
+
+    Returns:
+        list: dicts with method, seconds and error, fastest first.
+    """
+    h = benchmark_hamiltonian ( parse_spinsys ( spinsys_text ) , proton_frequency , load_nuclei () , rf=rf )
+    return benchmark ( h , maxdt * 1e-6 )
+
+
+def propagation_benchmark(field , spinning_frequency , sw , gamma_angles) :
+    """
+    Times on this machine the propagator algorithms SIMPSON offers, for the spin system being
+    built and a step of maxdt, and recommends the fastest accurate one with the domain suited
+    to the sampling (Tošner, JMR 246 (2014) 79 compares them inside SIMPSON).
+
+    Returns:
+        list: methods to pre-select, or None before the benchmark is run.
+    """
+    with st.expander ( "Which propagation method is fastest here?" ) :
+        spinsys_text = st.session_state.get ( 'simpson_spinsys' ) or st.text_area (
+            "Paste the spinsys here:" , key='method_spinsys' , value=None )
+        maxdt = st.number_input ( "maxdt of the pulse sequence in µs" , min_value=0.01 , value=1.0 )
+        rf = st.number_input ( "Strongest rf field in Hz" , min_value=0.0 , value=100000.0 , step=10000.0 )
+        if spinsys_text and st.button ( "Time the methods" ) :
+            try :
+                results = method_benchmark ( spinsys_text , float ( field ) * 1e6 , maxdt , rf )
+            except (KeyError , ValueError) as error :
+                st.error ( str ( error ) )
+                return None
+            try :
+                sw_hz = par_number ( { 'sw' : str ( sw ) , 'spin_rate' : str ( spinning_frequency ) } , 'sw' )
+            except (KeyError , ValueError) :
+                sw_hz = spinning_frequency
+            method = recommend_method ( results )
+            domain = recommend_domain ( spinning_frequency , sw_hz , gamma_angles )
+            st.session_state[ 'method_benchmark' ] = (results , [ domain ] + ([ method ] if method else [ ]))
+        if 'method_benchmark' not in st.session_state :
+            return None
+        results , recommended = st.session_state[ 'method_benchmark' ]
+        st.dataframe ( { 'method' : [ r[ 'method' ] for r in results ] ,
+                         'time per step (µs)' : [ round ( r[ 'seconds' ] * 1e6 , 1 ) for r in results ] ,
+                         'error' : [ f"{r[ 'error' ]:.1e}" for r in results ] } , hide_index=True )
+        st.success ( f"Recommended: {' '.join ( recommended )}, selected below" )
+        st.caption ( "NumPy/SciPy timings of the same algorithms; SIMPSON's own ranking follows the same trend." )
+        return recommended
 
 
 def main () :
@@ -201,23 +369,10 @@ def main () :
     powder_file = st.selectbox ( "Which powder averaging scheme?" , options_crystal_file ,
                                  index=27 )
     if powder_file is not None :
-        match = re.split ( r"([A-Za-z]+)([0-9]+)" , powder_file )
-        if match[ 1 ] == 'bcr' :
-            alpha , beta = bcr_sequence ( int ( match[ 2 ] ) )
-            plot_points_on_sphere_with_plotly ( alpha , beta )
-        elif match[ 1 ] == 'zcw' :
-            alpha , beta = zcw_sequence ( int ( match[ 2 ] ) )
-            plot_points_on_sphere_with_plotly ( alpha , beta )
-        elif match[ 1 ] == 'rep' :
-            alpha , beta = repulsion_sequence ( float ( match[ 2 ] ) )
-            plot_points_on_sphere_with_plotly ( alpha , beta )
-        elif powder_file == "alpha0beta0":
-            plot_points_on_sphere_with_plotly ( np.zeros(100) , np.zeros(100))
-        elif powder_file == "alpha0beta90":
-            plot_points_on_sphere_with_plotly ( 90.0 * np.ones ( 100 ), np.zeros ( 100 )  )
-        else :
-            st.write ( 'Cannot generate figure'
-                       )
+        powder_view ( powder_file )
+
+    custom_crystal_file ()
+    powder_convergence_benchmark ( options_crystal_file , field )
 
     gamma_angles = st.number_input ("Number of gamma angles", min_value=0, max_value=512, value=8, format='%d')
 
@@ -250,37 +405,17 @@ def main () :
     conjugate_fid = st.selectbox("True or False?", ["false", "true"], index=0)
 
     value_methods = ["direct", "freq", "gcompute", "dysev", "dysevr", "pade", "taylor", "cheby1", "cheby2"]
-    method_of_sim = st.pills("Method of propagation", value_methods, selection_mode="multi", default=value_methods[0])
-
-    gen_str_method = ""
-    for methods in method_of_sim:
-        gen_str_method = gen_str_method + methods + " "
-
-    script_dir = os.path.dirname ( __file__ )
-    prop_image_file = os.path.join ( script_dir , '../resources/prop_methods.jpg' )
-
-
-    st.image( prop_image_file, width=256, caption="Performance comparison of different strategies implemented in "
-                                                              "SIMPSON for propagator calculation for one carbon and 1–9 protons"
-                                                              "Tošner, Z. ‘Computer-Intensive Simulation of Solid-State NMR Experiments Using SIMPSON’. JMR 246 (2014): 79–93. https://doi.org/10.1016/j.jmr.2014.07.002."
-             )
+    recommended = propagation_benchmark ( field , spinning_frequency , sw , gamma_angles )
+    method_of_sim = st.pills("Method of propagation", value_methods, selection_mode="multi",
+                             default=recommended or value_methods[0])
 
 
     st.divider()
     if st.button("Generate code"):
-        par_code = (" par {  \n \t proton_frequency \t" + f"{float ( field ) * (10.0 ** 6):.4e} \n"
-                            "\t spin_rate \t" + f"{spinning_frequency} \n"
-                              "\t crystal_file \t" + f"{powder_file} \n"
-                                 "\t gamma_angles \t" + f"{gamma_angles} \n"
-                                                        "\t start_operator \t" + f"{start_operator} \n"
-                                                                                 "\t detect_operator \t" + f"{detect_operator} \n"
-                                                                                                           "\t verbose \t" + f"{verbose} \n"
-                                                                                                                             "\t np \t" + f"{number_of_acq_points} \n"
-                                                                                                                                          "\t sw \t" + f"{sw} \n"
-                                                                                                                                                       "\t conjugate_fid \t" + f"{conjugate_fid} \n"
-                                                                                                                                                                               "\t method \t" + f"{gen_str_method} \n"
-                                                                                                                                                                                                "}"
-                    )
+        par_code = par_block ( proton_frequency=float ( field ) * 1e6 , spin_rate=spinning_frequency ,
+                               crystal_file=powder_file , gamma_angles=gamma_angles , start_operator=start_operator ,
+                               detect_operator=detect_operator , verbose=verbose , np=number_of_acq_points , sw=sw ,
+                               conjugate_fid=conjugate_fid , method=method_of_sim )
         st.code(par_code, language="Tcl")
 
 if __name__ == '__main__':
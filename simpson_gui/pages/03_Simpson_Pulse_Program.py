@@ -1,415 +1,129 @@
 import streamlit as st
 
-def generate_recoupling(type):
-
-    def recoupling_s3():
-        recoupling_code = f"""
-        set rf [expr 0.5*$par(spin_rate)]
-        set t90 [expr 0.25e6/$rf]
-        set t270 [expr 0.75e6/$rf]
-        set t360 [expr 1e6/$rf]
-        set par(sw) [expr $par(spin_rate)/16]
-        set ph 90
-        for {{set i 1}} {{$i <= 2}} {{incr i}} {{
-            pulse $t360 $rf [expr $ph+fmod($i,2)*180]
-            pulse $t270 $rf [expr $ph+fmod($i,2)*180+180]
-            pulse $t90  $rf [expr $ph+fmod($i,2)*180]
-        }}
-        for {{set i 1}} {{$i <= 2}} {{incr i}} {{
-            pulse $t360 $rf [expr $ph+fmod($i,2)*180+180]
-            pulse $t270 $rf [expr $ph+fmod($i,2)*180]
-            pulse $t90  $rf [expr $ph+fmod($i,2)*180+180]
-        }}
-        """
-        return recoupling_code
-
-    def recoupling_brs3():
-        recoupling_code = f"""
-        set rf [expr 0.5*$par(spin_rate)]
-        set t90 [expr 0.25e6/$rf]
-        set t270 [expr 0.75e6/$rf]
-        set t360 [expr 1e6/$rf]
-        set par(sw) [expr $par(spin_rate)/16]
-        set ph 90
-        pulseid 1 250000 x
-        for {{set i 1}} {{$i <= 2}} {{incr i}} {{
-            pulse $t360 $rf [expr $ph+fmod($i,2)*180]
-            pulse $t270 $rf [expr $ph+fmod($i,2)*180+180]
-            pulse $t90  $rf [expr $ph+fmod($i,2)*180]
-        }}
-        for {{set i 1}} {{$i <= 2}} {{incr i}} {{
-            pulse $t360 $rf [expr $ph+fmod($i,2)*180+180]
-            pulse $t270 $rf [expr $ph+fmod($i,2)*180]
-            pulse $t90  $rf [expr $ph+fmod($i,2)*180+180]
-        }}
-        pulseid 1 250000 -x
-        """
-        return recoupling_code
-
-    def recoupling_sr26():
-        recoupling_code = f"""
-        set rf [expr 6.5*$par(spin_rate)]
-        set t90 [expr 0.25e6/$rf]
-        set t270 [expr 0.75e6/$rf]
-        set ph [expr 180*11/26]
-        set ph1 [expr $ph+180]
-        set ph2 [expr -$ph+180]
-
-        for {{set k 1}} {{$k <= 2}} {{incr k}} {{
-            for {{set j 1}} {{$j <= 2}} {{incr j}} {{
-                for {{set i 1}} {{$i <= 13}} {{incr i}} {{
-                    pulse $t90  $rf [expr pow(-1,$k-1)*pow(-1,$j-1)*$ph+fmod($k+1,2)*180]
-                    pulse $t270 $rf [expr pow(-1,$k-1)*pow(-1,$j-1)*$ph+fmod($k,2)*180]
-                    pulse $t90  $rf [expr -pow(-1,$k-1)*pow(-1,$j-1)*$ph+fmod($k+1,2)*180]
-                    pulse $t270 $rf [expr -pow(-1,$k-1)*pow(-1,$j-1)*$ph+fmod($k,2)*180]
-                }}
-            }}
-        }}
-        """
-        return recoupling_code
-
-    def recoupling_postc7():
-        recoupling_code = f"""
-        set rf [expr 7*$par(spin_rate)]
-        set t90 [expr 0.25e6/$rf]
-        for {{set i 1}} {{$i <= 7}} {{incr i}} {{
-            set phase [expr $i*360.0/7.0]
-            pulse $t90 $rf $phase
-            pulse [expr 4.0*$t90] $rf [expr $phase+180]
-            pulse [expr 3.0*$t90] $rf $phase
-        }}
-        """
-        return recoupling_code
-
-    def recoupling_rseq():
-        recoupling_code = f"""
-        # e.g. for R20_2^9
-        set N 20
-        set nsub 2
-        set nusub 9
-        set rf [expr ($N/$nsub*$par(spin_rate)]
-        set t90 [expr 0.25e6/$rf]
-        set phase [expr 180*$nusup/$par(N)]
-        set loops [expr $par(N)/2]
-        for {{set i 1}} {{$i <= $loops}} {{incr i}} {{
-            pulse $t90 $rf $phase
-            pulse [expr 3.0*$t90] $rf [expr $phase+180]
-            pulse $t90 $rf -$phase
-            pulse [expr 3.0*$t90] $rf [expr -($phase+180)]
-        }}
-        """
-        return recoupling_code
-
-    def recoupling_baba():
-        recoupling_code = f"""
-        set rf [expr 10*$par(spin_rate)]
-        set t90 [expr 0.25e6/$rf]
-        set td [expr (0.5e6/$par(spin_rate))-(2*$t90)]
-        pulse $t90 $rf x
-        delay $td
-        pulse $t90 $rf x
-        pulse $t90 $rf y
-        delay $td
-        pulse $t90 $rf -y
-        pulse $t90 $rf x
-        # Additional steps are omitted for brevity
-        """
-        return recoupling_code
+from core.cost import rf_amplitude
+from core.nuclei import load_nuclei
+from core.par import par_number, parse_par
+from core.preview import largest_maxdt
+from core.sequence import DECOUPLING, RECOUPLING, WRITTEN_OUT, compile_pulseq, describe, events_tcl, pulseq_code, variables_tcl
+from core.spinsys import parse_spinsys
 
-    # Map type to corresponding TCL string generator
-    recoupling_generators = {
-        "s3": recoupling_s3,
-        "brs3": recoupling_brs3,
-        "sr26": recoupling_sr26,
-        "postc7": recoupling_postc7,
-        "rseq": recoupling_rseq,
-        "baba": recoupling_baba,
-    }
-
-    if type in recoupling_generators:
-        return recoupling_generators[type]()
-    else:
+def generate_recoupling(type):
+    """
+    TCL events of one cycle of a homonuclear recoupling sequence, see core.sequence.RECOUPLING.
+    """
+    if type not in RECOUPLING:
         raise ValueError(f"Unknown pulse type: {type}")
+    events = RECOUPLING[type]().events
+    return '\n'.join(variables_tcl(events) + events_tcl(events))
 
 
 def generate_decoupling(type) :
-    def decoupling_cw() :
-        decoupling_code = f"""
-        acq_block {{
-            pulse $tdec 0 x $rf 0
-            pulse $tdec 0 x $rf 0
-        }}
-        """
-        return decoupling_code
-
-    def decoupling_tppm() :
-        decoupling_code = f"""
-        acq_block {{
-            pulse $tdec 0 x $rf $ph
-            pulse $tdec 0 x $rf -$ph
-        }}
-        """
-        return decoupling_code
-
-    def decoupling_swftppm() :
-        decoupling_code = f"""
-        acq_block {{
-            foreach mul [list 0.78 0.86 0.94 0.96 0.98 1 1.02 1.04 1.06 1.14 1.22] {{
-                pulse [expr $mul*$tdec] 0 0 $rf $ph
-                pulse [expr $mul*$tdec] 0 0 $rf -$ph
-            }}
-        }}
-        """
-        return decoupling_code
-
-    def decoupling_xix() :
-        decoupling_code = f"""
-        acq_block {{
-            pulse [expr $par(tr)*$par(xix)] 0 x $rf x
-            pulse [expr $par(tr)*$par(xix)] 0 x $rf -x
-        }}
-        """
-        return decoupling_code
-
-    def decoupling_spinal64() :
-        decoupling_code = f"""
-        acq_block {{
-            foreach sup [list 1 -1 -1 1 -1 1 1 -1] {{
-                pulse $tdec 0 x $rf [expr $sup*$ph]
-                pulse $tdec 0 x $rf [expr -$sup*$ph]
-                pulse $tdec 0 x $rf [expr $sup*($ph+5)]
-                pulse $tdec 0 x $rf [expr $sup*(-$ph-5)]
-                pulse $tdec 0 x $rf [expr $sup*($ph+10)]
-                pulse $tdec 0 x $rf [expr $sup*(-$ph-10)]
-                pulse $tdec 0 x $rf [expr $sup*($ph+5)]
-                pulse $tdec 0 x $rf [expr $sup*(-$ph-5)]
-            }}
-        }}
-        """
-        return decoupling_code
+    """
+    TCL events of one cycle of a decoupling sequence, see core.sequence.DECOUPLING; fslg and lg4
+    acquire inside their cycle and are written out in core.sequence.WRITTEN_OUT.
+    """
+    if type in DECOUPLING :
+        events = DECOUPLING[ type ] ().events
+        return '\n'.join ( variables_tcl ( events ) + events_tcl ( events ) )
+    if type in ( 'fslg' , 'lg4' ) :
+        return WRITTEN_OUT[ type ]
+    raise ValueError ( f"Unknown decoupling type: {type}" )
 
-    def decoupling_rcw() :
-        decoupling_code = f"""
-        acq_block {{
-            pulse [expr $par(tr)-0.5*$tdec] 0 0 $rf 0
-            pulse $tdec 0 0 $rf 90
-            pulse [expr $par(tr)-$tdec] 0 0 $rf 0
-            pulse $tdec 0 0 $rf 0
-            pulse [expr $par(tr)-$tdec] 0 0 $rf 0
-            pulse $tdec 0 0 $rf 90
-            pulse [expr $par(tr)-0.5*$tdec] 0 0 $rf 0
-        }}
-        """
-        return decoupling_code
-
-    def decoupling_wpmlg() :
-        decoupling_code = f"""
-            set rfk 100 ;# Power in kHz for decoupling
-            set N 5 ;# number of PMLG pulses here PMLG5
-            set phlist [list 0 180] 
-            set rf [expr $rfk*1000]
-            set lgoffset [expr $rf/sqrt(2.0)] ;# calculation of the LG offset
-            set taulg [expr 1.0/sqrt(pow($rf,2)+pow($lgoffset,2))] ;# calculation of the total length of the LG pulse
-            set wpmlgph [expr $taulg*$lgoffset*360/$N] ;# calculates the phase of the first pulse of wPMLG
-            set phshift [expr $wpmlgph/2] ;# this is a half phase increment/decrement shift in the first pulse of PMLG
-            set taupmlg [expr $taulg*1.0e6/$N] ;# calculates the length of each pulse of pmlg
-            set window 4.6
-            set phpmlg [expr 180.0 - $phshift]
-            set propno 0
-            foreach sup $phlist {{
-            for {{set i 1}} {{$i <= $N}} {{incr i}} {{
-                pulse $taupmlg $rf [expr fmod($phpmlg + $sup, 360)]
-                # puts "pulse $taupmlg $rf [expr fmod($phpmlg + $sup, 360)]"
-                set phpmlg [expr {{$phpmlg - $wpmlgph}}] 
-            }}
-            set phpmlg [expr {{$phpmlg + $wpmlgph + 180}}]
-            for {{set i 1}} {{$i <= $N}} {{incr i}} {{
-                pulse $taupmlg $rf [expr fmod($phpmlg + $sup, 360)]
-                # puts "pulse $taupmlg $rf [expr fmod($phpmlg + $sup, 360)]"
-                set phpmlg [expr {{$phpmlg + $wpmlgph}}] 
-            }}
-            delay $window
-            incr $propno
-            prop $propno
-            }}
-        """
-        return decoupling_code
-
-    def decoupling_fslg() :
-        decoupling_code = f"""
-            set rfk 100
-            set rf [expr $rfk*1000]
-            set lgoffset [expr $rf/sqrt(2.0)] ;# calculation of the LG offset
-            set taulg [expr 1e6/sqrt(pow($rf,2)+pow($lgoffset,2))] ;# calculation of the total length of the LG pulse
-            set window 4.6
-            set pma [expr 2.5*54.74/90]
-
-            for {{set i 1}} {{$i <= $par(np)/$par(N)}} {{incr i}} {{
-                pulseid $pma 100000 y
-                offset $lgoffset
-                pulse $taulg $rf 0
-                offset [expr -1*$lgoffset]
-                pulse $taulg $rf 180
-                offset 0
-                pulseid $pma 100000 -y
-                acq  
-                delay $window
-            }}
-        """
-        return decoupling_code
-
-    def decoupling_lg4()  :
-        decoupling_code = f"""
-            set rfk 100
-            set rf [expr $rfk*1000]
-            set lgoffset [expr $rf/sqrt(2.0)] ;# calculation of the LG offset
-            set taulg [expr 1e6/sqrt(pow($rf,2)+pow($lgoffset,2))] ;# calculation of the total length of the LG pulse
-            set window 4.6
-            set phadd 70
-            
-            for {{set i 1}} {{$i <= $par(np)/2}} {{incr i}} {{
-                offset $lgoffset
-                pulse $taulg $rf [expr 90-$phadd]
-                offset [expr -1*$lgoffset]
-                pulse $taulg $rf [expr 270-$phadd]
-                offset 0
-                delay $window
-                acq
-                offset [expr -1*$lgoffset]
-                pulse $taulg $rf [expr -90+$phadd]
-                offset $lgoffset
-                pulse $taulg $rf [expr -270+$phadd]
-                offset 0
-                acq
-                delay $window
-            }}
-        """
-        return decoupling_code
-
-    # Map decoupling sequences to their corresponding functions
-    decoupling_generators = {
-        "cw" : decoupling_cw ,
-        "tppm" : decoupling_tppm ,
-        "swftppm" : decoupling_swftppm ,
-        "xix" : decoupling_xix ,
-        "spinal64" : decoupling_spinal64 ,
-        "rcw" : decoupling_rcw ,
-        "wpmlg" : decoupling_wpmlg,
-        "fslg" : decoupling_fslg,
-        "lg4" : decoupling_lg4,
-    }
-
-
-    # Return the corresponding code for the given type
-    if type in decoupling_generators :
-        return decoupling_generators[ type ] ()
-    else :
-        raise ValueError ( f"Unknown decoupling type: {type}" )
 
 def generate_heteronuclear_recoupling(type) :
+    """
+    TCL of a heteronuclear recoupling sequence, written out in core.sequence.WRITTEN_OUT.
+    """
+    if type in ( 'tedor' , 'redor' ) :
+        return WRITTEN_OUT[ type ]
+    raise ValueError ( f"Unknown decoupling type: {type}" )
+
+
+@st.cache_data(max_entries=16)
+def converged_maxdt(spinsys_text, par_text, tolerance, rf):
+    """
+    Largest maxdt for which the preview FID of the spin system converges, see core.preview.largest_maxdt.
+
+    Returns:
+        tuple: (maxdt in µs or None, list of (maxdt, relative change when halved)).
+    """
+    return largest_maxdt(parse_spinsys(spinsys_text), parse_par(par_text), load_nuclei(), tolerance=tolerance, rf=rf)
+
+
+def maxdt_input(default, key, sequence_code):
+    """
+    maxdt of a sequence. With the spin system and par block of the previous pages, a button sets it
+    to the largest step whose preview FID, under an rf field as strong as the pulses of the
+    sequence, changes by less than a tolerance when the step is halved.
+
+    Parameters:
+        default (float): maxdt in µs used until the search is run.
+        key (str): widget key, one per sequence.
+        sequence_code (str): TCL code of the sequence, for its rf amplitude.
+
+    Returns:
+        float: maxdt in µs.
+    """
+    spinsys_text = st.session_state.get('simpson_spinsys')
+    par_text = st.session_state.get('par_code')
+    if spinsys_text and par_text:
+        col1, col2 = st.columns(2)
+        tolerance = col1.number_input('Tolerated change of the FID', min_value=1e-4, max_value=0.5, value=0.01,
+                                      format='%.4f', key=f'{key}_tolerance')
+        rf = rf_amplitude(sequence_code, parse_par(par_text))
+        if col2.button('Find the largest safe maxdt', key=f'{key}_search'):
+            try:
+                with st.spinner('Running the preview at decreasing steps...'):
+                    maxdt, history = converged_maxdt(spinsys_text, par_text, tolerance, rf)
+            except (KeyError, ValueError) as error:
+                st.error(f'Cannot search maxdt: {error}')
+            else:
+                st.session_state[f'{key}_history'] = history
+                if maxdt is None:
+                    st.warning('The FID does not converge within the steps tried, keep a small maxdt.')
+                else:
+                    st.session_state[key] = maxdt
+        if f'{key}_history' in st.session_state:
+            st.caption(f'Change of the FID under {rf / 1000:g} kHz rf when halving maxdt: ' + ', '.join(
+                f'{maxdt:g} µs: {change:.1e}' for maxdt, change in st.session_state[f'{key}_history']))
+    else:
+        st.caption('Build the spin system and the par block first to search maxdt automatically.')
+    if key not in st.session_state:
+        st.session_state[key] = default
+    return st.number_input('Time over which Hamiltonian is time independent', format='%.3f', key=key)
+
+
+def compiled_sequence(sequence, maxdt, coherence_filter=None):
+    """
+    pulseq procedure of a sequence of core.sequence, storing and reusing the propagators of its
+    repeated cycle. How many are stored depends on the spin rate, and for decoupling on the
+    spectral width, taken from the par block when there is one.
+
+    Parameters:
+        sequence (Sequence): one cycle of the sequence.
+        maxdt (float): maxdt in µs.
+        coherence_filter (tuple): coherence orders kept between excitation and reconversion, or None.
+
+    Returns:
+        str: TCL code, or None if the sequence cannot be compiled.
+    """
+    par = parse_par(st.session_state['par_code']) if st.session_state.get('par_code') else {}
+    try:
+        spin_rate, sw = par_number(par, 'spin_rate', 10000.0), par_number(par, 'sw', 20000.0)
+    except (KeyError, ValueError):
+        spin_rate, sw = 10000.0, 20000.0
+    col1, col2 = st.columns(2)
+    spin_rate = col1.number_input('Spin rate (Hz)', min_value=0.0, value=float(spin_rate), key=f'{sequence.name}_spin_rate')
+    if sequence.role == 'acquisition':
+        sw = col2.number_input('Spectral width (Hz)', min_value=1.0, value=float(sw), key=f'{sequence.name}_sw')
+    try:
+        code, report = compile_pulseq(sequence, spin_rate, sw, maxdt, coherence_filter)
+    except ValueError as error:
+        st.error(f'Cannot compile {sequence.name}: {error}')
+        return None
+    st.caption(describe(sequence, report))
+    return code
 
-    def zftedor():
-        recoupling_code = f"""
-
-            matrix set 10 elements {{{{1 3}} {{2 4}} {{3 1}} {{4 2}}}}
-            
-            set rfC  150000
-            set rfP  150000
-            set tr    [expr 1.0e6/$par(spin_rate)]
-            set t90C  [expr 0.25e6/$rfC]
-            set t180C [expr 2.0*$t90C]
-            set t90P  [expr 0.25e6/$rfP]
-            set t180P [expr 2.0*$t90P]
-            
-            
-            reset
-            delay [expr $tr/2.0-$t180P]
-            pulse $t180P 0 x $rfP x    
-            delay [expr $tr/2.0-$t180P]
-            pulse $t180P 0 x $rfP y
-            store 1
-            
-            reset
-            delay [expr 1*$tr-$t180C/2]
-            pulse $t180C $rfC x 0 x
-            delay [expr 1*$tr-$t180C/2]
-            store 2
-            reset
-            
-            reset
-            pulse $t180P 0 x $rfP x  
-            delay [expr $tr/2.0-$t180P]
-            pulse $t180P 0 x $rfP y  
-            delay [expr $tr/2.0-$t180P]
-            store 3
-            
-            
-            for {{set s 0}}{{$s < $par(np)}} {{incr s}} {{
-            reset
-            
-            prop 1 $s
-            prop 2
-            prop 3 $s
-            
-            
-            pulseid 1 250000 x 250000 x
-            pulseid 1 250000 x 250000 $ph
-            filter 10
-            
-            prop 1 $s
-            prop 2
-            prop 3 $s
-            
-            acq
-            }}"""
-        return recoupling_code
-
-    def redor():
-        recoupling_code = f"""
-            
-            set rf 100000
-            set t180 pr 0.5e6/$rf]
-            set tr   [expr 1.0e6/$par(spin_rate)]
-            set tr2  [expr $tr-$t180]   
-            
-            reset
-            delay $tr2
-            pulse $t180 0 x $rf x
-            delay $tr2
-            pulse $t180 0 x $rf y
-            store 1
-            
-            reset
-            acq
-            delay $tr2
-            pulse $t180 0 x $rf x
-            delay $tr2
-            pulse $t180 $rf x 0 x
-            prop 1
-            store 2
-            acq
-            
-            for {{set i 2}} {{$i < $par(np)}} {{incr i}} {{
-            reset
-            prop 1
-            prop 2
-            prop 1
-            store 2
-            acq
-            }}
-            """
-        return recoupling_code
-
-    recoupling_generators = {
-        "tedor" : zftedor ,
-        "redor" : redor ,
-        }
-
-    # Return the corresponding code for the given type
-    if type in recoupling_generators :
-        return recoupling_generators[ type ] ()
-    else :
-        raise ValueError ( f"Unknown decoupling type: {type}" )
 
 def main():
     st.header('Recoupling')
@@ -420,53 +134,21 @@ def main():
         option_homonuclear_recoupling = ["s3", "brs3", "sr26", "postc7", "rseq", "baba"]
         homonuclear_recoupling = st.selectbox("Homonuclear Recoupling Sequence:", option_homonuclear_recoupling, index=None)
         if homonuclear_recoupling is not None:
-            max_delta_time = st.number_input('Time over which Hamiltonian is time independent', format='%.1f', value = 3.0)
+            max_delta_time = maxdt_input(3.0, 'maxdt_homonuclear_recoupling',
+                                         generate_recoupling(homonuclear_recoupling))
             dq_filter_choice = st.toggle("Double Quantum Filter")
-            if dq_filter_choice:
-                dq_filter = "matrix set 2 totalcoherence {2 -2} "
-                filter_dq = "filter 2"
-            else:
-                dq_filter = " "
-                filter_dq = " "
-            pulse_sequence = f"""
-                            proc pulseq {{}}  {{
-                            global par
-                maxdt {max_delta_time}
-                {dq_filter}
-                
-                {generate_recoupling(homonuclear_recoupling)}
-                store 1 ; #stores the propagator for 1 block of S3
-                reset ; # resets the density matrix to rho0
-                store 3 ; # identity prop
-                acq ; # take first data point i.e. zero
-        
-                # loop below reuses stored propagators for the rest of acq
-                for {{set j 1}} {{$j < $par(np)}} {{incr j}} {{
-                reset
-                prop 3 ; # call the identity propagator for the first time and then calls 1 to j-1 S3's
-                prop 1 ; # call jth S3
-                store 3 ; # store it in 3 and reused later
-                {filter_dq}
-                prop 3 ; # reconversion
-                acq ; # detect 1 point
-                }}
-                }}
-                """
-            st.code(pulse_sequence, language='tcl')
+            pulse_sequence = compiled_sequence(RECOUPLING[homonuclear_recoupling](), max_delta_time,
+                                               (2, -2) if dq_filter_choice else None)
+            if pulse_sequence is not None:
+                st.code(pulse_sequence, language='tcl')
 
         st.subheader('Heteronuclear Recoupling')
         option_heteronuclear_recoupling = ["tedor", "redor"]
         heteronuclear_recoupling = st.selectbox("Heteronuclear Recoupling Sequence:", option_heteronuclear_recoupling, index=None)
         if heteronuclear_recoupling is not None:
-            max_delta_time = st.number_input('Time over which Hamiltonian is time independent', format='%.1f', value = 3.0)
-            pulse_sequence = f"""
-                              proc pulseq {{}}  {{
-                              global par
-                  maxdt {max_delta_time}
-                  {generate_heteronuclear_recoupling(heteronuclear_recoupling)}
-                  }}
-                  """
-            st.code(pulse_sequence, language='tcl')
+            max_delta_time = maxdt_input(3.0, 'maxdt_heteronuclear_recoupling',
+                                         generate_heteronuclear_recoupling(heteronuclear_recoupling))
+            st.code(pulseq_code(heteronuclear_recoupling, max_delta_time, 0, 0)[0], language='tcl')
 
 
     st.header('Decoupling')
@@ -477,18 +159,11 @@ def main():
         option_heteronuclear_decoupling = ["cw", "tppm", "swftppm", "xix", "spinal64", "rcw"]
         heteronuclear_decoupling = st.selectbox("Heteronuclear Decoupling Sequence:", option_heteronuclear_decoupling, index=None)
         if heteronuclear_decoupling is not None:
-            max_delta_time = st.number_input('Time over which Hamiltonian is time independent', format='%.1f', value=1.0)
-            pulse_sequence = f"""
-            proc pulseq {{}} {{
-            global par
-            set rf 100000
-            set tdec [expr 0.5e6/$rf]
-            set ph 15
-            maxdt {max_delta_time}
-            {generate_decoupling(heteronuclear_decoupling)}
-            }}
-            """
-            st.code(pulse_sequence, language='tcl')
+            max_delta_time = maxdt_input(1.0, 'maxdt_heteronuclear_decoupling',
+                                         generate_decoupling(heteronuclear_decoupling))
+            pulse_sequence = compiled_sequence(DECOUPLING[heteronuclear_decoupling](), max_delta_time)
+            if pulse_sequence is not None:
+                st.code(pulse_sequence, language='tcl')
 
 
         st.subheader('Homonuclear Decoupling')
@@ -496,15 +171,14 @@ def main():
 
         homonuclear_decoupling = st.selectbox("Homonuclear Decoupling Sequence:", option_homonuclear_decoupling, index=None)
         if homonuclear_decoupling is not None:
-            max_delta_time = st.number_input('Time over which Hamiltonian is time independent', format='%.1f', value=1.0)
-            pulse_sequence = f"""
-            proc pulseq{{}} {{
-            global par
-            maxdt {max_delta_time}
-            {generate_decoupling(homonuclear_decoupling)}
-            }}
-            """
-            st.code(pulse_sequence, language='tcl')
+            max_delta_time = maxdt_input(1.0, 'maxdt_homonuclear_decoupling',
+                                         generate_decoupling(homonuclear_decoupling))
+            if homonuclear_decoupling in DECOUPLING:
+                pulse_sequence = compiled_sequence(DECOUPLING[homonuclear_decoupling](), max_delta_time)
+            else:
+                pulse_sequence = pulseq_code(homonuclear_decoupling, max_delta_time, 0, 0)[0]
+            if pulse_sequence is not None:
+                st.code(pulse_sequence, language='tcl')
 
 if __name__ == '__main__':
     st.title("To generate pulse program")
@@ -1,5 +1,7 @@
 import streamlit as st
 
+from core.render import main_block
+
 def main():
 
 
@@ -7,26 +9,12 @@ def main():
     time_or_frequency = st.selectbox("Frequency domain or time domain?", ["fft", "time"], index = None)
 
     if time_or_frequency == "fft":
-        text_time_or_frequency = " "
         zero_fill = st.number_input("Zero-filling factor", format="%d", value=1)
         lb = st.number_input("Line Broadening in Hz", format="%f", value=0.0)
         ratio_gaussian_lorentzian = st.number_input("Gaussian/Lorentzian Ratio", format="%d", max_value=1, min_value=0, value=0)
-        text_time_or_frequency += f" fzerofill $f {zero_fill} \n \tfaddlb $f {lb} {ratio_gaussian_lorentzian}"
-        text_time_or_frequency += "\n \t fft $f"
+        main_code = main_block("fft", zero_fill, lb, ratio_gaussian_lorentzian)
     else:
-        text_time_or_frequency = " "
-
-    save_text_option = "fsave $f $par(name).txt -xreim"
-
-    main_code = f"""
-        proc main {{}} {{
-        global par
-        set f [fsimpson]
-        {text_time_or_frequency}
-        {save_text_option}
-        funload $f
-        }}
-    """
+        main_code = main_block("time")
 
     st.code(main_code, language="tcl")
 
@@ -1,21 +1,39 @@
+import io
+import math
+import zipfile
+
+import numpy as np
 import streamlit as st
-from streamlit_ace import st_ace
 
-def full_file():
-    full_file = " "
-    if "simpson_spinsys" in st.session_state :
-        full_file = st.session_state[ 'simpson_spinsys' ] + "\n\n"
+from core.cache import ResultCache
+from core.cost import calibrate, estimate_cost, input_features, selected_cost
+from core.lazy import LazyImport
+from core.nuclei import load_nuclei
+from core.partition import coupling_clusters, spin_dimension, split_clusters
+from core.render import full_file as render_full_file
+from core.runner import SIMPSON_EXECUTABLE , SimpsonRunner , resolve_executable
+from core.shard import MANIFEST , merge_results , read_manifest , shard_files , split_input
+from core.spinsys import parse_spinsys
+from core.sweep import Sweep , parse_values , expand_sweep , point_output , stack_results
 
-    if "par_code" in st.session_state :
-        full_file += st.session_state[ 'par_code' ] + "\n\n"
+pd = LazyImport('pandas')
+st_ace = LazyImport('streamlit_ace', 'st_ace')
 
-    if "pulse_sequence" in st.session_state :
-        full_file += st.session_state[ 'pulse_sequence' ] + "\n\n"
 
-    if "main_code" in st.session_state :
-        full_file += st.session_state[ 'main_code' ] + "\n\n"
+@st.cache_resource
+def simpson_runner() :
+    """
+    One pool of SIMPSON processes for the whole server, so that sessions share the cores
+    and the cache of results.
+    """
+    return SimpsonRunner ( cache=ResultCache () )
 
-    return full_file
+
+def full_file():
+    return render_full_file({'spinsys': st.session_state.get('simpson_spinsys'),
+                             'par': st.session_state.get('par_code'),
+                             'pulseq': st.session_state.get('pulse_sequence'),
+                             'main': st.session_state.get('main_code')}) or " "
 
 def main():
     st.title("Full Simulation File")
@@ -23,6 +41,7 @@ def main():
     simpson_file_contents = full_file()
     response_code = st_ace(simpson_file_contents, language="tcl", height=400, theme="solarized_dark")
     st.code(response_code, language="tcl")
+    st.session_state["simpson_full_file"] = response_code
 
     st.download_button(
         label="Download File",
@@ -30,7 +49,318 @@ def main():
         file_name="simpson_file.in",
         mime="in")
 
+    st.divider()
+    cost_estimate(response_code)
+    st.divider()
+    run_locally(response_code)
+    st.divider()
+    crystallite_shards(response_code)
+    st.divider()
+    spin_clusters(response_code)
+    st.divider()
+    parameter_sweep(response_code)
+
+
+def format_seconds(seconds):
+    if seconds < 120:
+        return f"{seconds:.3g} s"
+    if seconds < 7200:
+        return f"{seconds / 60:.3g} min"
+    return f"{seconds / 3600:.3g} h"
+
+
+@st.fragment
+def cost_estimate(simpson_file_contents):
+    """
+    Predicted run time and memory of the file for every method, from the size of the spin
+    system, the powder average, np and the events of the pulseq, calibrated on this machine.
+    The calibration times matrix exponentials, so it only runs once asked for, then once per process.
+    """
+    st.subheader("Cost estimate")
+    try:
+        features = input_features(simpson_file_contents, load_nuclei())
+    except (KeyError, ValueError) as error:
+        st.info(f"Cannot estimate the cost of this file: {error}")
+        return
+    if st.button("Estimate the run time", key="cost_estimate_run"):
+        st.session_state["cost_estimate_shown"] = True
+    if not st.session_state.get("cost_estimate_shown"):
+        return
+    with st.spinner("Timing matrix exponentials on this machine..."):
+        rows = estimate_cost(features, calibrate())
+    st.caption(f"Hilbert space dimension {features.dimension}, {features.crystallites} crystallites × "
+               f"{features.gamma_angles} gamma angles, np {features.n_points}, {features.events} pulse/delay "
+               f"events and {features.propagators} propagators per orientation (maxdt {features.maxdt} µs).")
+    if features.unknown_loops:
+        st.caption(f"{features.unknown_loops} loops could not be evaluated and count as one pass.")
+
+    budget = st.number_input("Time budget in minutes", min_value=0.0, value=60.0, step=10.0)
+    domain, method = features.selected()
+    selected = selected_cost(features, rows)
+    if selected["seconds"] > budget * 60:
+        fastest = rows[0]
+        st.warning(f"With method {domain} {method} this run should take about {format_seconds(selected['seconds'])}, "
+                   f"more than the budget. Fastest: {fastest['domain']} {fastest['method']} "
+                   f"({format_seconds(fastest['seconds'])}); splitting the crystallites divides the time too.")
+    else:
+        st.success(f"Method {domain} {method}: about {format_seconds(selected['seconds'])} and "
+                   f"{selected['bytes'] / 2 ** 20:.3g} MB.")
+    st.dataframe(pd.DataFrame({"domain": [row["domain"] for row in rows],
+                               "method": [row["method"] for row in rows],
+                               "time": [format_seconds(row["seconds"]) for row in rows],
+                               "memory (MB)": [row["bytes"] / 2 ** 20 for row in rows]}),
+                 hide_index=True)
+
+
+def run_locally(simpson_file_contents):
+    """
+    Runs the assembled file, and any uploaded inputs, with a local SIMPSON executable.
+    Progress is read from the verbose output, so keep the second verbose flag on (e.g. 1101).
+    """
+    st.subheader("Run locally")
+    runner = simpson_runner()
+    executable = st.text_input("SIMPSON executable", value=st.session_state.get("simpson_executable", SIMPSON_EXECUTABLE))
+    st.session_state["simpson_executable"] = executable
+    if resolve_executable(executable) is None:
+        st.warning(f"{executable} was not found, give the full path of the SIMPSON executable.")
+        return
+
+    extra_inputs = st.file_uploader("Other input files to run alongside", type=["in", "tcl"], accept_multiple_files=True)
+    st.caption(f"Up to {runner.max_workers} inputs run at the same time, the others wait in the queue.")
+    if "simpson_jobs" not in st.session_state:
+        st.session_state["simpson_jobs"] = []
+
+    col1, col2 = st.columns(2)
+    if col1.button("Run"):
+        inputs = [("simpson_file", simpson_file_contents)] if simpson_file_contents.strip() else []
+        inputs += [(uploaded.name.rsplit(".", 1)[0], uploaded.getvalue().decode()) for uploaded in extra_inputs or []]
+        for name, text in inputs:
+            st.session_state["simpson_jobs"].append(runner.submit(name, text, executable))
+    if col2.button("Cancel all"):
+        runner.cancel(st.session_state["simpson_jobs"])
+    job_progress()
+
+
+@st.fragment(run_every=1.0)
+def job_progress():
+    """
+    Live view of the jobs of this session, refreshed every second.
+    """
+    for index, job in enumerate(st.session_state.get("simpson_jobs", [])):
+        st.progress(job.progress, text=f"{job.name}: {job.state}" + (" (from the cache)" if job.cached else ""))
+        with st.expander("Output"):
+            st.code("\n".join(job.log) or job.error or "", language="text")
+            if not job.finished and st.button("Cancel", key=f"cancel_job_{index}"):
+                job.cancel()
+            for file_name, content in job.outputs.items():
+                st.download_button(label=f"Download {file_name}", data=content, file_name=file_name,
+                                   key=f"download_{index}_{file_name}")
+
+
+def crystallite_shards(simpson_file_contents):
+    """
+    Splits the crystallites of the file into shards run in parallel, on the local pool or on a
+    cluster, and merges their results with the weights of the shards.
+    """
+    st.subheader("Split the crystallites")
+    st.caption("Every shard gets its own crystal file. The full result is the weighted sum of the shard results, "
+               "so keep the main section linear (no magnitude spectra).")
+    runner = simpson_runner()
+    n_shards = st.number_input("Number of shards", min_value=1, value=runner.max_workers, step=1)
+    try:
+        shards = split_input(simpson_file_contents, n_shards)
+    except (KeyError, ValueError) as error:
+        st.info(f"Cannot split this file: {error}")
+        shards = None
+
+    if shards:
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as handle:
+            for file_name, content in shard_files(shards).items():
+                handle.writestr(f"shards/{file_name}", content)
+        st.download_button(label="Download the shards for a batch scheduler", data=archive.getvalue(),
+                           file_name="shards.zip", mime="application/zip")
+        st.caption("Run `shards/run_shard.sh <index>` for every index, or as an array job, "
+                   "then upload the results with shards.json below.")
+
+        executable = st.session_state.get("simpson_executable", SIMPSON_EXECUTABLE)
+        col1, col2 = st.columns(2)
+        if col1.button("Run shards", disabled=resolve_executable(executable) is None):
+            jobs = [runner.submit(shard.name, shard.text, executable, files=shard.files) for shard in shards]
+            st.session_state["simpson_shards"] = (shards, jobs)
+        if col2.button("Cancel shards") and "simpson_shards" in st.session_state:
+            runner.cancel(st.session_state["simpson_shards"][1])
+        shard_progress()
+
+    uploaded = st.file_uploader("Results of the shards and shards.json", accept_multiple_files=True)
+    files = {uploaded_file.name: uploaded_file.getvalue() for uploaded_file in uploaded or []}
+    if MANIFEST in files:
+        manifest = read_manifest(files[MANIFEST])
+        try:
+            merged = merge_results(manifest, [files.get(f"{shard.name}.txt") for shard in manifest])
+        except ValueError as error:
+            st.error(f"Cannot merge: {error}")
+            return
+        st.download_button(label="Download the merged result", data=merged, file_name="merged.txt",
+                           key="download_uploaded_merge")
+
+
+@st.fragment(run_every=2.0)
+def shard_progress():
+    """
+    Progress of the shards of this session, and their merged result once every shard is done.
+    """
+    if "simpson_shards" not in st.session_state:
+        return
+    shards, jobs = st.session_state["simpson_shards"]
+    st.progress(float(sum(shard.weight * job.progress for shard, job in zip(shards, jobs))),
+                text=", ".join(f"{job.name}: {job.state}" for job in jobs))
+    if not all(job.finished for job in jobs):
+        return
+    try:
+        merged = merge_results(shards, [point_output(job.outputs, job.name) if job.state == "done" else None
+                                        for job in jobs])
+    except ValueError as error:
+        st.error(f"Cannot merge the shards: {error}")
+        return
+    st.download_button(label="Download the merged result", data=merged, file_name="merged.txt",
+                       key="download_shards")
+
+
+def spin_clusters(simpson_file_contents):
+    """
+    Splits the spin system into clusters of coupled spins simulated on their own, optionally cutting
+    the weak couplings, and shows what it saves. The inputs are merged like crystallite shards.
+    """
+    st.subheader("Split the spin system")
+    st.caption("Spins without couplings between them evolve independently, so each cluster can be simulated "
+               "alone and the results summed.")
+    threshold = st.number_input("Cut couplings below (Hz)", min_value=0.0, value=0.0, step=10.0)
+    nuclei = load_nuclei()
+    try:
+        spin_system = parse_spinsys(simpson_file_contents)
+        clusters, cut = coupling_clusters(spin_system, threshold)
+        shards = split_clusters(simpson_file_contents, threshold, nuclei=nuclei)
+    except (KeyError, ValueError) as error:
+        st.info(f"Cannot split this file: {error}")
+        return
+    if len(clusters) < 2:
+        st.caption("The couplings join every spin into one cluster.")
+        return
+
+    dimensions = [math.prod(spin_dimension(spin_system.nuclei[spin - 1], nuclei) for spin in cluster)
+                  for cluster in clusters]
+    full = math.prod(spin_dimension(nucleus, nuclei) for nucleus in spin_system.nuclei)
+    st.write(f"{len(clusters)} clusters: Hilbert space dimensions {' + '.join(map(str, dimensions))} = "
+             f"{sum(dimensions)} instead of {full}.")
+    if cut:
+        i, j, strength = cut[0]
+        st.warning(f"{len(cut)} couplings between clusters are dropped, the largest {strength:g} Hz "
+                   f"between spins {i} and {j}: the result is approximate.")
+    simulated = {shard.name: shard.weight for shard in shards}
+    width = len(str(max(len(clusters) - 1, 0)))
+    st.dataframe(pd.DataFrame({
+        "Cluster": [f"cluster_{k:0{width}d}" for k in range(len(clusters))],
+        "Spins": [" ".join(f"{spin_system.nuclei[spin - 1]}({spin})" for spin in cluster) for cluster in clusters],
+        "Dimension": dimensions,
+        "Weight": [simulated.get(f"cluster_{k:0{width}d}") for k in range(len(clusters))],
+    }), hide_index=True)
+    st.caption("Clusters without weight give no signal for the start and detect operators and are not simulated.")
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as handle:
+        for file_name, content in shard_files(shards).items():
+            handle.writestr(f"clusters/{file_name}", content)
+    st.download_button(label="Download the clusters", data=archive.getvalue(), file_name="clusters.zip",
+                       mime="application/zip")
+    st.caption("Run them like the crystallite shards, then upload the results with shards.json above to sum them.")
+
+
+def sweep_definition():
+    """
+    Table of the swept fields and their values.
+
+    Returns:
+        Sweep: the sweep, or None if the table is empty or invalid.
+    """
+    st.markdown("Fields: `par.<key>` (e.g. `par.spin_rate`), `set.<variable>` for a `set` in the pulse sequence "
+                "(e.g. `set.rf`), `dipole.<i>.<j>` in Hz or `distance.<i>.<j>` in Å. Values: `1000, 2000, 5000` "
+                "or `start:stop:count`.")
+    table = st.data_editor(pd.DataFrame({"Field": ["par.spin_rate"], "Values": ["5000:15000:3"]}),
+                           num_rows="dynamic", key="sweep_table")
+    mode = st.segmented_control("Combine the values", ["grid", "zip"], default="grid", key="sweep_mode")
+    axes = []
+    for field_name, values in zip(table["Field"], table["Values"]):
+        if not field_name or not values:
+            continue
+        try:
+            axes.append((field_name.strip(), parse_values(values)))
+        except ValueError as error:
+            st.error(f"{field_name}: {error}")
+            return None
+    if not axes:
+        return None
+    return Sweep(axes=axes, mode=mode or "grid")
+
+
+def parameter_sweep(simpson_file_contents):
+    """
+    Expands the file into one input per point of a sweep, runs them on the local pool and
+    stacks the results into one array.
+    """
+    st.subheader("Parameter sweep")
+    sweep = sweep_definition()
+    if sweep is None:
+        return
+    try:
+        inputs = expand_sweep(simpson_file_contents, sweep, nuclei=load_nuclei())
+    except ValueError as error:
+        st.error(f"Cannot expand the sweep: {error}")
+        return
+    st.write(f"{len(inputs)} input files, shape {sweep.shape}")
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as handle:
+        for name, text, _ in inputs:
+            handle.writestr(f"{name}.in", text)
+    st.download_button(label="Download the input files", data=archive.getvalue(), file_name="sweep.zip",
+                       mime="application/zip")
+
+    executable = st.session_state.get("simpson_executable", SIMPSON_EXECUTABLE)
+    col1, col2 = st.columns(2)
+    if col1.button("Run sweep", disabled=resolve_executable(executable) is None):
+        runner = simpson_runner()
+        jobs = [runner.submit(name, text, executable) for name, text, _ in inputs]
+        st.session_state["simpson_sweep"] = (sweep, jobs)
+    if col2.button("Cancel sweep") and "simpson_sweep" in st.session_state:
+        simpson_runner().cancel(st.session_state["simpson_sweep"][1])
+    sweep_progress()
+
+
+@st.fragment(run_every=2.0)
+def sweep_progress():
+    """
+    Overall progress of the sweep of this session, and its stacked results once every point is finished.
+    """
+    if "simpson_sweep" not in st.session_state:
+        return
+    sweep, jobs = st.session_state["simpson_sweep"]
+    states = pd.Series([job.state for job in jobs]).value_counts()
+    st.progress(float(np.mean([job.progress for job in jobs])),
+                text=", ".join(f"{count} {state}" for state, count in states.items()))
+    if not all(job.finished for job in jobs):
+        return
+    try:
+        results = stack_results(sweep, [point_output(job.outputs, job.name) if job.state == "done" else None
+                                        for job in jobs])
+    except ValueError as error:
+        st.error(f"Cannot stack the results: {error}")
+        return
+    buffer = io.BytesIO()
+    np.savez(buffer, **results)
+    st.download_button(label="Download the stacked results (.npz)", data=buffer.getvalue(),
+                       file_name="sweep_results.npz", key="download_sweep")
 
 
 if __name__ == '__main__' :
-    main()
\ No newline at end of file
+    main()
@@ -1,14 +1,117 @@
 import streamlit as st
 import numpy as np
-from plotly.subplots import make_subplots
-import plotly.graph_objects as go
-
-
+import io
+import time
+
+from core.cache import ResultCache , cache_key , simpson_version
+from core.lazy import LazyImport
+from core.nuclei import load_nuclei
+from core.par import parse_par , par_number
+from core.preview import DENSE_SPINS , MAX_SPINS , simulate_fid , fid_to_spectrum
+from core.runner import SIMPSON_EXECUTABLE , resolve_executable
+from core.spinsys import parse_spinsys
+
+go = LazyImport ( 'plotly.graph_objects' )
+make_subplots = LazyImport ( 'plotly.subplots' , 'make_subplots' )
+
+
+def data_figure(x , re , im , plot_options , time_or_freq) :
+    """
+    Real and imaginary parts side by side.
+
+    Parameters:
+        x (np.ndarray): time in s or frequency in Hz.
+        re, im (np.ndarray): real and imaginary parts.
+        plot_options (list): parts to show, "Real" and/or "Imaginary".
+        time_or_freq (str): "time" or "freq".
+
+    Returns:
+        go.Figure: the figure, or None if no part is selected.
+    """
+    cols = len(plot_options)
+    if not cols :
+        return None
+    # Create subplots dynamically based on rows
+    fig = make_subplots (
+        rows=1 , cols=cols , shared_xaxes=True ,
+        subplot_titles=plot_options
+    )
+
+    # Two boolean flags for displaying Real/Imaginary parts
+    display_real = "Real" in plot_options
+    display_imag = "Imaginary" in plot_options
+
+    # Plot Real Part (if selected)
+    if display_real :
+        fig.add_trace (
+            go.Scatter ( x=x , y=re , mode="lines" , name="Real" ) ,
+            row=1 , col=1
+        )
+
+    # Plot Imaginary Part (if selected)
+    if display_imag :
+        fig.add_trace (
+            go.Scatter ( x=x , y=im , mode="lines" , name="Imaginary" ) ,
+            col=(2 if display_real else 1) , row=1
+        )
+
+    # Update layout for "time" or "freq"
+    fig.update_layout (
+        title="Time Domain Plot" if time_or_freq == "time" else "Frequency Domain Plot" ,
+        xaxis_title="Time (s)" if time_or_freq == "time" else "Frequency (Hz)" ,
+        yaxis_title="Amplitude" ,
+        showlegend=False
+    )
+
+    # Reverse x-axis for frequency domain (if frequency selected)
+    if time_or_freq == "freq" :
+        fig.update_xaxes ( autorange="reversed" )
+    return fig
+
+
+def cached_result() :
+    """
+    Result of the file assembled on the Full File page if it was already run with the same SIMPSON version.
+
+    Returns:
+        bytes: content of the data file, or None.
+    """
+    text = st.session_state.get ( "simpson_full_file" )
+    executable = resolve_executable ( st.session_state.get ( "simpson_executable" , SIMPSON_EXECUTABLE ) )
+    if not text or executable is None :
+        return None
+    outputs = ResultCache ().get ( cache_key ( text , simpson_version ( executable ) ) )
+    if not outputs :
+        return None
+    data_files = [ name for name in outputs if name.endswith ( ".txt" ) ]
+    return outputs[ data_files[ 0 ] ] if len ( data_files ) == 1 else None
+
+
+@st.cache_data ( max_entries=16 )
+def loaded_data(content) :
+    """
+    Columns of a data file in x, real, imaginary format, cached on its content.
+
+    Parameters:
+        content (bytes): content of the file.
+
+    Returns:
+        np.ndarray: (N, 3) array.
+    """
+    return np.loadtxt ( io.BytesIO ( content ) , ndmin=2 )
+
+
+@st.fragment
 def plot_data() :
     file_uploaded = st.file_uploader ( "Upload the data file" )
-    if file_uploaded is not None :
+    content = None if file_uploaded is None else file_uploaded.getvalue ()
+    if content is None :
+        content = cached_result ()
+        if content is not None :
+            st.caption ( "Showing the stored result of the file on the Full File page." )
+    if content is not None :
         time_or_freq = st.selectbox ( "Time domain or frequency domain?" , [ "freq" , "time" ] , index=None )
-        data = np.loadtxt ( file_uploaded )
+        data = loaded_data ( content )
 
         plot_options = st.multiselect ( "Plot options" , [ "Real", "Imaginary"] , default=None )
 
@@ -17,57 +120,77 @@ def plot_data() :
         re = data[ : , 1 ]
         im = data[ : , 2 ]
 
-        cols = len(plot_options)
-        if cols:
-            # Create subplots dynamically based on rows
-            fig = make_subplots (
-                rows=1 , cols=cols , shared_xaxes=True ,
-                subplot_titles=plot_options
-            )
-
-            # Two boolean flags for displaying Real/Imaginary parts
-            display_real = "Real" in plot_options
-            display_imag = "Imaginary" in plot_options
-
-            # Plot Real Part (if selected)
-            if display_real :
-                fig.add_trace (
-                    go.Scatter ( x=x , y=re , mode="lines" , name="Real" ) ,
-                    row=1 , col=1
-                )
-
-            # Plot Imaginary Part (if selected)
-            if display_imag :
-                fig.add_trace (
-                    go.Scatter ( x=x , y=im , mode="lines" , name="Imaginary" ) ,
-                    col=(2 if display_real else 1) , row=1
-                )
-
-            # Update layout for "time" or "freq"
-            fig.update_layout (
-                title="Time Domain Plot" if time_or_freq == "time" else "Frequency Domain Plot" ,
-                xaxis_title="Time (s)" if time_or_freq == "time" else "Frequency (Hz)" ,
-                yaxis_title="Amplitude" ,
-                showlegend=False
-            )
-
-            # Reverse x-axis for frequency domain (if frequency selected)
-            if time_or_freq == "freq" :
-                fig.update_xaxes ( autorange="reversed" )
-
+        fig = data_figure ( x , re , im , plot_options , time_or_freq )
+        if fig is not None :
             # Display the plot
             st.plotly_chart ( fig , use_container_width=True )
 
 
-
-
-
+@st.cache_data ( max_entries=16 )
+def preview_fid(spinsys_text , par_text , maxdt) :
+    """
+    FID simulated in-process from the spinsys and par blocks, cached on their text.
+
+    Returns:
+        tuple: (time in s, complex FID, sw in Hz, run time in s).
+    """
+    start = time.perf_counter ()
+    par = parse_par ( par_text )
+    t , fid = simulate_fid ( parse_spinsys ( spinsys_text ) , par , load_nuclei () , maxdt=maxdt )
+    return t , fid , par_number ( par , 'sw' ) , time.perf_counter () - start
+
+
+@st.fragment
+def preview_simulation() :
+    """
+    Quick preview of the spectrum for 1 to MAX_SPINS (12) spins 1/2 without running SIMPSON. Only the
+    free evolution from the start operator is computed, the pulse sequence is not applied. Above
+    DENSE_SPINS the FID is a random-vector estimate.
+    """
+    st.write ( f"Free evolution of 1 to {MAX_SPINS} spins 1/2 under MAS from the start operator, "
+               "the pulse sequence is not applied. Keep sw a multiple of spin_rate (or the dwell time a "
+               "multiple of the rotor period) so that rotor-period propagators can be reused. "
+               f"Above {DENSE_SPINS} spins, state vectors are propagated instead of propagators: the FID is "
+               "then a random-vector estimate and takes minutes, use a small crystal file." )
+    spinsys_text = st.session_state.get ( 'simpson_spinsys' )
+    par_text = st.session_state.get ( 'par_code' )
+    if not spinsys_text :
+        spinsys_text = st.text_area ( "Paste the spinsys section here:" , value=None , key="preview_spinsys" )
+    if not par_text :
+        par_text = st.text_area ( "Paste the par section here:" , value=None , key="preview_par" )
+    if not spinsys_text or not par_text :
+        st.info ( "Add the spin system and the parameters on their pages, or paste them above." )
+        return
+
+    col1 , col2 , col3 = st.columns ( 3 )
+    maxdt = col1.number_input ( "Maximum time step in µs" , min_value=0.05 , value=1.0 , key="preview_maxdt" )
+    zero_fill = col2.number_input ( "Zero-filling factor" , min_value=1 , value=2 , format="%d" , key="preview_zf" )
+    lb = col3.number_input ( "Line Broadening in Hz" , min_value=0.0 , value=50.0 , key="preview_lb" )
+    time_or_freq = st.selectbox ( "Time domain or frequency domain?" , [ "freq" , "time" ] , key="preview_domain" )
+    plot_options = st.multiselect ( "Plot options" , [ "Real", "Imaginary"] , default=[ "Real" ] , key="preview_parts" )
+
+    if st.button ( "Run preview" ) :
+        try :
+            t , fid , sw , run_time = preview_fid ( spinsys_text , par_text , maxdt * 1e-6 )
+        except (ValueError , KeyError) as error :
+            st.error ( f"Cannot run the preview: {error}" )
+            return
+        st.caption ( f"Simulated in {run_time:.2f} s" )
+        if time_or_freq == "freq" :
+            x , y = fid_to_spectrum ( fid , sw , zero_fill=zero_fill , lb=lb )
+        else :
+            x , y = t , fid
+        fig = data_figure ( x , y.real , y.imag , plot_options , time_or_freq )
+        if fig is not None :
+            st.plotly_chart ( fig , use_container_width=True )
 
 
 def main():
     st.title("Plot Data")
     plot_data()
     st.divider()
+    st.subheader("Preview")
+    preview_simulation()
 
 if __name__ == '__main__' :
     main()
\ No newline at end of file
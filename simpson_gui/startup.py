@@ -0,0 +1,133 @@
+"""
+Measures the startup cost of every page of the GUI, so that slow imports are caught:
+
+    python -m simpson_gui.startup --json startup.json
+    python -m simpson_gui.startup --baseline startup.json
+
+For every page, in fresh interpreters (Streamlit itself already imported, as in the server):
+cold import, the first import of the page with its dependencies; warm import, the same once they
+are loaded; cold render, the first run of the page; warm render, a second run in the same process.
+The heavy modules loaded by the first run are listed, they should only be those the page shows.
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname ( os.path.abspath ( __file__ ) )
+HEAVY_MODULES = ( 'numpy' , 'pandas' , 'scipy' , 'plotly.graph_objects' , 'streamlit_ace' )
+TIMINGS = ( 'cold_import' , 'warm_import' , 'cold_render' , 'warm_render' )
+
+# Run in a fresh interpreter per page and per measurement, prints one JSON object
+_PROBE = """
+import importlib.util , json , sys , time
+import streamlit
+from streamlit.testing.v1 import AppTest
+root , path , what = sys.argv[ 1 : ]
+sys.path.insert ( 0 , root )
+before = set ( sys.modules )
+
+def timed(action) :
+    start = time.perf_counter ()
+    action ()
+    return time.perf_counter () - start
+
+def load() :
+    spec = importlib.util.spec_from_file_location ( '_startup_page' , path )
+    spec.loader.exec_module ( importlib.util.module_from_spec ( spec ) )
+
+def render() :
+    app = AppTest.from_file ( path , default_timeout=120 ).run ()
+    if app.exception :
+        raise SystemExit ( app.exception[ 0 ].value )
+
+first , second = (load , load) if what == 'import' else (render , render)
+result = { f'cold_{what}' : timed ( first ) , f'warm_{what}' : timed ( second ) ,
+           'loaded' : sorted ( name for name in %r if name in sys.modules and name not in before ) }
+print ( json.dumps ( result ) )
+""" % (HEAVY_MODULES ,)
+
+
+def pages() :
+    """
+    Paths of the pages, the home page last.
+    """
+    return sorted ( glob.glob ( os.path.join ( ROOT , 'pages' , '[0-9]*.py' ) ) ) + [ os.path.join ( ROOT , 'Homepage.py' ) ]
+
+
+def _probe(path , what) :
+    done = subprocess.run ( [ sys.executable , '-c' , _PROBE , ROOT , path , what ] , capture_output=True , text=True ,
+                            cwd=ROOT )
+    if done.returncode :
+        raise RuntimeError ( f"{os.path.basename ( path )}: {done.stderr.strip ().splitlines ()[ -1 :]}" )
+    return json.loads ( done.stdout.strip ().splitlines ()[ -1 ] )
+
+
+def measure(path , repeat=3) :
+    """
+    Startup times of one page in seconds, the smallest of ``repeat`` fresh interpreters.
+    The home page runs its layout at import, so only its render is measured.
+    :return: dict with the TIMINGS (None when not measured) and the heavy modules loaded by the first run
+    """
+    result = dict.fromkeys ( TIMINGS )
+    kinds = ( 'render' , ) if os.path.basename ( path ) == 'Homepage.py' else ( 'import' , 'render' )
+    for what in kinds :
+        runs = [ _probe ( path , what ) for _ in range ( repeat ) ]
+        for key in ( f'cold_{what}' , f'warm_{what}' ) :
+            result[ key ] = min ( run[ key ] for run in runs )
+        if what == 'render' :
+            result[ 'loaded' ] = runs[ 0 ][ 'loaded' ]
+    return result
+
+
+def regressions(results , baseline , tolerance=0.25 , slack=0.05) :
+    """
+    Timings slower than the baseline by more than ``tolerance`` (relative) plus ``slack`` seconds.
+    :return: list of (page, timing, baseline s, now s)
+    """
+    slower = [ ]
+    for page , timings in results.items () :
+        for key in TIMINGS :
+            before , now = baseline.get ( page , { } ).get ( key ) , timings.get ( key )
+            if before is not None and now is not None and now > before * (1 + tolerance) + slack :
+                slower.append ( (page , key , before , now) )
+    return slower
+
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser ( prog='python -m simpson_gui.startup' ,
+                                       description='Measure the import and first-render times of the pages.' )
+    parser.add_argument ( '--repeat' , type=int , default=3 , help='fresh interpreters per timing (default: 3)' )
+    parser.add_argument ( '--json' , help='write the timings to this file' )
+    parser.add_argument ( '--baseline' , help='timings of an earlier run, fail if a page got slower' )
+    parser.add_argument ( '--tolerance' , type=float , default=0.25 , help='allowed relative slowdown (default: 0.25)' )
+    args = parser.parse_args ( argv )
+
+    results = { }
+    print ( f"{'page':32s}" + ''.join ( f"{key.replace ( '_' , ' ' ):>13s}" for key in TIMINGS ) + "  heavy modules loaded" )
+    for path in pages () :
+        page = os.path.basename ( path )
+        try :
+            results[ page ] = measure ( path , args.repeat )
+        except RuntimeError as error :
+            parser.exit ( 1 , f"{parser.prog}: error: {error}\n" )
+        timings = results[ page ]
+        print ( f"{page:32s}" + ''.join ( f"{'-' if timings[ key ] is None else f'{timings[ key ]:.3f} s':>13s}" for key in TIMINGS )
+                + "  " + (' '.join ( timings[ 'loaded' ] ) or '-') )
+    if args.json :
+        with open ( args.json , 'w' ) as handle :
+            json.dump ( results , handle , indent=2 )
+    if args.baseline :
+        with open ( args.baseline ) as handle :
+            slower = regressions ( results , json.load ( handle ) , args.tolerance )
+        for page , key , before , now in slower :
+            print ( f"{page}: {key.replace ( '_' , ' ' )} {before:.3f} s -> {now:.3f} s" , file=sys.stderr )
+        if slower :
+            return 1
+    return 0
+
+
+if __name__ == '__main__' :
+    sys.exit ( main () )
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import the package as simpson_gui, from the folder that holds it
+sys.path.insert ( 0 , os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
@@ -0,0 +1,28 @@
+from simpson_gui.core.cache import canonical_input
+
+INPUT = """spinsys {
+    channels 13C
+    nuclei 13C
+}
+par {
+    spin_rate 10000
+    np 32
+}
+proc main {} {
+    set f [fsimpson]
+    fsave $f "out  a.txt"
+}
+"""
+
+
+def test_layout_and_comments_do_not_matter() :
+    other = INPUT.replace ( '    ' , '\t  ' ).replace ( 'np 32' , 'np   32 ;# points' ).replace ( '{\n' , '{   \n' )
+    other = other.replace ( '    spin_rate 10000\n' , '' ).replace ( 'np   32' , 'spin_rate 10000\n np   32' )
+    assert canonical_input ( '# header\n' + other ) == canonical_input ( INPUT )
+
+
+def test_quoted_and_braced_words_keep_their_whitespace() :
+    assert canonical_input ( INPUT.replace ( 'out  a.txt' , 'out a.txt' ) ) != canonical_input ( INPUT )
+    braced = INPUT.replace ( '"out  a.txt"' , '{out  a.txt}' )
+    assert canonical_input ( braced.replace ( 'out  a.txt' , 'out a.txt' ) ) != canonical_input ( braced )
+    assert '"out  a.txt"' in canonical_input ( INPUT )
@@ -0,0 +1,54 @@
+import pytest
+
+from simpson_gui.core.sequence import (DECOUPLING , RECOUPLING , Delay , Phase , PulseId , compress_events , expand ,
+                                       sequence_variables)
+
+BUILDERS = { **RECOUPLING , **DECOUPLING }
+
+
+def _channels(event , spin_rate) :
+    """
+    rf amplitude and phase of every channel, None for a channel without rf or for a delay.
+    """
+    if isinstance ( event , Delay ) :
+        return None
+    channels = [ ]
+    for rf , phase in zip ( event.rf , event.phase ) :
+        amplitude = rf.value ( spin_rate , amplitude=True )
+        degrees = phase.degrees () if isinstance ( phase , Phase ) else phase
+        channels.append ( (round ( amplitude , 6 ) , round ( degrees % 360 , 6 ) % 360) if amplitude else None )
+    return None if not any ( channels ) else tuple ( channels )
+
+
+def timeline(events , spin_rate) :
+    """
+    rf and phases over time: (channels, length in µs) with the consecutive stretches of the same
+    channels joined, and ideal pulses as steps of no length.
+    """
+    steps = [ ]
+    for event in expand ( events ) :
+        channels = _channels ( event , spin_rate )
+        if isinstance ( event , PulseId ) :
+            steps.append ( [ ('pulseid' , channels , round ( event.duration.value ( spin_rate ) , 9 )) , 0.0 ] )
+        elif steps and steps[ -1 ][ 0 ] == channels :
+            steps[ -1 ][ 1 ] += event.duration.value ( spin_rate )
+        else :
+            steps.append ( [ channels , event.duration.value ( spin_rate ) ] )
+    return steps
+
+
+@pytest.mark.parametrize ( 'name' , sorted ( BUILDERS ) )
+@pytest.mark.parametrize ( 'spin_rate' , [ 10000.0 , 12500.0 ] )
+def test_compression_keeps_the_rf_and_phase_timeline(name , spin_rate) :
+    events = BUILDERS[ name ] ().events
+    compressed = compress_events ( events )
+    original , result = timeline ( events , spin_rate ) , timeline ( compressed , spin_rate )
+    assert [ channels for channels , _ in result ] == [ channels for channels , _ in original ]
+    assert [ length for _ , length in result ] == pytest.approx ( [ length for _ , length in original ] )
+    assert len ( expand ( compressed ) ) <= len ( expand ( events ) )
+
+
+def test_compression_keeps_the_phase_variables() :
+    events = BUILDERS[ 'tppm' ] ().events
+    assert sequence_variables ( compress_events ( events ) ) == sequence_variables ( events ) == { 'rf' : '100000' ,
+                                                                                                  'ph' : '15' }
@@ -0,0 +1,35 @@
+import pytest
+
+from simpson_gui.core.cost import input_features
+from simpson_gui.core.nuclei import load_nuclei
+
+SPINSYS = """spinsys {
+    channels 13C
+    nuclei 13C 13C
+    dipole 1 2 -2000 0 0 0
+}
+par {
+    np 32
+    crystal_file zcw20
+}
+"""
+
+PULSEQ = """proc pulseq {} {
+    global par
+    acq_block {
+        delay 10
+    }
+}
+"""
+
+
+def test_features_of_a_full_input() :
+    features = input_features ( SPINSYS + PULSEQ , load_nuclei () )
+    assert features.dimension == 4
+    assert features.n_points == 32 and features.propagators > 0
+
+
+@pytest.mark.parametrize ( 'text' , [ '' , ' ' , PULSEQ , SPINSYS ] )
+def test_partial_inputs_have_no_estimate(text) :
+    with pytest.raises ( ValueError ) :
+        input_features ( text , load_nuclei () )
@@ -0,0 +1,52 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from simpson_gui.core.dipolar import dipolar_constant , euler_angles_between , pairwise_dipolar
+
+Rot = pytest.importorskip ( 'scipy.spatial.transform' ).Rotation
+
+
+def angle_between_vectors(vec1 , vec2) :
+    """
+    The rotation of one pair as the Spinsys page computed it before the angles were batched.
+    """
+    vec1 = vec1 / np.linalg.norm ( vec1 )
+    vec2 = vec2 / np.linalg.norm ( vec2 )
+    cp = np.cross ( vec1 , vec2 )
+    ssc = np.array ( [ [ 0 , -cp[ 2 ] , cp[ 1 ] ] , [ cp[ 2 ] , 0 , -cp[ 0 ] ] , [ -cp[ 1 ] , cp[ 0 ] , 0 ] ] )
+    rot_mat = np.identity ( 3 ) + ssc + np.dot ( ssc , ssc ) / (1 + np.dot ( vec1 , vec2 ))
+    with warnings.catch_warnings () :
+        # scipy warns about the gimbal lock of the pairs along z
+        warnings.simplefilter ( 'ignore' )
+        return Rot.from_matrix ( rot_mat ).as_euler ( 'zyz' , degrees=True )
+
+
+def _same_angles(angles , reference) :
+    return np.abs ( (angles - reference + 180.0) % 360.0 - 180.0 ).max ()
+
+
+def test_angles_match_the_rotation_of_each_pair() :
+    rng = np.random.default_rng ( 1 )
+    vec1 , vec2 = rng.normal ( size=( 500 , 3 ) ) , rng.normal ( size=( 500 , 3 ) )
+    # pairs along z and an orthogonal pair, where scipy puts the whole angle into alpha
+    vec1[ :3 ] = [ [ 0 , 0 , 1 ] , [ 0.3 , 0.4 , 1 ] , [ 1 , 0 , 0 ] ]
+    vec2[ :3 ] = [ [ 0 , 0 , 2 ] , [ 0.6 , 0.8 , 2 ] , [ 0.6 , 0.8 , 0 ] ]
+    reference = np.array ( [ angle_between_vectors ( a , b ) for a , b in zip ( vec1 , vec2 ) ] )
+    assert _same_angles ( euler_angles_between ( vec1 , vec2 ) , reference ) < 1e-6
+
+
+def test_pairwise_dipolar_matches_the_pairs_one_by_one() :
+    rng = np.random.default_rng ( 2 )
+    coords = rng.normal ( size=( 40 , 3 ) ) * 3.0
+    gyr = rng.choice ( [ 42.577 , 10.705 , -4.316 ] , size=40 )
+    pair_data = pairwise_dipolar ( coords , gyr )
+    i , j = pair_data[ 'i' ] , pair_data[ 'j' ]
+    assert len ( i ) == 40 * 39 // 2
+    dist = np.linalg.norm ( coords[ j ] - coords[ i ] , axis=1 )
+    assert pair_data[ 'dist' ] == pytest.approx ( dist )
+    assert pair_data[ 'dip' ] == pytest.approx ( dipolar_constant ( dist , gyr[ i ] , gyr[ j ] ) )
+    reference = np.array ( [ angle_between_vectors ( coords[ a ] , coords[ b ] ) for a , b in zip ( i , j ) ] )
+    angles = np.column_stack ( ( pair_data[ 'alpha' ] , pair_data[ 'beta' ] , pair_data[ 'gamma' ] ) )
+    assert _same_angles ( angles , reference ) < 1e-6
@@ -0,0 +1,42 @@
+import numpy as np
+
+from simpson_gui.core.krylov import krylov_fid
+from simpson_gui.core.nuclei import load_nuclei
+from simpson_gui.core.par import parse_par
+from simpson_gui.core.preview import simulate_fid
+from simpson_gui.core.spinsys import parse_spinsys
+
+# A chain of four spins, small enough for the dense engine
+INPUT = """spinsys {
+    channels 13C
+    nuclei 13C 13C 13C 13C
+    shift 1 10p 60p 0.5 0 20 0
+    shift 2 -5p 40p 0.3 30 60 90
+    shift 3 20p -30p 0 0 0 0
+    dipole 1 2 -2500 0 45 0
+    dipole 2 3 -1500 40 60 0
+    dipole 3 4 -2000 0 90 30
+}
+par {
+    proton_frequency 400e6
+    spin_rate 10000
+    sw 17000
+    np 16
+    crystal_file zcw20
+    gamma_angles 4
+    start_operator Inx
+    detect_operator Inp
+}
+"""
+
+
+def test_fid_converges_to_the_dense_engine() :
+    spin_system , par , nuclei = parse_spinsys ( INPUT ) , parse_par ( INPUT ) , load_nuclei ()
+    _ , dense = simulate_fid ( spin_system , par , nuclei , maxdt=1e-5 )
+    errors = [ ]
+    for n_vectors in ( 1 , 16 ) :
+        time , fid = krylov_fid ( spin_system , par , nuclei , maxdt=1e-5 , n_vectors=n_vectors )
+        errors.append ( np.abs ( fid - dense ).max () / np.abs ( dense ).max () )
+    assert np.allclose ( time , np.arange ( 16 ) / 17000.0 )
+    # the random vectors add an error falling as 1 / sqrt(n_vectors)
+    assert errors[ 1 ] < 0.03 and errors[ 1 ] < 0.5 * errors[ 0 ]
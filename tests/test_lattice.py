@@ -0,0 +1,38 @@
+import io
+
+import numpy as np
+
+from simpson_gui.core.lattice import read_cif
+
+# A sugar fragment: primed labels, a quoted symmetry operation and a quoted value with spaces
+CIF = """data_sugar
+_cell_length_a 5.0
+_cell_length_b 6.0
+_cell_length_c 7.0
+_cell_angle_alpha 90
+_cell_angle_beta 90
+_cell_angle_gamma 90
+_symmetry_space_group_name_H-M 'P 1 21 1'
+loop_
+_symmetry_equiv_pos_as_xyz
+'x, y, z'
+'-x, y+1/2, -z'
+loop_
+_atom_site_label
+_atom_site_type_symbol
+_atom_site_fract_x
+_atom_site_fract_y
+_atom_site_fract_z
+C1' C 0.1 0.2 0.3
+O4' O 0.15(2) 0.25 0.35
+H1'' H 0.2 0.1 0.4
+"""
+
+
+def test_primed_labels() :
+    atoms , fractional , lattice = read_cif ( io.StringIO ( CIF ) )
+    plain_atoms , plain_fractional , _ = read_cif ( io.StringIO ( CIF.replace ( "'' H" , ' H' ).replace ( "' " , ' ' ) ) )
+    assert list ( atoms ) == list ( plain_atoms )
+    assert sorted ( atoms ) == [ 'C' , 'C' , 'H' , 'H' , 'O' , 'O' ]
+    assert np.allclose ( fractional , plain_fractional )
+    assert np.allclose ( np.diag ( lattice ) , [ 5.0 , 6.0 , 7.0 ] )
@@ -0,0 +1,47 @@
+import numpy as np
+
+from simpson_gui.core.nuclei import load_nuclei
+from simpson_gui.core.par import parse_par
+from simpson_gui.core.partition import split_clusters
+from simpson_gui.core.preview import simulate_fid
+from simpson_gui.core.shard import merge_results
+from simpson_gui.core.spinsys import parse_spinsys
+from simpson_gui.core.sweep import read_xreim
+
+# Spins 1 and 2 coupled, spin 3 on its own: two clusters
+INPUT = """spinsys {
+    channels 13C
+    nuclei 13C 13C 13C
+    shift 1 10p 20p 0.5 0 0 0
+    shift 3 -15p 5p 0.2 0 0 0
+    dipole 1 2 -2000 0 30 0
+}
+par {
+    proton_frequency 400e6
+    spin_rate 10000
+    sw spin_rate
+    np 16
+    crystal_file zcw20
+    gamma_angles 4
+    start_operator Inx
+    detect_operator Inp
+}
+"""
+
+
+def _xreim(x , data) :
+    return ''.join ( f"{a:.12g} {value.real:.12g} {value.imag:.12g}\n" for a , value in zip ( x , data ) )
+
+
+def _preview(text) :
+    return simulate_fid ( parse_spinsys ( text ) , parse_par ( text ) , load_nuclei () )
+
+
+def test_cluster_results_add_up_to_the_whole_spin_system() :
+    shards = split_clusters ( INPUT )
+    # each cluster is weighted by the dimension of the spins it leaves out
+    assert [ shard.weight for shard in shards ] == [ 2.0 , 4.0 ]
+    _ , full = _preview ( INPUT )
+    outputs = [ _xreim ( *_preview ( shard.text ) ) for shard in shards ]
+    _ , merged = read_xreim ( merge_results ( shards , outputs ) )
+    assert np.abs ( merged - full ).max () < 1e-8 * np.abs ( full ).max ()
@@ -0,0 +1,52 @@
+import math
+
+import numpy as np
+import pytest
+
+from simpson_gui.core.powder import ZCW_CONSTANTS , crystal_file_angles , zcw_angles
+
+# The zcw crystal files shipped with SIMPSON, each one short of a Fibonacci number
+SIMPSON_ZCW = ( 20 , 33 , 54 , 88 , 143 , 232 , 376 , 609 , 986 , 1596 , 2583 , 4180 , 6764 , 10945 , 17710 , 28656 )
+
+
+def eden_levitt(n , zcw_type=1) :
+    """
+    ZCW set written out point by point (Eden & Levitt, J. Magn. Reson. 132 (1998) 220): N = g_M
+    is the Fibonacci number above n and j runs from 1 to N - 1, leaving out the pole, as in SIMPSON.
+    """
+    fibonacci = [ 8 , 13 ]
+    while fibonacci[ -1 ] < n + 1 :
+        fibonacci.append ( fibonacci[ -1 ] + fibonacci[ -2 ] )
+    assert fibonacci[ -1 ] == n + 1
+    big , small = fibonacci[ -1 ] , fibonacci[ -3 ]
+    c1 , c2 , c3 = ZCW_CONSTANTS[ zcw_type ]
+    points = [ ]
+    for j in range ( 1 , big ) :
+        beta = math.degrees ( math.acos ( c1 * (c2 * math.fmod ( j / big , 1.0 ) - 1.0) ) )
+        alpha = 360.0 / c3 * math.fmod ( j * small / big , 1.0 )
+        points.append ( ( alpha , beta ) )
+    return np.array ( points ).T
+
+
+@pytest.mark.parametrize ( 'n' , SIMPSON_ZCW )
+def test_zcw_sets_match_the_simpson_sets(n) :
+    alpha , beta , weights = crystal_file_angles ( f"zcw{n}" )
+    reference_alpha , reference_beta = eden_levitt ( n )
+    assert len ( alpha ) == n
+    assert alpha == pytest.approx ( reference_alpha , abs=1e-9 )
+    assert beta == pytest.approx ( reference_beta , abs=1e-9 )
+    assert weights == pytest.approx ( np.full ( n , 1.0 / n ) )
+
+
+def test_first_point_of_zcw20() :
+    alpha , beta , _ = zcw_angles ( 20 )
+    assert alpha[ 0 ] == pytest.approx ( 360.0 * 8 / 21 )
+    assert beta[ 0 ] == pytest.approx ( math.degrees ( math.acos ( 2 / 21 - 1 ) ) )
+
+
+@pytest.mark.parametrize ( 'zcw_type' , [ 0.5 , 0.25 ] )
+def test_hemisphere_and_octant(zcw_type) :
+    alpha , beta , _ = zcw_angles ( 232 , zcw_type )
+    reference_alpha , reference_beta = eden_levitt ( 232 , zcw_type )
+    assert alpha == pytest.approx ( reference_alpha , abs=1e-9 )
+    assert beta == pytest.approx ( reference_beta , abs=1e-9 )
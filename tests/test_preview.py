@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from simpson_gui.core.nuclei import load_nuclei
+from simpson_gui.core.par import parse_par
+from simpson_gui.core.preview import acquisition , crystallites , parse_operator , simulate_fid , spin_hamiltonian
+from simpson_gui.core.spinsys import parse_spinsys
+
+linalg = pytest.importorskip ( 'scipy.linalg' )
+Rot = pytest.importorskip ( 'scipy.spatial.transform' ).Rotation
+
+SPINSYS = """spinsys {
+    channels 13C
+    nuclei 13C 13C
+    shift 1 10p 60p 0.5 0 20 0
+    shift 2 -5p 40p 0.3 30 60 90
+    dipole 1 2 -2500 0 45 0
+}
+"""
+
+PAR = """par {
+    proton_frequency 400e6
+    spin_rate 10000
+    sw %s
+    np 10
+    crystal_file zcw20
+    gamma_angles 4
+    start_operator Inx
+    detect_operator Inp
+}
+"""
+
+
+def brute_force_fid(spin_system , par , nuclei , maxdt) :
+    """
+    The FID crystallite by crystallite, with the Hamiltonian at the middle of every step built from the
+    field direction in the crystal frame and each step propagator taken with expm.
+    """
+    proton_frequency , spin_rate , rotor_angle , n_points , dwell = acquisition ( par )
+    h_iso , tensors , operators = spin_hamiltonian ( spin_system , proton_frequency , nuclei )
+    rho0 = parse_operator ( par[ 'start_operator' ] , len ( spin_system.nuclei ) )
+    detect = parse_operator ( par[ 'detect_operator' ] , len ( spin_system.nuclei ) )
+    n_steps = int ( np.ceil ( dwell / maxdt - 1e-9 ) )
+    dt = dwell / n_steps
+    theta = np.radians ( rotor_angle )
+    fid = np.zeros ( n_points , dtype=complex )
+    for alpha , beta , gamma , weight in zip ( *crystallites ( par ) ) :
+        rotation = Rot.from_euler ( 'ZY' , [ alpha , beta ] , degrees=True ).as_matrix ()
+        rho = rho0
+        for point in range ( n_points ) :
+            fid[ point ] += weight * np.trace ( detect @ rho )
+            for step in range ( n_steps ) :
+                phase = np.radians ( gamma ) + 2 * np.pi * spin_rate * (point * dwell + (step + 0.5) * dt)
+                field = rotation @ [ np.sin ( theta ) * np.cos ( phase ) , np.sin ( theta ) * np.sin ( phase ) ,
+                                       np.cos ( theta ) ]
+                hamiltonian = h_iso + sum ( field @ tensor @ field * operator
+                                            for tensor , operator in zip ( tensors , operators ) )
+                propagator = linalg.expm ( -2j * np.pi * dt * hamiltonian )
+                rho = propagator @ rho @ propagator.conj ().T
+    return fid
+
+
+# rotor synchronised (two dwell times per period), and not synchronised. With 12 steps per rotor
+# period, a multiple of the gamma angles, both step at the same times as the brute force
+@pytest.mark.parametrize ( 'sw' , [ '20000' , '17000' ] )
+def test_fid_matches_step_by_step_propagation(sw) :
+    text = SPINSYS + PAR % sw
+    spin_system , par , nuclei = parse_spinsys ( text ) , parse_par ( text ) , load_nuclei ()
+    maxdt = 1.0 / 120000
+    _ , fid = simulate_fid ( spin_system , par , nuclei , maxdt=maxdt )
+    reference = brute_force_fid ( spin_system , par , nuclei , maxdt )
+    assert np.abs ( fid - reference ).max () < 1e-8 * np.abs ( reference ).max ()
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+from simpson_gui.core.render import write_inputs
+
+SPINSYS = "spinsys {\n    channels 13C\n    nuclei 13C\n}\n"
+
+
+def test_inputs_are_written(tmp_path) :
+    paths = write_inputs ( [ { 'name' : 'one' , 'spinsys' : SPINSYS } , { 'name' : 'two' , 'par' : { 'np' : 8 } } ] ,
+                           str ( tmp_path ) )
+    assert [ os.path.basename ( path ) for path in paths ] == [ 'one.in' , 'two.in' ]
+    assert sorted ( os.listdir ( tmp_path ) ) == [ 'one.in' , 'two.in' ]
+    assert 'nuclei 13C' in ( tmp_path / 'one.in' ).read_text ()
+
+
+def test_a_failing_spec_writes_nothing(tmp_path) :
+    ( tmp_path / 'good.in' ).write_text ( 'previous run\n' )
+    # the second spec has an unknown section and fails to render after the first one
+    specs = [ { 'name' : 'good' , 'spinsys' : SPINSYS } , { 'name' : 'bad' , 'spinsys' : SPINSYS , 'pars' : '' } ]
+    with pytest.raises ( ValueError ) :
+        write_inputs ( specs , str ( tmp_path ) )
+    assert os.listdir ( tmp_path ) == [ 'good.in' ]
+    assert ( tmp_path / 'good.in' ).read_text () == 'previous run\n'
@@ -0,0 +1,70 @@
+import stat
+import time
+
+import pytest
+
+from simpson_gui.core.cache import ResultCache
+from simpson_gui.core.runner import SimpsonRunner
+
+# Stands in for SIMPSON: prints progress lines and saves <input name>.xreim next to the input,
+# or fails when the input asks for it
+STAND_IN = """#!/bin/sh
+if [ "$1" = "-v" ] ; then echo "SIMPSON version 0.0-test" ; exit 0 ; fi
+stem="${1%.in}"
+grep -q fail "$1" && { echo "Error: asked to fail" ; exit 3 ; }
+printf 'Crystallite 1/2\\rCrystallite 2/2\\n'
+ls > "$stem.files"
+printf '0 1 0\\n1 0.5 0.25\\n' > "$stem.xreim"
+"""
+
+
+def _wait(job , timeout=30) :
+    start = time.monotonic ()
+    while not job.finished :
+        if time.monotonic () - start > timeout :
+            raise TimeoutError ( job.name )
+        time.sleep ( 0.01 )
+    return job
+
+
+@pytest.fixture
+def simpson(tmp_path) :
+    path = tmp_path / 'simpson'
+    path.write_text ( STAND_IN )
+    path.chmod ( path.stat ().st_mode | stat.S_IXUSR )
+    return str ( path )
+
+
+def test_job_runs_and_collects_outputs(simpson) :
+    runner = SimpsonRunner ( max_workers=1 )
+    job = _wait ( runner.submit ( 'test run' , 'par { np 2 }\n' , executable=simpson ,
+                                  files={ 'powder.cry' : '2\n0 0 0.5\n90 90 0.5\n' } ) )
+    assert job.state == 'done' and job.returncode == 0
+    assert job.progress == 1.0
+    assert list ( job.log ) == [ 'Crystallite 1/2' , 'Crystallite 2/2' ]
+    # the input and the files given with it sit together in the working directory, only new files come back
+    assert sorted ( job.outputs ) == [ 'test_run.files' , 'test_run.xreim' ]
+    assert { b'powder.cry' , b'test_run.in' } <= set ( job.outputs[ 'test_run.files' ].split () )
+    assert job.outputs[ 'test_run.xreim' ] == b'0 1 0\n1 0.5 0.25\n'
+
+
+def test_failed_run(simpson) :
+    job = _wait ( SimpsonRunner ( max_workers=1 ).submit ( 'broken' , 'fail\n' , executable=simpson ) )
+    assert job.state == 'failed' and job.returncode == 3
+    assert 'Error: asked to fail' in job.log
+
+
+def test_missing_executable(tmp_path) :
+    with pytest.raises ( ValueError ) :
+        SimpsonRunner ().submit ( 'x' , '' , executable=str ( tmp_path / 'no_simpson' ) )
+
+
+def test_cached_result_is_renamed(simpson , tmp_path) :
+    runner = SimpsonRunner ( max_workers=1 , cache=ResultCache ( str ( tmp_path / 'cache' ) ) )
+    first = _wait ( runner.submit ( 'first' , 'par {\n np 2\n}\n' , executable=simpson ) )
+    assert not first.cached
+    # the same input with another layout is found in the cache and not run again
+    second = runner.submit ( 'second' , '# same input\npar {\n    np   2 ;# points\n}\n' , executable=simpson )
+    assert second.cached and second.state == 'done'
+    assert second.outputs[ 'second.xreim' ] == first.outputs[ 'first.xreim' ]
+    assert not second.log
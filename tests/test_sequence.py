@@ -0,0 +1,27 @@
+import pytest
+
+from simpson_gui.core.sequence import DECOUPLING , RECOUPLING , Phase , pulseq_code , sequence_variables
+from simpson_gui.core.sweep import apply_value
+
+BUILDERS = { **RECOUPLING , **DECOUPLING }
+
+
+@pytest.mark.parametrize ( 'phase , tcl , degrees' , [ ( Phase ( 15 ) , '$ph' , 15 ) ,
+                                                       ( Phase ( 15 ) + 180 , '[expr $ph+180]' , 195 ) ,
+                                                       ( -Phase ( 15 ) - 5 , '[expr -$ph-5]' , -20 ) ,
+                                                       ( Phase ( 15 ) * -1 , '[expr -$ph]' , -15 ) ,
+                                                       ( Phase ( 10 , name='ph2' ) + 30 , '[expr $ph2+30]' , 40 ) ] )
+def test_phases_are_written_with_their_variable(phase , tcl , degrees) :
+    assert phase.tcl () == tcl
+    assert phase.degrees () == pytest.approx ( degrees )
+
+
+@pytest.mark.parametrize ( 'name' , sorted ( BUILDERS ) )
+def test_compiled_sequences_can_be_swept(name) :
+    code , _ = pulseq_code ( name , 1.0 , 10000.0 , 20000.0 )
+    variables = sequence_variables ( BUILDERS[ name ] ().events )
+    assert 'rf' in variables
+    for variable in variables :
+        swept = apply_value ( code , f"set.{variable}" , 123 )
+        assert f"set {variable} 123\n" in swept
+        assert f"${variable}" in swept.split ( f"set {variable} 123\n" , 1 )[ 1 ]
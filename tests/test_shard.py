@@ -0,0 +1,75 @@
+import io
+
+import numpy as np
+import pytest
+
+from simpson_gui.core.nuclei import load_nuclei
+from simpson_gui.core.par import parse_par
+from simpson_gui.core import preview
+from simpson_gui.core.shard import merge_results , split_input
+from simpson_gui.core.spinsys import parse_spinsys
+from simpson_gui.core.sweep import read_xreim
+
+INPUT = """spinsys {
+    channels 13C
+    nuclei 13C 13C 13C
+    shift 1 10p 20p 0.5 0 0 0
+    shift 3 -15p 5p 0.2 0 0 0
+    dipole 1 2 -2000 0 30 0
+}
+par {
+    proton_frequency 400e6
+    spin_rate 10000
+    sw spin_rate
+    np 16
+    crystal_file zcw20
+    gamma_angles 4
+    start_operator Inx
+    detect_operator Inp
+}
+"""
+
+
+def _xreim(x , data) :
+    return ''.join ( f"{a:.12g} {value.real:.12g} {value.imag:.12g}\n" for a , value in zip ( x , data ) )
+
+
+def _preview(text) :
+    return preview.simulate_fid ( parse_spinsys ( text ) , parse_par ( text ) , load_nuclei () )
+
+
+def test_crystallite_shards_are_weighted_by_their_share_of_the_powder() :
+    weights = np.array ( [ 1.0 , 2.0 , 3.0 , 4.0 , 5.0 ] )
+    angles = ( np.zeros ( 5 ) , np.linspace ( 0 , 90 , 5 ) , weights )
+    shards = split_input ( INPUT , 2 , angles=angles )
+    # crystallites 0, 2, 4 and 1, 3
+    assert [ shard.weight for shard in shards ] == pytest.approx ( [ 9 / 15 , 6 / 15 ] )
+    x = np.arange ( 4.0 )
+    results = [ np.full ( 4 , 1 + 1j ) , np.full ( 4 , 2 - 1j ) ]
+    merged_x , merged = read_xreim ( merge_results ( shards , [ _xreim ( x , data ) for data in results ] ) )
+    assert merged_x == pytest.approx ( x )
+    assert merged == pytest.approx ( 9 / 15 * results[ 0 ] + 6 / 15 * results[ 1 ] )
+
+
+def test_shard_results_add_up_to_the_whole_powder(monkeypatch) :
+    shards = split_input ( INPUT , 3 )
+    tables = { name[ :-4 ] : np.loadtxt ( io.StringIO ( content ) , skiprows=1 , ndmin=2 )
+               for shard in shards for name , content in shard.files.items () }
+    generated = preview.crystal_file_angles
+    # the preview reads the crystal file each shard writes next to its input
+    monkeypatch.setattr ( preview , 'crystal_file_angles' , lambda name : (
+        ( tables[ name ][ : , 0 ] , tables[ name ][ : , 1 ] , tables[ name ][ : , -1 ] ) if name in tables
+        else generated ( name ) ) )
+    _ , full = _preview ( INPUT )
+    outputs = [ _xreim ( *_preview ( shard.text ) ) for shard in shards ]
+    _ , merged = read_xreim ( merge_results ( shards , outputs ) )
+    assert np.abs ( merged - full ).max () < 1e-8 * np.abs ( full ).max ()
+
+
+def test_merge_needs_every_result_with_the_same_points() :
+    shards = split_input ( INPUT , 2 , angles=( np.zeros ( 2 ) , np.zeros ( 2 ) , np.ones ( 2 ) ) )
+    with pytest.raises ( ValueError ) :
+        merge_results ( shards , [ _xreim ( [ 0 ] , [ 1 ] ) , None ] )
+    with pytest.raises ( ValueError ) :
+        merge_results ( shards , [ _xreim ( [ 0 ] , [ 1 ] ) , _xreim ( [ 0 , 1 ] , [ 1 , 1 ] ) ] )
+